@@ -1,37 +1,23 @@
 #!/bin/bash
-KSQL_SERVER="http://localhost:8088"
+# Export every stream/table/query definition through the REST API: ksql-linage.py --deep
+# runs DESCRIBE ... EXTENDED and EXPLAIN concurrently instead of one ksql CLI round trip each.
+KSQL_SERVER="${KSQL_SERVER:-http://localhost:8088}"
 OUTPUT_FILE="ksql_definitions.sql"
-TEMP_FILE="temp_output.txt"
-
-# Initialize the output file
-> "$OUTPUT_FILE"
-
-# Create a temporary SQL script
-> temp_script.sql
-
-# Get streams
-streams=$(ksql $KSQL_SERVER --execute "SHOW STREAMS;" | grep -vE "Stream Name|===" | awk '{print $1}' | grep -v '^$')
-
-# Add DESCRIBE for each stream
-for stream in $streams; do
-    echo "DESCRIBE $stream;" >> temp_script.sql
-done
-
-# Get queries
-query_ids=$(ksql $KSQL_SERVER --execute "SHOW QUERIES;" | grep -vE "Query ID|===" | awk '{print $1}' | grep -v '^$')
-
-# Add EXPLAIN for each query
-for query_id in $query_ids; do
-    echo "EXPLAIN $query_id;" >> temp_script.sql
-done
-
-# Run the script and capture output
-ksql $KSQL_SERVER < temp_script.sql > "$TEMP_FILE"
-
-# Extract only the Statement and Query String lines, removing decorative borders
-grep -E "Statement\s*:|Query String\s*:" "$TEMP_FILE" | sed 's/.*Statement\s*:\s*//;s/.*Query String\s*:\s*//' | sed '/^$/d' | sed 's/$/;/' >> "$OUTPUT_FILE"
-
-# Clean up
-rm temp_script.sql "$TEMP_FILE"
+WORKERS="${KSQL_WORKERS:-16}"
+
+# Credentials come from KSQL_USERNAME/KSQL_PASSWORD or KSQL_API_KEY/KSQL_API_SECRET when set
+lineage_args=(--url "$KSQL_SERVER" --deep --workers "$WORKERS" --export-sql "$OUTPUT_FILE" --log-level WARNING)
+if [ -n "$KSQL_USERNAME" ]; then
+    lineage_args+=(--username "$KSQL_USERNAME" --password "$KSQL_PASSWORD")
+elif [ -n "$KSQL_API_KEY" ]; then
+    lineage_args+=(--api-key "$KSQL_API_KEY" --api-secret "$KSQL_API_SECRET")
+fi
+
+python3 "$(dirname "$0")/ksql-linage.py" "${lineage_args[@]}"
+status=$?
+if [ $status -ne 0 ]; then
+    echo "Definition export failed (exit status $status)" >&2
+    exit $status
+fi
 
 echo "Stream and query definitions exported to $OUTPUT_FILE"
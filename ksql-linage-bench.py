@@ -0,0 +1,703 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def load_lineage_module():
+    """Import ksql-linage.py (hyphenated, so not importable by name)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ksql-linage.py')
+    spec = importlib.util.spec_from_file_location('ksql_linage', path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so the parser process pool can pickle its worker function by module name
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# The regex extraction ksql-linage.py used before the tokenizer, kept as the baseline
+LEGACY_CREATE_PATTERNS = [
+    r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+AS\s+SELECT\s+.*?\s+FROM\s+(\w+)',
+    r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+WITH\s+.*?AS\s+SELECT\s+.*?\s+FROM\s+(\w+)',
+    r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+AS\s+SELECT\s+.*?\s+FROM\s+(\w+)\s+',
+]
+LEGACY_INSERT_PATTERNS = [
+    r'INSERT\s+INTO\s+(\w+)\s+SELECT\s+.*?\s+FROM\s+(\w+)',
+    r'INSERT\s+INTO\s+(\w+)\s+SELECT\s+.*?\s+FROM\s+(\w+)\s+',
+]
+
+
+def legacy_regex_dependencies(sql: str, query_id: str):
+    """Regex dependency extraction as shipped before the tokenizer (prints removed)"""
+    dependencies = []
+    sql_upper = ' '.join(sql.split()).upper()
+    for pattern in LEGACY_CREATE_PATTERNS:
+        for object_type, target, source in re.findall(pattern, sql_upper, re.IGNORECASE | re.DOTALL):
+            dependencies.append({"source": source, "target": target, "query_id": query_id,
+                                 "type": f"CREATE_{object_type}"})
+    for pattern in LEGACY_INSERT_PATTERNS:
+        for target, source in re.findall(pattern, sql_upper, re.IGNORECASE | re.DOTALL):
+            dependencies.append({"source": source, "target": target, "query_id": query_id,
+                                 "type": "INSERT_INTO"})
+    if not dependencies:
+        for object_type, name in re.findall(r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+WITH\s*\(', sql_upper):
+            dependencies.append({"source": "EXTERNAL_SOURCE", "target": name, "query_id": query_id,
+                                 "type": f"SOURCE_{object_type}"})
+    return dependencies
+
+
+def synthetic_statement(index: int, columns: int, joins: int):
+    """A CSAS/CTAS/INSERT statement with a long projection and `joins` JOIN inputs
+
+    Every fourth statement reads from a back-quoted source, as mixed-case
+    topic-derived names do in practice.
+    """
+    projection = ',\n    '.join(
+        f"CASE WHEN s.COL_{c} > {c} THEN UCASE(s.NAME_{c}) ELSE 'from_{c}' END AS OUT_{c}"
+        for c in range(columns))
+    join_sql = ''.join(f"\n  LEFT JOIN LOOKUP_{index}_{j} l{j} WITHIN 1 HOUR ON s.ID = l{j}.ID"
+                       for j in range(joins))
+    source = f"`Source_{index}`" if index % 4 == 3 else f"SOURCE_{index}"
+    body = f"SELECT\n    {projection}\n  FROM {source} s{join_sql}\n  WHERE s.ID IS NOT NULL\n  EMIT CHANGES"
+    kind = index % 3
+    if kind == 0:
+        return f"CREATE STREAM DERIVED_{index} WITH (KAFKA_TOPIC='derived_{index}', VALUE_FORMAT='AVRO') AS {body};"
+    if kind == 1:
+        return f"CREATE TABLE AGG_{index} AS {body.replace('WHERE', 'GROUP BY s.ID HAVING COUNT(*) > 0 AND')};"
+    return f"INSERT INTO DERIVED_{index - 2} {body};"
+
+
+def bench_parser(args):
+    """Statements per second: tokenizer/parser vs the legacy regex path"""
+    lineage_module = load_lineage_module()
+    statements = [synthetic_statement(i, args.columns, args.joins) for i in range(args.statements)]
+    total_bytes = sum(len(s) for s in statements)
+
+    def parser_path(sql, query_id):
+        return lineage_module.statement_dependencies(lineage_module.parse_ksql_statement(sql), query_id)
+
+    print("=" * 80)
+    print(f"PARSER BENCHMARK: {len(statements)} statements, {args.columns} columns, "
+          f"{args.joins} joins, avg {total_bytes // len(statements)} bytes")
+    print("=" * 80)
+
+    results = {}
+    for label, func in (('regex', legacy_regex_dependencies), ('tokenizer', parser_path)):
+        best = None
+        edges = 0
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            edges = sum(len(func(sql, f"Q{i}")) for i, sql in enumerate(statements))
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[label] = best
+        print(f"{label:<10} {len(statements) / best:>12,.0f} statements/sec  "
+              f"{total_bytes / best / 1e6:>8.1f} MB/sec  {edges:>8} edges")
+
+    print(f"\nSpeedup: {results['regex'] / results['tokenizer']:.1f}x "
+          f"(expected edges per statement: {1 + args.joins})")
+
+
+def synthetic_dependencies(edges: int, objects: int):
+    """Dependency dicts with freshly built name strings, as the resolver produces them"""
+    for i in range(edges):
+        target = i % objects
+        source = (i * 7 + 1) % objects
+        yield {
+            "source": f"{'STREAM' if source % 3 else 'TABLE'}_ORDERS_ENRICHED_{source}",
+            "target": f"{'STREAM' if target % 3 else 'TABLE'}_ORDERS_ENRICHED_{target}",
+            "query_id": f"CSAS_ORDERS_ENRICHED_{target}_{target + 1000}",
+            "type": "CREATE_STREAM" if target % 3 else "CREATE_TABLE"
+        }
+
+
+def legacy_lineage(dependencies, streams, tables):
+    """The eager three-copies layout: dependencies, typed buckets and query_relationships"""
+    lineage = {"streams": streams, "tables": tables, "dependencies": list(dependencies),
+               "relationships": {"stream_to_stream": [], "stream_to_table": [], "table_to_stream": [],
+                                 "table_to_table": [], "query_relationships": []}}
+    relationships = lineage['relationships']
+    object_types = {name: 'STREAM' for name in streams}
+    object_types.update({name: 'TABLE' for name in tables})
+    for dep in lineage['dependencies']:
+        source_type = object_types.get(dep['source'], 'EXTERNAL')
+        target_type = object_types.get(dep['target'], 'UNKNOWN')
+        bucket = f"{source_type.lower()}_to_{target_type.lower()}"
+        if bucket in relationships:
+            relationships[bucket].append({'source_object': dep['source'], 'target_object': dep['target'],
+                                          'query_id': dep['query_id'], 'relationship_type': dep['type']})
+        relationships['query_relationships'].append({
+            'query_id': dep['query_id'], 'input_object': dep['source'], 'input_type': source_type,
+            'output_object': dep['target'], 'output_type': target_type, 'operation': dep['type']})
+    return lineage
+
+
+def measure(build):
+    """Bytes still allocated by build()'s result, and the peak while building it"""
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def bench_memory(args):
+    """Retained size of the lineage structure: legacy dict copies vs interned arrays"""
+    lineage_module = load_lineage_module()
+    streams = {f"STREAM_ORDERS_ENRICHED_{i}": {} for i in range(args.objects) if i % 3}
+    tables = {f"TABLE_ORDERS_ENRICHED_{i}": {} for i in range(args.objects) if not i % 3}
+
+    def compact():
+        lineage = lineage_module.empty_lineage('bench')
+        lineage['streams'], lineage['tables'] = streams, tables
+        lineage['dependencies'].extend(synthetic_dependencies(args.edges, args.objects))
+        return lineage
+
+    print("=" * 80)
+    print(f"MEMORY BENCHMARK: {args.edges:,} edges over {args.objects:,} objects")
+    print("=" * 80)
+    legacy, legacy_bytes, legacy_peak = measure(
+        lambda: legacy_lineage(synthetic_dependencies(args.edges, args.objects), streams, tables))
+    interned, compact_bytes, compact_peak = measure(compact)
+    for label, retained, peak in (('legacy', legacy_bytes, legacy_peak), ('compact', compact_bytes, compact_peak)):
+        print(f"{label:<10} retained {retained / 1e6:>8.1f} MB  ({retained / args.edges:>6.0f} B/edge)  "
+              f"peak {peak / 1e6:>8.1f} MB")
+    print(f"\nReduction: {legacy_bytes / compact_bytes:.1f}x retained, "
+          f"{len(interned['dependencies'].names):,} interned names")
+
+    legacy_rows = legacy['relationships']['stream_to_table'] + legacy['relationships']['table_to_stream']
+    compact_rows = interned['relationships']['stream_to_table'] + interned['relationships']['table_to_stream']
+    print(f"Typed bucket views match legacy buckets: {legacy_rows == compact_rows}")
+
+
+def bench_export(args):
+    """Wall time and peak traced memory of each streaming export format"""
+    lineage_module = load_lineage_module()
+    lineage = lineage_module.empty_lineage('bench')
+    lineage['streams'] = {f"STREAM_ORDERS_ENRICHED_{i}": {'topic': f"orders_{i}"} for i in range(args.objects) if i % 3}
+    lineage['tables'] = {f"TABLE_ORDERS_ENRICHED_{i}": {'topic': f"orders_{i}"} for i in range(args.objects) if not i % 3}
+    lineage['dependencies'].extend(synthetic_dependencies(args.edges, args.objects))
+    formats = [fmt.strip() for fmt in args.formats.split(',')]
+    base = os.path.join(args.output_dir, 'bench_export')
+
+    print("=" * 80)
+    print(f"EXPORT BENCHMARK: {args.edges:,} edges over {args.objects:,} objects")
+    print("=" * 80)
+    runs = [[fmt] for fmt in formats] + ([formats] if len(formats) > 1 else [])
+    for run in runs:
+        started = time.perf_counter()
+        written = lineage_module.export_lineage_formats(lineage, base, run)
+        elapsed = time.perf_counter() - started
+        # Memory is traced in a second pass; tracemalloc slows allocation-heavy code several-fold
+        tracemalloc.start()
+        lineage_module.export_lineage_formats(lineage, base, run)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        size = sum(os.path.getsize(filename) for filename, _ in written.values())
+        rows = max((count for _, count in written.values()), default=0)
+        print(f"{'+'.join(run):<24} {elapsed:>7.3f}s  {rows:>8,} rows  {size / 1e6:>7.1f} MB written  "
+              f"peak {peak / 1e6:>6.1f} MB")
+    for filename, _ in written.values():
+        os.remove(filename)
+
+
+def generate_catalog(queries: int, streams: int = None, tables: int = None, columns: int = 20,
+                     join_fanin: int = 2, chain_depth: int = 5, seed: int = 1):
+    """Synthetic ksqlDB catalog shaped like SHOW ... EXTENDED / DESCRIBE / EXPLAIN responses
+
+    Objects are spread over chain_depth layers. Layer-0 objects are source
+    streams/tables; every other object is written by a CSAS/CTAS that joins
+    join_fanin objects from the previous layer. Queries beyond the derived
+    object count become INSERT INTO statements.
+    """
+    rng = random.Random(seed)
+    streams = max(1, queries * 2 // 3) if streams is None else streams
+    tables = max(1, queries // 3) if tables is None else tables
+    kinds = ['STREAM'] * streams + ['TABLE'] * tables
+    rng.shuffle(kinds)
+    total = len(kinds)
+    chain_depth = max(1, min(chain_depth, total))
+
+    objects = []
+    layers = [[] for _ in range(chain_depth)]
+    for index, kind in enumerate(kinds):
+        layer = index * chain_depth // total
+        name = f"{kind}_{index:06d}"
+        fields = [{"name": "ID", "schema": {"type": "STRING"}}] + [
+            {"name": f"COL_{c}", "schema": {"type": "BIGINT" if c % 2 else "STRING"}} for c in range(columns)]
+        objects.append({
+            "name": name, "type": kind, "topic": f"{name.lower()}_topic", "keyFormat": "KAFKA",
+            "valueFormat": "AVRO", "fields": fields, "readQueries": [], "writeQueries": [],
+            "statistics": f"messages-per-sec: {rng.uniform(0.5, 500):.2f} total-messages: {rng.randint(1, 10**6)}",
+            "errorStats": "", "layer": layer
+        })
+        layers[layer].append(objects[-1])
+
+    query_descriptions = []
+
+    def select_sql(target, sources):
+        projection = ', '.join(f"s0.COL_{c} AS COL_{c}" for c in range(columns))
+        joins = ''.join(
+            f" LEFT JOIN {source['name']} s{j + 1}"
+            f"{' WITHIN 1 HOUR' if source['type'] == 'STREAM' and sources[0]['type'] == 'STREAM' else ''}"
+            f" ON s0.ID = s{j + 1}.ID" for j, source in enumerate(sources[1:]))
+        group = " GROUP BY s0.ID" if target['type'] == 'TABLE' and sources[0]['type'] == 'STREAM' else ""
+        return f"SELECT s0.ID AS ID, {projection} FROM {sources[0]['name']} s0{joins}{group} EMIT CHANGES"
+
+    def add_query(query_id, target, sources, sql):
+        query_descriptions.append({
+            "id": query_id, "statementText": sql, "sources": [source['name'] for source in sources],
+            "sinks": [target['name']], "sinkKafkaTopics": [target['topic']], "state": "RUNNING",
+            "queryType": "PERSISTENT"
+        })
+        for source in sources:
+            source['readQueries'].append({"id": query_id})
+        target['writeQueries'].append({"id": query_id})
+
+    derived = [obj for obj in objects if obj['layer'] > 0]
+    for number, target in enumerate(derived[:queries]):
+        upstream = layers[target['layer'] - 1]
+        sources = rng.sample(upstream, min(join_fanin, len(upstream)))
+        verb = 'CSAS' if target['type'] == 'STREAM' else 'CTAS'
+        sql = f"CREATE {target['type']} {target['name']} WITH (KAFKA_TOPIC='{target['topic']}') AS " \
+              f"{select_sql(target, sources)};"
+        target['statement'] = sql
+        add_query(f"{verb}_{target['name']}_{number}", target, sources, sql)
+    for obj in objects:
+        if 'statement' not in obj:
+            obj['statement'] = (f"CREATE {obj['type']} {obj['name']} (ID STRING "
+                                f"{'PRIMARY KEY' if obj['type'] == 'TABLE' else 'KEY'}) "
+                                f"WITH (KAFKA_TOPIC='{obj['topic']}', VALUE_FORMAT='AVRO');")
+
+    insert_targets = [obj for obj in derived if obj['type'] == 'STREAM'] or derived or objects
+    for number in range(len(query_descriptions), queries):
+        target = rng.choice(insert_targets)
+        upstream = layers[max(0, target['layer'] - 1)]
+        sources = [rng.choice(upstream)]
+        add_query(f"INSERTQUERY_{number}", target, sources,
+                  f"INSERT INTO {target['name']} {select_sql(target, sources)};")
+
+    # Consumer rates and occasional failures, from their own generator so the catalog shape is unchanged
+    stats_rng = random.Random(seed + 1)
+    for obj in objects:
+        del obj['layer']
+        if obj['readQueries']:
+            obj['statistics'] += (f" consumer-messages-per-sec: {stats_rng.uniform(0.5, 500) * len(obj['readQueries']):.2f}"
+                                  f" consumer-total-messages: {stats_rng.randint(1, 10**6)}")
+            if stats_rng.random() < 0.05:
+                failed = stats_rng.uniform(0.01, 5)
+                obj['errorStats'] = (f"consumer-failed-messages: {int(failed * 3600)} "
+                                     f"consumer-failed-messages-per-sec: {failed:.2f}")
+    return {"objects": objects, "queries": query_descriptions}
+
+
+class StubKsqlServer:
+    """Local /ksql endpoint serving a synthetic catalog with configurable latency and injected faults
+
+    Each request independently gets a 503 with probability error_rate, a dropped
+    connection with drop_rate, or an extra slow_latency seconds with slow_rate.
+    After outage_after requests the server stops answering: every later request
+    hangs for slow_latency seconds and then has its connection dropped.
+    """
+
+    def __init__(self, catalog, latency: float = 0.0, port: int = 0, error_rate: float = 0.0,
+                 drop_rate: float = 0.0, slow_rate: float = 0.0, slow_latency: float = 3.0, seed: int = 1,
+                 outage_after: int = None):
+        self.catalog = catalog
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.outage_after = outage_after
+        self.rng = random.Random(seed)
+        self.faults = {'errors': 0, 'drops': 0, 'slow': 0}
+        self.requests = 0
+        self.by_name = {obj['name']: obj for obj in catalog['objects']}
+        self.by_query = {query['id']: query for query in catalog['queries']}
+        streams = [obj for obj in catalog['objects'] if obj['type'] == 'STREAM']
+        tables = [obj for obj in catalog['objects'] if obj['type'] == 'TABLE']
+        self.show_bodies = {
+            'STREAMS': self._show('source_descriptions', 'sourceDescriptions', streams),
+            'TABLES': self._show('source_descriptions', 'sourceDescriptions', tables),
+            'QUERIES': self._show('query_descriptions', 'queryDescriptions', catalog['queries']),
+        }
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @staticmethod
+    def _show(type_name: str, key: str, entities):
+        return json.dumps([{"@type": type_name, "statementText": "", key: entities}]).encode('utf-8')
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, ksql: str):
+        """(status, body) for one statement"""
+        words = ksql.strip().rstrip(';').split()
+        verb = words[0].upper() if words else ''
+        if verb == 'SHOW' and len(words) > 1 and words[1].upper() in self.show_bodies:
+            return 200, self.show_bodies[words[1].upper()]
+        if verb == 'DESCRIBE' and len(words) > 1 and words[1] in self.by_name:
+            return 200, json.dumps([{"@type": "sourceDescription", "statementText": ksql,
+                                     "sourceDescription": self.by_name[words[1]]}]).encode('utf-8')
+        if verb == 'EXPLAIN' and len(words) > 1 and words[1] in self.by_query:
+            return 200, json.dumps([{"@type": "queryDescription", "statementText": ksql,
+                                     "queryDescription": self.by_query[words[1]]}]).encode('utf-8')
+        return 400, json.dumps({"@type": "statement_error", "error_code": 40001,
+                                "message": f"Unsupported by stub: {ksql}"}).encode('utf-8')
+
+    def pick_fault(self):
+        """None, 'error', 'drop', 'slow' or 'hang' for the next request"""
+        if self.outage_after is not None and self.requests > self.outage_after:
+            return 'hang'
+        roll = self.rng.random()
+        for fault, rate in (('error', self.error_rate), ('drop', self.drop_rate), ('slow', self.slow_rate)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                ksql = json.loads(self.rfile.read(length)).get('ksql', '')
+                server.requests += 1
+                fault = server.pick_fault()
+                if fault in ('error', 'drop', 'slow'):
+                    server.faults[{'error': 'errors', 'drop': 'drops', 'slow': 'slow'}[fault]] += 1
+                if fault == 'hang':
+                    time.sleep(server.slow_latency)
+                if fault in ('drop', 'hang'):
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                if fault == 'slow':
+                    time.sleep(server.slow_latency)
+                if fault == 'error':
+                    status, body = 503, json.dumps({"@type": "generic_error", "error_code": 50300,
+                                                    "message": "Injected fault"}).encode('utf-8')
+                else:
+                    status, body = server.respond(ksql)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/vnd.ksql.v1+json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client timed out or hedged and went away
+                    self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@contextlib.contextmanager
+def lineage_log_level(level: int = logging.WARNING):
+    """Raise the ksql_linage logger to at least level for a timed section, then restore it"""
+    logger = logging.getLogger('ksql_linage')
+    previous = logger.level
+    logger.setLevel(max(level, previous))
+    try:
+        yield
+    finally:
+        logger.setLevel(previous)
+
+
+def run_pipeline(url: str, output_dir: str, formats):
+    """Time each phase of one full run against url; progress logging is off so it doesn't skew timings"""
+    lineage_module = load_lineage_module()
+    timings = {}
+    with lineage_log_level():
+        client = lineage_module.KsqlDBLineageEnhanced(url)
+        lineage = lineage_module.empty_lineage(client.ksql_url)
+
+        started = time.perf_counter()
+        streams, tables, queries = client._fetch_show_results(False, 1, lineage_module.RateLimiter())
+        timings['fetch'] = time.perf_counter() - started
+        for info in streams:
+            lineage['streams'][info['name']] = info
+        for info in tables:
+            lineage['tables'][info['name']] = info
+        for query_id, record in queries:
+            lineage['queries'][query_id] = record
+
+        started = time.perf_counter()
+        parsed = sum(len(client.parse_dependencies_from_sql(query['sql'], query_id))
+                     for query_id, query in lineage['queries'].items())
+        timings['parse'] = time.perf_counter() - started
+
+        statements = [(query_id, query['sql']) for query_id, query in lineage['queries'].items()]
+        started = time.perf_counter()
+        lineage_module.parse_statements(statements, min_parallel=0)
+        timings['parse_pool'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        client.resolve_dependencies(lineage)
+        timings['resolve'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        client._build_relationships(lineage)
+        timings['relationships'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        lineage_module.export_lineage_formats(lineage, os.path.join(output_dir, 'bench'), formats)
+        timings['export'] = time.perf_counter() - started
+        client.transport.close()
+
+    return {
+        "timings": timings,
+        "counts": {"streams": len(lineage['streams']), "tables": len(lineage['tables']),
+                   "queries": len(lineage['queries']), "edges": len(lineage['dependencies']),
+                   "parsed_edges": parsed, "parse_processes": os.cpu_count()},
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def bench_suite_run(args):
+    """Child process of `suite`: one size, fresh interpreter, JSON result on stdout"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        result = run_pipeline(args.url, output_dir, args.formats.split(','))
+    print(json.dumps(result))
+
+
+def bench_suite(args):
+    """fetch/parse/relationships/export timings and peak RSS per catalog size, written as JSON"""
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = {
+        "generated_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "git_revision": git_revision(),
+        "parameters": {"columns": args.columns, "join_fanin": args.join_fanin, "chain_depth": args.chain_depth,
+                       "latency": args.latency, "formats": args.formats},
+        "results": []
+    }
+
+    print("=" * 100)
+    print(f"LINEAGE BENCHMARK SUITE: sizes {sizes}, {args.columns} columns, fan-in {args.join_fanin}, "
+          f"depth {args.chain_depth}, latency {args.latency * 1000:.0f} ms")
+    print("=" * 100)
+    print(f"{'queries':>9} {'edges':>9} {'fetch':>8} {'parse':>8} {'pool':>8} {'resolve':>8} {'relations':>10} "
+          f"{'export':>8} {'peak RSS':>10}")
+    for size in sizes:
+        catalog = generate_catalog(size, columns=args.columns, join_fanin=args.join_fanin,
+                                   chain_depth=args.chain_depth, seed=args.seed)
+        server = StubKsqlServer(catalog, latency=args.latency).start()
+        try:
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), 'suite-run', '--url', server.url,
+                 '--formats', args.formats],
+                capture_output=True, text=True, check=True)
+        finally:
+            server.stop()
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        result['size'] = size
+        report['results'].append(result)
+        t = result['timings']
+        print(f"{size:>9,} {result['counts']['edges']:>9,} {t['fetch']:>7.2f}s {t['parse']:>7.2f}s {t['parse_pool']:>7.2f}s "
+              f"{t['resolve']:>7.2f}s {t['relationships']:>9.2f}s {t['export']:>7.2f}s "
+              f"{result['peak_rss_mb']:>8.1f}MB")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Results written to: {args.output}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Request policies compared by `resilience`: (label, request_policy)
+RESILIENCE_POLICIES = [
+    ('no policy', {'retries': 0, 'min_timeout': float('inf'), 'breaker_threshold': 0}),
+    ('retries + adaptive timeout', {'retries': 3, 'min_timeout': 0.5}),
+    ('retries + timeout + hedge p95', {'retries': 3, 'min_timeout': 0.5, 'hedge_percentile': 95}),
+]
+
+
+def resilience_run(lineage_module, url: str, policy, workers: int, timeout: float):
+    """One deep crawl; returns (seconds, lineage, policy stats)"""
+    client = lineage_module.KsqlDBLineageEnhanced(url, pool_size=workers, timeout=timeout,
+                                                  request_policy=dict(policy))
+    started = time.perf_counter()
+    with lineage_log_level():
+        lineage = client.build_comprehensive_lineage(deep=True, workers=workers)
+    elapsed = time.perf_counter() - started
+    stats = client.transport.summary()
+    client.transport.close()
+    return elapsed, lineage, stats
+
+
+def bench_resilience(args):
+    """Completeness and wall time of deep crawls under injected faults, then fail-fast time during an outage"""
+    lineage_module = load_lineage_module()
+    logging.getLogger('ksql_linage').setLevel(logging.CRITICAL)
+    catalog = generate_catalog(args.queries, columns=args.columns, join_fanin=args.join_fanin,
+                               chain_depth=args.chain_depth, seed=args.seed)
+    expected_objects = len(catalog['objects'])
+    expected_queries = len(catalog['queries'])
+
+    print("=" * 100)
+    print(f"RESILIENCE: {expected_objects} objects, {expected_queries} queries; faults: {args.error_rate:.0%} 503, "
+          f"{args.drop_rate:.0%} dropped, {args.slow_rate:.0%} slow (+{args.slow_latency:.1f}s)")
+    print("=" * 100)
+    print(f"{'policy':<32} {'time':>8} {'objects':>9} {'described':>10} {'explained':>10} {'requests':>9} "
+          f"{'retries':>8} {'hedged':>7} {'failed':>7}")
+    for label, policy in RESILIENCE_POLICIES:
+        server = StubKsqlServer(catalog, latency=args.latency, error_rate=args.error_rate, drop_rate=args.drop_rate,
+                                slow_rate=args.slow_rate, slow_latency=args.slow_latency, seed=args.seed).start()
+        try:
+            elapsed, lineage, stats = resilience_run(lineage_module, server.url, policy, args.workers, args.timeout)
+        finally:
+            server.stop()
+        objects = len(lineage['streams']) + len(lineage['tables'])
+        print(f"{label:<32} {elapsed:>7.2f}s {objects:>4}/{expected_objects:<4} "
+              f"{len(lineage['descriptions']):>5}/{expected_objects:<4} {len(lineage['explains']):>5}/{expected_queries:<4} "
+              f"{server.requests:>9} {stats['retries']:>8} {stats['hedged']:>7} {stats['failed']:>7}")
+
+    outage_after = expected_objects // 2
+    print(f"\nOutage after {outage_after} requests (later requests hang {args.slow_latency:.1f}s, then drop):")
+    for label, policy in RESILIENCE_POLICIES[:2]:
+        server = StubKsqlServer(catalog, latency=args.latency, slow_latency=args.slow_latency,
+                                outage_after=outage_after).start()
+        try:
+            elapsed, _, stats = resilience_run(lineage_module, server.url, policy, args.workers, args.timeout)
+        finally:
+            server.stop()
+        print(f"  {label:<30} gave up after {elapsed:.2f}s and {server.requests} requests "
+              f"(breaker trips: {stats['breaker_trips']})")
+
+
+def bench_stub(args):
+    """Serve a synthetic catalog until interrupted"""
+    catalog = generate_catalog(args.queries, columns=args.columns, join_fanin=args.join_fanin,
+                               chain_depth=args.chain_depth, seed=args.seed)
+    server = StubKsqlServer(catalog, latency=args.latency, port=args.port, error_rate=args.error_rate,
+                            drop_rate=args.drop_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                            seed=args.seed)
+    print(f"Stub ksqlDB serving {len(catalog['objects'])} objects and {len(catalog['queries'])} queries "
+          f"at {server.url} (Ctrl-C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+def add_catalog_arguments(parser):
+    parser.add_argument('--columns', type=int, default=20, help='Projected columns per query (default: 20)')
+    parser.add_argument('--join-fanin', type=int, default=2, help='Sources joined per derived object (default: 2)')
+    parser.add_argument('--chain-depth', type=int, default=5, help='Layers in the pipeline chain (default: 5)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Stub response latency in seconds (default: 0)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the catalog and injected faults (default: 1)')
+
+
+def add_fault_arguments(parser, error_rate=0.0, drop_rate=0.0, slow_rate=0.0):
+    parser.add_argument('--error-rate', type=float, default=error_rate, help=f'Fraction of requests answered 503 (default: {error_rate})')
+    parser.add_argument('--drop-rate', type=float, default=drop_rate, help=f'Fraction of connections dropped without a response (default: {drop_rate})')
+    parser.add_argument('--slow-rate', type=float, default=slow_rate, help=f'Fraction of requests delayed by --slow-latency (default: {slow_rate})')
+    parser.add_argument('--slow-latency', type=float, default=3.0, help='Extra seconds for slow requests (default: 3)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for ksql-linage.py')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    parse_cmd = sub.add_parser('parser', help='Dependency extraction throughput')
+    parse_cmd.add_argument('--statements', type=int, default=2000, help='Statements to parse (default: 2000)')
+    parse_cmd.add_argument('--columns', type=int, default=150, help='Projected columns per statement (default: 150)')
+    parse_cmd.add_argument('--joins', type=int, default=2, help='JOIN inputs per statement (default: 2)')
+    parse_cmd.add_argument('--repeat', type=int, default=3, help='Runs per path, best is reported (default: 3)')
+    parse_cmd.set_defaults(func=bench_parser)
+
+    memory_cmd = sub.add_parser('memory', help='Retained size of the in-memory lineage')
+    memory_cmd.add_argument('--edges', type=int, default=100000, help='Dependency edges (default: 100000)')
+    memory_cmd.add_argument('--objects', type=int, default=20000, help='Distinct objects (default: 20000)')
+    memory_cmd.set_defaults(func=bench_memory)
+
+    export_cmd = sub.add_parser('export', help='Streaming export throughput and memory')
+    export_cmd.add_argument('--edges', type=int, default=100000, help='Dependency edges (default: 100000)')
+    export_cmd.add_argument('--objects', type=int, default=20000, help='Distinct objects (default: 20000)')
+    export_cmd.add_argument('--formats', default='csv,jsonl,dot,graphml', help='Formats to time (default: all)')
+    export_cmd.add_argument('--output-dir', default='.', help='Where temporary export files go (default: .)')
+    export_cmd.set_defaults(func=bench_export)
+
+    suite_cmd = sub.add_parser('suite', help='End-to-end timings and peak RSS against a stub server')
+    suite_cmd.add_argument('--sizes', default='100,10000,100000', help='Comma-separated query counts (default: 100,10000,100000)')
+    suite_cmd.add_argument('--formats', default='csv,jsonl,dot,graphml', help='Export formats to time (default: all)')
+    suite_cmd.add_argument('--output', default='bench_results.json', help='Machine-readable results file (default: bench_results.json)')
+    add_catalog_arguments(suite_cmd)
+    suite_cmd.set_defaults(func=bench_suite)
+
+    suite_run_cmd = sub.add_parser('suite-run', help=argparse.SUPPRESS)
+    suite_run_cmd.add_argument('--url', required=True)
+    suite_run_cmd.add_argument('--formats', default='csv,jsonl,dot,graphml')
+    suite_run_cmd.set_defaults(func=bench_suite_run)
+
+    stub_cmd = sub.add_parser('stub', help='Run the stub ksqlDB server on its own')
+    stub_cmd.add_argument('--queries', type=int, default=1000, help='Queries in the catalog (default: 1000)')
+    stub_cmd.add_argument('--port', type=int, default=8088, help='Port to listen on (default: 8088)')
+    add_catalog_arguments(stub_cmd)
+    add_fault_arguments(stub_cmd)
+    stub_cmd.set_defaults(func=bench_stub)
+
+    resilience_cmd = sub.add_parser('resilience', help='Deep crawls against a fault-injecting stub, per request policy')
+    resilience_cmd.add_argument('--queries', type=int, default=200, help='Queries in the catalog (default: 200)')
+    resilience_cmd.add_argument('--workers', type=int, default=8, help='Concurrent requests (default: 8)')
+    resilience_cmd.add_argument('--timeout', type=float, default=30, help='Read timeout ceiling in seconds (default: 30)')
+    add_catalog_arguments(resilience_cmd)
+    add_fault_arguments(resilience_cmd, error_rate=0.05, drop_rate=0.02, slow_rate=0.02)
+    resilience_cmd.set_defaults(func=bench_resilience)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
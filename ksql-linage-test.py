@@ -0,0 +1,796 @@
+#!/usr/bin/env python3
+"""Repeatable checks for ksql-linage.py
+
+    python3 ksql-linage-test.py            (or: python3 -m pytest -q ksql-linage-test.py)
+
+Request policy checks run against the fault-injecting stub server from
+ksql-linage-bench.py on a local port; nothing else is needed.
+"""
+import contextlib
+import http.client
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+
+def load_script(filename: str, name: str):
+    """Import a hyphenated script from this directory under an importable name"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+bench = load_script('ksql-linage-bench.py', 'ksql_linage_bench')
+ksql_linage = bench.load_lineage_module()
+# Breaker and retry warnings are expected here
+logging.getLogger('ksql_linage').setLevel(logging.CRITICAL)
+
+
+def payload(ksql: str):
+    return json.dumps({"ksql": ksql, "streamsProperties": {}}).encode('utf-8')
+
+
+def sample_lineage(objects, queries=(), edges=()):
+    """Lineage with {name: 'STREAM' | 'TABLE'} objects on <name>_topic, (query_id, sql, sources, sinks) queries
+    and (source, target, query_id) edges"""
+    lineage = ksql_linage.empty_lineage('http://stub/ksql')
+    for name, object_type in objects.items():
+        lineage['streams' if object_type == 'STREAM' else 'tables'][name] = {
+            'name': name, 'topic': f"{name.lower()}_topic", 'format': 'JSON', 'key_format': 'KAFKA'}
+    for query_id, sql, sources, sinks in queries:
+        lineage['queries'][query_id] = {'sql': sql, 'status': 'RUNNING', 'sources': list(sources), 'sinks': list(sinks)}
+    lineage['dependencies'].extend({'source': source, 'target': target, 'query_id': query_id,
+                                    'type': 'CREATE_STREAM'} for source, target, query_id in edges)
+    return lineage
+
+
+class RaisingTransport:
+    """Inner transport failing every request with an error outside TRANSIENT_ERRORS"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def post(self, payload: bytes, timeout: float = None):
+        self.requests += 1
+        raise ValueError('malformed response')
+
+    @contextlib.contextmanager
+    def stream(self, payload: bytes, timeout: float = None):
+        self.requests += 1
+        raise ValueError('malformed response')
+        yield
+
+    def close(self):
+        pass
+
+
+class OkResponse:
+    status = 200
+
+    def read(self, amount: int = None):
+        return b'[]'
+
+
+class BrokenBodyTransport(RaisingTransport):
+    """Inner transport whose stream answers 200 and leaves the body to the caller"""
+
+    @contextlib.contextmanager
+    def stream(self, payload: bytes, timeout: float = None):
+        self.requests += 1
+        yield OkResponse()
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        breaker = ksql_linage.CircuitBreaker(threshold=2, reset_after=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual((breaker.state, breaker.trips), ('open', 1))
+        with self.assertRaises(ksql_linage.CircuitOpenError):
+            breaker.before_request()
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = ksql_linage.CircuitBreaker(threshold=1, reset_after=0)
+        breaker.record_failure()
+        breaker.before_request()
+        self.assertEqual(breaker.state, 'half-open')
+        with self.assertRaises(ksql_linage.CircuitOpenError):
+            breaker.before_request()
+        breaker.record_success()
+        self.assertEqual((breaker.state, breaker.failures, breaker.trial_in_flight), ('closed', 0, False))
+
+    def test_failed_trial_reopens(self):
+        breaker = ksql_linage.CircuitBreaker(threshold=1, reset_after=0)
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual((breaker.state, breaker.trips, breaker.trial_in_flight), ('open', 2, False))
+
+    def test_disabled_breaker_never_opens(self):
+        breaker = ksql_linage.CircuitBreaker(threshold=0)
+        for _ in range(10):
+            breaker.record_failure()
+            breaker.before_request()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_unexpected_error_does_not_leave_breaker_half_open(self):
+        breaker = ksql_linage.CircuitBreaker(threshold=1, reset_after=0)
+        inner = RaisingTransport()
+        transport = ksql_linage.ResilientTransport(inner, retries=0, breaker=breaker)
+        for _ in range(3):
+            # A stuck trial would raise CircuitOpenError instead of reaching the inner transport
+            with self.assertRaises(ValueError):
+                transport.post(payload("SHOW STREAMS EXTENDED;"))
+            self.assertFalse(breaker.trial_in_flight)
+        with self.assertRaises(ValueError):
+            with transport.stream(payload("SHOW STREAMS EXTENDED;")):
+                pass
+        self.assertFalse(breaker.trial_in_flight)
+        self.assertEqual((inner.requests, breaker.trips), (4, 4))
+
+    def test_failure_while_consuming_stream_is_recorded(self):
+        breaker = ksql_linage.CircuitBreaker(threshold=1, reset_after=60)
+        transport = ksql_linage.ResilientTransport(BrokenBodyTransport(), retries=0, breaker=breaker)
+        with self.assertRaises(ConnectionResetError):
+            with transport.stream(payload("SHOW STREAMS EXTENDED;")) as response:
+                response.read()
+                raise ConnectionResetError('body cut off')
+        self.assertEqual((breaker.state, breaker.failures), ('open', 1))
+
+
+class RequestPolicyTest(unittest.TestCase):
+    """Retry and hedge counts against the fault-injecting stub server"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.catalog = bench.generate_catalog(20)
+
+    def start_server(self, **faults):
+        server = bench.StubKsqlServer(self.catalog, **faults).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def client(self, server, **policy):
+        policy.setdefault('backoff_base', 0.001)
+        client = ksql_linage.KsqlDBLineageEnhanced(server.url, request_policy=policy)
+        self.addCleanup(client.transport.close)
+        return client
+
+    def test_retries_until_attempts_run_out(self):
+        server = self.start_server(error_rate=1.0)
+        client = self.client(server, retries=2)
+        self.assertIsNone(client.execute_ksql("SHOW STREAMS EXTENDED;"))
+        stats = client.transport.summary()
+        self.assertEqual((server.requests, stats['retries'], stats['failed']), (3, 2, 1))
+
+    def test_retries_recover_from_injected_errors(self):
+        server = self.start_server(error_rate=0.5, seed=3)
+        client = self.client(server, retries=10)
+        for obj in self.catalog['objects'][:10]:
+            self.assertIsNotNone(client.execute_ksql(f"DESCRIBE {obj['name']} EXTENDED;"))
+        stats = client.transport.summary()
+        self.assertGreater(stats['retries'], 0)
+        self.assertEqual(stats['retries'], server.faults['errors'])
+        self.assertEqual(server.requests, 10 + stats['retries'])
+        self.assertEqual(stats['failed'], 0)
+
+    def test_non_idempotent_statements_are_not_retried(self):
+        server = self.start_server(error_rate=1.0)
+        client = self.client(server, retries=3)
+        status, _ = client.transport.post(payload("TERMINATE CSAS_X_1;"))
+        self.assertEqual((status, server.requests, client.transport.summary()['retries']), (503, 1, 0))
+
+    def slow_once(self, server):
+        """Make only the next request slow, so the hedged copy answers at normal speed"""
+        faults = iter(['slow'])
+        server.pick_fault = lambda: next(faults, None)
+
+    def warm_up(self, client, count: int = 5):
+        # The hedge delay is a latency percentile, known once min_samples requests have completed
+        names = [obj['name'] for obj in self.catalog['objects']]
+        for name in names[:count]:
+            self.assertIsNotNone(client.execute_ksql(f"DESCRIBE {name} EXTENDED;"))
+        return names[count]
+
+    def test_hedge_answers_for_a_slow_primary(self):
+        server = self.start_server(slow_latency=1.0)
+        client = self.client(server, hedge_percentile=50)
+        name = self.warm_up(client)
+        self.slow_once(server)
+        started = time.monotonic()
+        self.assertIsNotNone(client.execute_ksql(f"DESCRIBE {name} EXTENDED;"))
+        self.assertLess(time.monotonic() - started, server.slow_latency)
+        stats = client.transport.summary()
+        self.assertEqual((stats['hedged'], stats['hedge_wins'], server.requests), (1, 1, 7))
+        # Let the losing primary finish so its connection goes back to the pool before close()
+        client.transport._hedge_pool.shutdown(wait=True)
+
+    def test_hedge_is_skipped_when_its_budget_is_spent(self):
+        server = self.start_server(slow_latency=0.5)
+        client = self.client(server, hedge_percentile=50)
+        name = self.warm_up(client)
+        self.slow_once(server)
+        budget = client.transport._hedge_budget
+        self.assertTrue(budget.acquire(blocking=False))
+        try:
+            self.assertIsNotNone(client.execute_ksql(f"DESCRIBE {name} EXTENDED;"))
+        finally:
+            budget.release()
+        stats = client.transport.summary()
+        self.assertEqual((stats['hedged'], stats['hedges_skipped'], server.requests), (0, 1, 6))
+
+
+class TokenizerParserTest(unittest.TestCase):
+
+    def parse(self, sql: str):
+        statement = ksql_linage.parse_ksql_statement(sql)
+        return statement['kind'], statement['sink'], statement['sources']
+
+    def test_every_join_source_once(self):
+        self.assertEqual(self.parse(
+            "CREATE STREAM enriched AS SELECT o.id, c.name FROM orders o JOIN customers c ON o.cid = c.id "
+            "LEFT OUTER JOIN regions r ON c.rid = r.id JOIN orders o2 ON o.id = o2.id EMIT CHANGES;"),
+            ('CREATE_AS', 'ENRICHED', ['ORDERS', 'CUSTOMERS', 'REGIONS']))
+
+    def test_comma_separated_from_list(self):
+        self.assertEqual(self.parse("CREATE STREAM s AS SELECT * FROM a, b WHERE a.x = b.x;"),
+                         ('CREATE_AS', 'S', ['A', 'B']))
+
+    def test_insert_into_with_properties(self):
+        statement = ksql_linage.parse_ksql_statement(
+            "INSERT INTO all_orders WITH (QUERY_ID='INS_1') SELECT * FROM eu_orders EMIT CHANGES;")
+        self.assertEqual((statement['kind'], statement['sink'], statement['sources'], statement['properties']),
+                         ('INSERT', 'ALL_ORDERS', ['EU_ORDERS'], {'QUERY_ID': 'INS_1'}))
+
+    def test_quoted_identifiers_strings_and_comments(self):
+        self.assertEqual(self.parse(
+            "CREATE TABLE `Mixed Case` WITH (KAFKA_TOPIC='t') AS SELECT 'FROM x' AS s, COUNT(*) "
+            "FROM \"Orders\" -- FROM fake\n GROUP BY s EMIT CHANGES;"),
+            ('CREATE_AS', 'Mixed Case', ['Orders']))
+
+    def test_source_definition_is_external(self):
+        statement = ksql_linage.parse_ksql_statement(
+            "CREATE STREAM raw (id INT) WITH (KAFKA_TOPIC='raw', VALUE_FORMAT='JSON');")
+        self.assertEqual(ksql_linage.statement_dependencies(statement, 'Q'), [
+            {'source': 'EXTERNAL_SOURCE', 'target': 'RAW', 'query_id': 'Q', 'type': 'SOURCE_STREAM'}])
+        self.assertEqual(statement['properties'], {'KAFKA_TOPIC': 'raw', 'VALUE_FORMAT': 'JSON'})
+
+    def test_split_ignores_semicolons_in_strings_and_comments(self):
+        statements = list(ksql_linage.split_ksql_statements(
+            "CREATE STREAM a (x VARCHAR) WITH (KAFKA_TOPIC='a;b');\n-- note; here\nINSERT INTO a SELECT * FROM b;"))
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(self.parse(statements[1]), ('INSERT', 'A', ['B']))
+
+
+class MetadataResolutionTest(unittest.TestCase):
+
+    def test_sql_is_parsed_only_without_server_metadata(self):
+        lineage = sample_lineage({'ORDERS': 'STREAM', 'USERS': 'TABLE', 'ENRICHED': 'STREAM', 'COUNTS': 'TABLE',
+                                  'ARCHIVE': 'STREAM'}, [
+            # The metadata wins over SQL that would give a different answer
+            ('CSAS_ENRICHED_1', "CREATE STREAM ENRICHED AS SELECT * FROM ORDERS;", ['ORDERS', 'USERS'], ['ENRICHED']),
+            ('CTAS_COUNTS_2', "", [], []),
+            ('INSERTQUERY_3', "INSERT INTO ARCHIVE SELECT * FROM ENRICHED;", [], []),
+        ])
+        lineage['explains']['CTAS_COUNTS_2'] = {'sources': ['ORDERS'], 'sinks': ['COUNTS']}
+        client = ksql_linage.KsqlDBLineageEnhanced('http://stub')
+        self.addCleanup(client.transport.close)
+        client.resolve_dependencies(lineage)
+        self.assertEqual(sorted(lineage['dependencies'].iter_tuples()), [
+            ('ENRICHED', 'ARCHIVE', 'INSERTQUERY_3', 'INSERT_INTO'),
+            ('ORDERS', 'COUNTS', 'CTAS_COUNTS_2', 'CREATE_TABLE'),
+            ('ORDERS', 'ENRICHED', 'CSAS_ENRICHED_1', 'CREATE_STREAM'),
+            ('USERS', 'ENRICHED', 'CSAS_ENRICHED_1', 'CREATE_STREAM'),
+        ])
+        self.assertEqual(lineage['metadata']['resolution'],
+                         {'cache': 0, 'server_metadata': 1, 'explain': 1, 'sql_parse': 1})
+        self.assertEqual({query_id: query['resolved_by'] for query_id, query in lineage['queries'].items()},
+                         {'CSAS_ENRICHED_1': 'server_metadata', 'CTAS_COUNTS_2': 'explain',
+                          'INSERTQUERY_3': 'sql_parse'})
+
+
+class SnapshotCacheTest(unittest.TestCase):
+
+    def resolve(self, queries, cache=None):
+        lineage = sample_lineage({'A': 'STREAM', 'B': 'STREAM', 'C': 'STREAM', 'D': 'STREAM'},
+                                 [(query_id, sql, [], []) for query_id, sql in queries.items()])
+        client = ksql_linage.KsqlDBLineageEnhanced('http://stub')
+        self.addCleanup(client.transport.close)
+        client.resolve_dependencies(lineage, cache)
+        return lineage
+
+    def test_only_changed_queries_are_reparsed_and_diffed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'cache.json')
+        first = self.resolve({'CSAS_B_1': "CREATE STREAM B AS SELECT * FROM A;",
+                              'CSAS_C_2': "CREATE STREAM C AS SELECT * FROM B;"})
+        cache = ksql_linage.LineageSnapshotCache(path)
+        cache.update(first)
+        cache.save()
+
+        cache = ksql_linage.LineageSnapshotCache.load(path)
+        second = self.resolve({'CSAS_B_1': "CREATE   STREAM B AS\n SELECT * FROM A;",
+                               'CSAS_C_2': "CREATE STREAM C AS SELECT * FROM A;",
+                               'INSERTQUERY_3': "INSERT INTO C SELECT * FROM D;"}, cache)
+        # Reformatting alone keeps the SQL hash, so CSAS_B_1 comes from the cache
+        self.assertEqual(second['metadata']['resolution'],
+                         {'cache': 1, 'server_metadata': 0, 'explain': 0, 'sql_parse': 2})
+        diff = cache.diff(second)
+        self.assertEqual([(edge['source'], edge['target']) for edge in diff['added_edges']], [('A', 'C'), ('D', 'C')])
+        self.assertEqual([(edge['source'], edge['target']) for edge in diff['removed_edges']], [('B', 'C')])
+        self.assertEqual((diff['changed_queries'], diff['added_queries'], diff['terminated_queries']),
+                         (['CSAS_C_2'], ['INSERTQUERY_3'], []))
+
+        cache.update(second)
+        third = self.resolve({'CSAS_C_2': "CREATE STREAM C AS SELECT * FROM A;"}, cache)
+        diff = cache.diff(third)
+        self.assertEqual(diff['terminated_queries'], ['CSAS_B_1', 'INSERTQUERY_3'])
+        self.assertEqual([(edge['source'], edge['target']) for edge in diff['removed_edges']], [('A', 'B'), ('D', 'C')])
+        self.assertEqual(diff['added_edges'], [])
+
+
+class LineageGraphTest(unittest.TestCase):
+
+    @staticmethod
+    def chain(edges):
+        queries = [(query_id, f"SQL {query_id}", [source], [target]) for source, target, query_id in edges]
+        lineage = sample_lineage({'A': 'STREAM', 'B': 'STREAM', 'C': 'TABLE', 'D': 'STREAM', 'E': 'STREAM'},
+                                 queries, edges)
+        for query in lineage['queries'].values():
+            query['sql_hash'] = ksql_linage.sql_fingerprint(query['sql'])
+        return lineage
+
+    def setUp(self):
+        self.lineage = self.chain([('EXTERNAL_SOURCE', 'A', 'SRC'), ('A', 'B', 'Q1'), ('B', 'C', 'Q2'),
+                                   ('C', 'D', 'Q3'), ('A', 'E', 'Q4')])
+        self.graph = ksql_linage.LineageGraph(self.lineage)
+
+    def test_downstream_upstream_and_depth(self):
+        self.assertEqual(self.graph.downstream('a'), {'B': (1, 'A'), 'E': (1, 'A'), 'C': (2, 'B'), 'D': (3, 'C')})
+        self.assertEqual(self.graph.downstream('A', depth=1), {'B': (1, 'A'), 'E': (1, 'A')})
+        self.assertEqual(self.graph.upstream('D'), {'C': (1, 'D'), 'B': (2, 'C'), 'A': (3, 'B')})
+        self.assertEqual(self.graph.via_queries('B', 'C'), ['Q2'])
+
+    def test_impact_starts_at_the_topic_readers(self):
+        self.assertEqual(self.graph.impact('b_topic'), {'B': (0, None), 'C': (1, 'B'), 'D': (2, 'C')})
+        self.assertEqual(self.graph.impact('no_such_topic'), {})
+
+    def test_apply_diff_patches_the_indexes_and_drops_memoized_walks(self):
+        self.assertIn('D', self.graph.downstream('A'))
+        cache = ksql_linage.LineageSnapshotCache('unused.json')
+        cache.update(self.lineage)
+        changed = self.chain([('EXTERNAL_SOURCE', 'A', 'SRC'), ('A', 'B', 'Q1'), ('B', 'C', 'Q2'),
+                              ('E', 'D', 'Q5'), ('A', 'E', 'Q4')])
+        self.graph.apply_diff(changed, cache.diff(changed))
+        self.assertEqual(self.graph.downstream('A'), {'B': (1, 'A'), 'E': (1, 'A'), 'C': (2, 'B'), 'D': (2, 'E')})
+        self.assertEqual(self.graph.upstream('D'), {'E': (1, 'D'), 'A': (2, 'E')})
+
+
+class InternedStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lineage = sample_lineage({'ORDERS': 'STREAM', 'ENRICHED': 'STREAM', 'TOTALS': 'TABLE', 'USERS': 'TABLE',
+                                       'CHANGES': 'STREAM'}, edges=[
+            ('EXTERNAL_SOURCE', 'ORDERS', 'CSAS_ORDERS_0'), ('ORDERS', 'ENRICHED', 'CSAS_ENRICHED_1'),
+            ('USERS', 'ENRICHED', 'CSAS_ENRICHED_1'), ('ENRICHED', 'TOTALS', 'CTAS_TOTALS_2'),
+            ('TOTALS', 'CHANGES', 'CSAS_CHANGES_3'), ('TOTALS', 'USERS', 'CTAS_USERS_4')])
+
+    def test_csv_matches_the_legacy_bucket_rows(self):
+        expected = ['Source,Source_Type,Target,Target_Type,Query_ID,Operation']
+        for bucket, (source_type, target_type) in ksql_linage.RELATIONSHIP_BUCKETS.items():
+            for rel in self.lineage['relationships'][bucket]:
+                expected.append(f"{rel['source_object']},{source_type},{rel['target_object']},{target_type},"
+                                f"{rel['query_id']},{rel['relationship_type']}")
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'lineage')
+            written = ksql_linage.export_lineage_formats(self.lineage, base, ['csv'])
+            with open(f"{base}_relationships.csv", newline='') as f:
+                self.assertEqual(f.read().splitlines(), expected)
+        self.assertEqual(written['csv'][1], 5)
+        self.assertEqual(expected[1], 'ORDERS,STREAM,ENRICHED,STREAM,CSAS_ENRICHED_1,CREATE_STREAM')
+
+    def test_bucket_counts_match_the_views(self):
+        relationships = self.lineage['relationships']
+        self.assertEqual(relationships.counts(), {key: len(relationships[key])
+                                                  for key in ksql_linage.RELATIONSHIP_BUCKETS})
+        self.assertEqual(relationships.counts(), {'stream_to_stream': 1, 'stream_to_table': 1,
+                                                  'table_to_stream': 2, 'table_to_table': 1})
+        self.assertEqual(len(relationships['query_relationships']), 6)
+
+
+class ExportFormatsTest(unittest.TestCase):
+
+    def test_one_pass_writes_every_format(self):
+        lineage = sample_lineage({'ORDERS': 'STREAM', 'TOTALS': 'TABLE'}, edges=[
+            ('EXTERNAL_SOURCE', 'ORDERS', 'CSAS_ORDERS_0'), ('ORDERS', 'TOTALS', 'CTAS_TOTALS_1')])
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'lineage')
+            written = ksql_linage.export_lineage_formats(lineage, base, ['csv', 'jsonl', 'dot', 'graphml'])
+            contents = {}
+            for fmt, (filename, rows) in written.items():
+                self.assertEqual(rows, 1)
+                with open(filename) as f:
+                    contents[fmt] = f.read()
+        self.assertEqual(contents['csv'].splitlines()[1], 'ORDERS,STREAM,TOTALS,TABLE,CTAS_TOTALS_1,CREATE_STREAM')
+        self.assertEqual([json.loads(line) for line in contents['jsonl'].splitlines()], [{
+            'source': 'ORDERS', 'source_type': 'STREAM', 'target': 'TOTALS', 'target_type': 'TABLE',
+            'query_id': 'CTAS_TOTALS_1', 'operation': 'CREATE_STREAM'}])
+        for line in ('"ORDERS" -> "CTAS_TOTALS_1" [label="Query Input"];',
+                     '"CTAS_TOTALS_1" -> "TOTALS" [label="Query Output"];',
+                     '"orders_topic" -> "ORDERS" [label="Stream"];', '"TOTALS" -> "totals_topic" [label="Sink Topic"];'):
+            self.assertIn(line, contents['dot'])
+        self.assertIn('<node id="TOTALS"><data key="type">TABLE</data><data key="topic">totals_topic</data></node>',
+                      contents['graphml'])
+        self.assertIn('<edge source="ORDERS" target="TOTALS"><data key="query_id">CTAS_TOTALS_1</data>',
+                      contents['graphml'])
+        self.assertTrue(contents['graphml'].endswith('</graphml>\n'))
+
+    def test_row_formats_are_skipped_without_rows(self):
+        lineage = sample_lineage({'ORDERS': 'STREAM'})
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'lineage')
+            written = ksql_linage.export_lineage_formats(lineage, base, ['csv', 'jsonl', 'dot'])
+            self.assertEqual(sorted(written), ['dot'])
+            self.assertFalse(os.path.exists(f"{base}_relationships.csv"))
+
+
+class BodyTransport:
+    """Transport answering every request with one fixed 200 body"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    @contextlib.contextmanager
+    def stream(self, payload: bytes, timeout: float = None):
+        response = io.BytesIO(self.body)
+        response.status = 200
+        yield response
+
+    def close(self):
+        pass
+
+
+class ChunkedBody(io.BytesIO):
+    """Response body handing out at most chunk_size bytes per read, whatever the caller asks for"""
+
+    def __init__(self, body: bytes, chunk_size: int):
+        super().__init__(body)
+        self.chunk_size = chunk_size
+
+    def read(self, amount: int = None):
+        return super().read(self.chunk_size)
+
+
+class StreamingResponseTest(unittest.TestCase):
+
+    BODY = json.dumps([{'@type': 'streams', 'statementText': 'SHOW STREAMS;', 'streams': [
+        {'type': 'STREAM', 'name': 'ORDERS', 'topic': 'orders', 'note': 'brackets ] and } and "quotes" in a string'},
+        {'type': 'STREAM', 'name': 'PAYMENTS', 'topic': 'payments'}]}, {'@type': 'warning', 'n': [1, 2.5, None]}])
+
+    def items(self, body, chunk_size):
+        return list(ksql_linage.iter_response_items(ChunkedBody(body.encode('utf-8'), chunk_size)))
+
+    def test_chunk_boundaries_do_not_change_the_events(self):
+        expected = self.items(self.BODY, 65536)
+        self.assertEqual([event[0] for event in expected], ['entity', 'entity', 'item', 'item'])
+        self.assertEqual(expected[2], ('item', {'@type': 'streams', 'statementText': 'SHOW STREAMS;', 'streams': []}))
+        for chunk_size in (1, 2, 7):
+            self.assertEqual(self.items(self.BODY, chunk_size), expected)
+
+    def test_truncated_array_raises(self):
+        for body in ('[{"a": 1}', '[{"a": 1},', '[{"streams": [{"name": "X"}', '[{"a": "unterminated'):
+            with self.assertRaises(ValueError):
+                self.items(body, 1)
+
+    def test_broken_stream_fails_the_request(self):
+        client = ksql_linage.KsqlDBLineageEnhanced('http://stub', transport=BodyTransport(self.BODY[:-30].encode()))
+        self.assertEqual(client._fetch_show_records("SHOW STREAMS;", 'streams', stream=True), [])
+        client = ksql_linage.KsqlDBLineageEnhanced('http://stub', transport=BodyTransport(self.BODY.encode()))
+        records = client._fetch_show_records("SHOW STREAMS;", 'streams', stream=True)
+        self.assertEqual([record['name'] for record in records], ['ORDERS', 'PAYMENTS'])
+
+
+class RecordReplayTest(unittest.TestCase):
+
+    @staticmethod
+    def comparable(lineage):
+        return ({bucket: lineage[bucket] for bucket in ('streams', 'tables', 'queries')},
+                sorted(lineage['dependencies'].iter_tuples()))
+
+    def test_replay_rebuilds_the_recorded_lineage(self):
+        server = bench.StubKsqlServer(bench.generate_catalog(20)).start()
+        self.addCleanup(server.stop)
+        recording = tempfile.TemporaryDirectory()
+        self.addCleanup(recording.cleanup)
+
+        client = ksql_linage.KsqlDBLineageEnhanced(server.url)
+        client.transport = ksql_linage.RecordingTransport(client.transport, recording.name, client.ksql_url)
+        recorded = client.build_comprehensive_lineage(deep=True, workers=4)
+        client.transport.close()
+        requests = server.requests
+
+        transport = ksql_linage.ReplayTransport(recording.name)
+        self.assertEqual(transport.ksql_url, f"{server.url}/ksql")
+        replayed = ksql_linage.KsqlDBLineageEnhanced('http://offline', transport=transport).build_comprehensive_lineage(
+            deep=True, workers=4)
+        self.assertEqual(server.requests, requests)
+        self.assertTrue(recorded['dependencies'])
+        self.assertEqual(self.comparable(replayed), self.comparable(recorded))
+
+
+class FederationTest(unittest.TestCase):
+
+    def test_shared_topic_stitches_clusters(self):
+        east = sample_lineage({'ORDERS': 'STREAM', 'ENRICHED': 'STREAM'}, [
+            ('CSAS_ENRICHED_1', 'CREATE STREAM ENRICHED AS SELECT * FROM ORDERS;', ['ORDERS'], ['ENRICHED'])], [
+            ('EXTERNAL_SOURCE', 'ORDERS', 'CSAS_ORDERS_0'), ('ORDERS', 'ENRICHED', 'CSAS_ENRICHED_1')])
+        west = sample_lineage({'ENRICHED_IN': 'STREAM', 'TOTALS': 'TABLE', 'UNRELATED': 'STREAM'}, edges=[
+            ('ENRICHED_IN', 'TOTALS', 'CTAS_TOTALS_1')])
+        west['streams']['ENRICHED_IN']['topic'] = 'enriched_topic'
+        federated = ksql_linage.empty_lineage('http://east/ksql, http://west/ksql')
+        federated['metadata']['clusters'] = {}
+        ksql_linage.merge_cluster_lineage(federated, 'east', east)
+        ksql_linage.merge_cluster_lineage(federated, 'west', west)
+
+        self.assertEqual(federated['queries']['east.CSAS_ENRICHED_1']['sinks'], ['east.ENRICHED'])
+        self.assertEqual(federated['metadata']['clusters']['west']['dependencies'], 1)
+        self.assertEqual(ksql_linage.stitch_clusters(federated), 1)
+        self.assertIn(('east.ENRICHED', 'west.ENRICHED_IN', 'topic:enriched_topic', 'CROSS_CLUSTER'),
+                      list(federated['dependencies'].iter_tuples()))
+        self.assertIn(('EXTERNAL_SOURCE', 'east.ORDERS', 'east.CSAS_ORDERS_0', 'CREATE_STREAM'),
+                      list(federated['dependencies'].iter_tuples()))
+        graph = ksql_linage.LineageGraph(federated)
+        self.assertEqual(graph.downstream('east.orders'), {
+            'east.ENRICHED': (1, 'east.ORDERS'), 'west.ENRICHED_IN': (2, 'east.ENRICHED'),
+            'west.TOTALS': (3, 'west.ENRICHED_IN')})
+
+
+class ColumnLineageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lineage = sample_lineage({'ORDERS': 'STREAM', 'USERS': 'TABLE', 'ENRICHED': 'STREAM', 'TOTALS': 'TABLE'}, [
+            ('CSAS_ENRICHED_1', "CREATE STREAM ENRICHED AS SELECT o.ID, o.AMOUNT * 2 AS DOUBLED, u.NAME "
+                                "FROM ORDERS o LEFT OUTER JOIN USERS u ON o.USER_ID = u.ID EMIT CHANGES;",
+             ['ORDERS', 'USERS'], ['ENRICHED']),
+            ('CTAS_TOTALS_2', "CREATE TABLE TOTALS AS SELECT NAME, SUM(DOUBLED) AS TOTAL FROM ENRICHED "
+                              "GROUP BY NAME EMIT CHANGES;", ['ENRICHED'], ['TOTALS'])])
+        self.lineage['streams']['ORDERS']['columns'] = ['ID', 'AMOUNT', 'USER_ID']
+        self.lineage['tables']['USERS']['columns'] = ['ID', 'NAME']
+        self.columns = ksql_linage.ColumnLineage(self.lineage).build()
+
+    def test_join_chain_keywords_are_not_column_references(self):
+        parsed = ksql_linage.parse_select_statement(
+            "CREATE STREAM X AS SELECT a.ID FROM A a JOIN B b WITHIN 1 HOUR ON a.ID = b.ID "
+            "LEFT OUTER JOIN C c WITHIN 1 HOUR ON b.K = c.K FULL JOIN D d ON c.Z = d.Z "
+            "INNER JOIN E e ON d.Z = e.Z WHERE a.F > 1 EMIT CHANGES;")
+        self.assertEqual(parsed['sources'], [('A', 'A'), ('B', 'B'), ('C', 'C'), ('D', 'D'), ('E', 'E')])
+        self.assertEqual(parsed['referenced'], [('A', 'ID'), ('B', 'ID'), ('B', 'K'), ('C', 'K'), ('C', 'Z'),
+                                                ('D', 'Z'), ('D', 'Z'), ('E', 'Z'), ('A', 'F')])
+
+    def test_columns_resolve_through_joins_and_aggregates(self):
+        rows = sorted(self.columns.iter_rows())
+        self.assertIn(('ENRICHED', 'DOUBLED', 'ORDERS', 'AMOUNT', 'CSAS_ENRICHED_1', 'derived', 'O.AMOUNT * 2'), rows)
+        self.assertIn(('ENRICHED', 'NAME', 'USERS', 'NAME', 'CSAS_ENRICHED_1', 'direct', 'U.NAME'), rows)
+        self.assertIn(('TOTALS', 'TOTAL', 'ENRICHED', 'DOUBLED', 'CTAS_TOTALS_2', 'derived', 'SUM(DOUBLED)'), rows)
+        self.assertEqual(self.columns.schema('ENRICHED'), ('ID', 'DOUBLED', 'NAME'))
+
+    def test_blast_radius_breaks_only_the_first_hop(self):
+        affected, broken = self.columns.blast_radius('ORDERS', 'AMOUNT')
+        self.assertEqual(affected, {('ENRICHED', 'DOUBLED'): (1, 'CSAS_ENRICHED_1', 'derived', ('ORDERS', 'AMOUNT')),
+                                    ('TOTALS', 'TOTAL'): (2, 'CTAS_TOTALS_2', 'derived', ('ENRICHED', 'DOUBLED'))})
+        self.assertEqual(broken, {'CSAS_ENRICHED_1': {('ORDERS', 'AMOUNT')}, 'CTAS_TOTALS_2': {('ENRICHED', 'DOUBLED')}})
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.columns.print_blast_radius('ORDERS', 'AMOUNT', affected, broken)
+        self.assertIn("  Breaks CSAS_ENRICHED_1 (reads ORDERS.AMOUNT)", output.getvalue())
+        self.assertIn("  Affected CTAS_TOTALS_2 (reads ENRICHED.DOUBLED)", output.getvalue())
+        self.assertNotIn("Breaks CTAS_TOTALS_2", output.getvalue())
+        self.assertIn("1 queries broken, 1 affected", output.getvalue())
+        _, broken = self.columns.blast_radius('USERS', 'ID')
+        self.assertEqual(broken, {'CSAS_ENRICHED_1': {('USERS', 'ID')}})
+
+
+class SequenceClient:
+    """Client whose successive builds return the given lineages"""
+
+    def __init__(self, *lineages):
+        self.lineages = list(lineages)
+
+    def build_comprehensive_lineage(self, **kwargs):
+        return self.lineages.pop(0)
+
+
+class ServeTest(unittest.TestCase):
+
+    @staticmethod
+    def lineage(status='RUNNING', generated_at='2026-01-01T00:00:00'):
+        lineage = sample_lineage({'A': 'STREAM', 'B': 'STREAM'}, [
+            ('CSAS_B_1', 'CREATE STREAM B AS SELECT * FROM A;', ['A'], ['B'])], [('A', 'B', 'CSAS_B_1')])
+        lineage['metadata']['generated_at'] = generated_at
+        lineage['queries']['CSAS_B_1'].update(status=status, sql_hash=ksql_linage.sql_fingerprint(
+            lineage['queries']['CSAS_B_1']['sql']))
+        return lineage
+
+    def start(self, *polls):
+        initial = self.lineage()
+        cache = ksql_linage.LineageSnapshotCache('unused.json')
+        cache.update(initial)
+        self.watcher = ksql_linage.LineageWatcher(SequenceClient(*polls), initial, cache)
+        httpd = ksql_linage.ThreadingHTTPServer(('127.0.0.1', 0), self.watcher._handler_class())
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        self.port = httpd.server_address[1]
+
+    def get(self, path, etag=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request('GET', path, headers={'If-None-Match': etag} if etag else {})
+        response = conn.getresponse()
+        return response.status, response.getheader('ETag'), response.read()
+
+    def test_etag_revalidates_until_the_served_body_changes(self):
+        self.start(self.lineage(generated_at='2026-01-01T00:01:00'), self.lineage('ERROR', '2026-01-01T00:02:00'))
+        status, etag, body = self.get('/lineage')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['queries']['CSAS_B_1']['status'], 'RUNNING')
+        self.assertEqual(self.get('/lineage', etag), (304, etag, b''))
+        downstream_etag = self.get('/downstream?object=a')[1]
+        self.assertNotEqual(downstream_etag, etag)
+
+        self.assertIsNone(self.watcher.poll())
+        self.assertEqual(self.get('/lineage', etag), (304, etag, b''))
+
+        self.assertIsNone(self.watcher.poll())
+        status, new_etag, body = self.get('/lineage', etag)
+        self.assertEqual(status, 200)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(json.loads(body)['queries']['CSAS_B_1']['status'], 'ERROR')
+        self.assertEqual(self.get('/downstream?object=a', downstream_etag)[0], 304)
+        self.assertEqual(json.loads(self.get('/health')[2])['etag'], new_etag)
+
+
+class LineageStoreWalkTest(unittest.TestCase):
+    """A → B → C → A loop (INSERT INTO) feeding D, walked from the SQLite store"""
+
+    def setUp(self):
+        lineage = sample_lineage(dict.fromkeys('ABCD', 'STREAM'), edges=[
+            ('A', 'B', 'CSAS_B_1'), ('B', 'C', 'CSAS_C_2'), ('C', 'A', 'INSERTQUERY_3'), ('C', 'D', 'CSAS_D_4'),
+            ('C', 'D', 'INSERTQUERY_5'), ('EXTERNAL_SOURCE', 'A', 'CSAS_A_0')])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ksql_linage.LineageStore(os.path.join(directory.name, 'lineage.db'))
+        self.addCleanup(self.store.close)
+        self.store.save_snapshot(lineage)
+
+    def test_downstream_visits_each_object_once_at_its_shortest_distance(self):
+        self.assertEqual(self.store.downstream('A'), [
+            ('B', 1, 'A', 'STREAM', 'b_topic', 'CSAS_B_1'),
+            ('C', 2, 'B', 'STREAM', 'c_topic', 'CSAS_C_2'),
+            ('D', 3, 'C', 'STREAM', 'd_topic', 'CSAS_D_4, INSERTQUERY_5'),
+        ])
+
+    def test_upstream_follows_the_loop_back(self):
+        self.assertEqual([(name, distance, via) for name, distance, via, *_ in self.store.upstream('A')],
+                         [('C', 1, 'A'), ('B', 2, 'C')])
+
+    def test_depth_limit(self):
+        self.assertEqual([row[0] for row in self.store.downstream('A', depth=1)], ['B'])
+
+    def test_impact_includes_the_topic_readers(self):
+        self.assertEqual([(row[0], row[1]) for row in self.store.impact('c_topic')],
+                         [('C', 0), ('A', 1), ('D', 1), ('B', 2)])
+
+
+class ParseStatementsTest(unittest.TestCase):
+
+    def test_pool_matches_serial(self):
+        statements = []
+        for i in range(1, 300):
+            statements.append((f"CSAS_S{i}_{i}", f"CREATE STREAM S{i} AS SELECT a.id, b.v FROM S{i - 1} a "
+                                                 f"JOIN T{i % 7} b WITHIN 1 HOUR ON a.id = b.id EMIT CHANGES;"))
+            statements.append((f"INSERTQUERY_{i}", f"INSERT INTO S{i} SELECT * FROM R{i % 11} EMIT CHANGES;"))
+        serial, serial_processes = ksql_linage.parse_statements(statements, workers=1)
+        pooled, pooled_processes = ksql_linage.parse_statements(statements, workers=2, min_parallel=0)
+        self.assertEqual(serial_processes, 1)
+        self.assertEqual(pooled_processes, 2)
+        self.assertEqual(pooled, serial)
+        self.assertTrue(all(serial))
+
+    def test_small_batches_stay_serial(self):
+        _, processes = ksql_linage.parse_statements([('Q1', "CREATE STREAM A AS SELECT * FROM B;")], workers=4)
+        self.assertEqual(processes, 1)
+
+
+class RuntimeProfileTest(unittest.TestCase):
+
+    RATES = {'S1': 100, 'S2': 50, 'A': 10, 'C': 80, 'D': 70, 'E': 200}
+
+    def setUp(self):
+        self.lineage = sample_lineage(dict.fromkeys(self.RATES, 'STREAM'), [
+            ('CSAS_A_1', '', ['S1'], ['A']), ('CSAS_E_2', '', ['S1'], ['E']), ('CSAS_C_3', '', ['A', 'S2'], ['C']),
+            ('CSAS_D_4', '', ['C'], ['D'])], [
+            ('S1', 'A', 'CSAS_A_1'), ('S1', 'E', 'CSAS_E_2'), ('A', 'C', 'CSAS_C_3'), ('S2', 'C', 'CSAS_C_3'),
+            ('C', 'D', 'CSAS_D_4')])
+        self.lineage['queries']['CSAS_E_2']['status'] = 'ERROR'
+        for name, rate in self.RATES.items():
+            self.lineage['descriptions'][name] = {'statistics': f"messages-per-sec: {rate} total-messages: 1000"}
+        self.profile = ksql_linage.RuntimeProfile(self.lineage).attach()
+
+    def test_runtime_metrics_sums_hosts_and_derives_error_rate(self):
+        metrics = ksql_linage.runtime_metrics({
+            'statistics': 'consumer-messages-per-sec: 30.0 consumer-total-messages: 900 consumer-lag: 5 '
+                          'last-message: 2026-01-01T00:00:00Z',
+            'errorStats': 'consumer-failed-messages-per-sec: 10 consumer-failed-messages: 4',
+            'clusterStatistics': [{'stats': [{'name': 'consumer-messages-per-sec', 'value': 30.0}]},
+                                  {'stats': [{'name': 'consumer-lag', 'value': 7}]}]})
+        self.assertEqual(metrics, {'consumer_messages_per_sec': 60.0, 'total_messages': 900.0,
+                                   'failed_messages_per_sec': 10.0, 'failed_messages': 4.0,
+                                   'last_message': '2026-01-01T00:00:00Z', 'lag': 12.0, 'error_rate': 10.0 / 70.0})
+        self.assertEqual(ksql_linage.runtime_metrics({}), {})
+
+    def test_attach_annotates_edges(self):
+        runtime = {(edge['source'], edge['target']): edge for edge in self.lineage['runtime']['edges']}
+        self.assertEqual(runtime[('S1', 'E')]['status'], 'ERROR')
+        self.assertEqual((runtime[('A', 'C')]['source_messages_per_sec'], runtime[('A', 'C')]['sink_messages_per_sec']),
+                         (10.0, 80.0))
+
+    def test_bottlenecks_are_the_slowest_node_on_the_widest_path(self):
+        found, pairs, capped = self.profile.bottlenecks(top=2)
+        self.assertEqual(found, [(10.0, 'A', 'S1', 'D', ['S1', 'A', 'C', 'D']),
+                                 (50.0, 'S2', 'S2', 'D', ['S2', 'C', 'D'])])
+        self.assertEqual(pairs, 3)
+        self.assertEqual(dict(capped), {'A': 1, 'S1': 1, 'S2': 1})
+
+    def test_hotspots_rank_by_fan_out(self):
+        self.assertEqual(self.profile.hotspots()[0], (2, 2, None, 'S1'))
+        self.assertEqual(self.profile.failing(), [])
+
+
+class LineageTopologyTest(unittest.TestCase):
+
+    def topology(self, objects, edges):
+        return ksql_linage.LineageTopology(ksql_linage.LineageGraph(sample_lineage(objects, edges=edges)))
+
+    def setUp(self):
+        self.topo = self.topology(dict.fromkeys('ABCDXYZ', 'STREAM'), [
+            ('A', 'B', 'CSAS_B_1'), ('B', 'C', 'CSAS_C_2'), ('C', 'B', 'INSERTQUERY_3'), ('C', 'D', 'CSAS_D_4'),
+            ('X', 'Y', 'CSAS_Y_5'), ('Z', 'Z', 'INSERTQUERY_6'), ('EXTERNAL_SOURCE', 'A', 'CSAS_A_0')])
+
+    def test_cycles_include_self_loops(self):
+        self.assertEqual(self.topo.cycles(), [['B', 'C'], ['Z']])
+
+    def test_deploy_order_and_levels(self):
+        self.assertEqual(self.topo.deploy_order(), [(0, 'A'), (0, 'X'), (0, 'Z'), (1, 'B'), (1, 'C'), (1, 'Y'),
+                                                    (2, 'D')])
+        self.assertEqual(self.topo.longest_chain(), [['A'], ['B', 'C'], ['D']])
+
+    def test_fan_components_and_subgraph(self):
+        self.assertEqual((self.topo.fan('B'), self.topo.fan('C')), ((2, 1), (1, 2)))
+        self.assertEqual(sorted(self.topo.weak_sizes, reverse=True), [4, 2, 1])
+        self.assertEqual(self.topo.subgraph('d', depth=1), {'C', 'D'})
+
+    def test_long_chains_do_not_recurse(self):
+        names = [f"S{i:05d}" for i in range(5000)]
+        topo = self.topology(dict.fromkeys(names, 'STREAM'),
+                             [(source, target, f"CSAS_{target}") for source, target in zip(names, names[1:])])
+        self.assertEqual(topo.deploy_order()[-1], (4999, names[-1]))
+        self.assertEqual(len(topo.longest_chain()), 5000)
+        self.assertEqual(topo.cycles(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
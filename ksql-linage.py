@@ -1,82 +1,2963 @@
 import json
 import csv
 import argparse
+import logging
 import re
 import base64
 from datetime import datetime
 import os
 import sys
-from collections import defaultdict
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from array import array
+from xml.sax.saxutils import escape as xml_escape, quoteattr as xml_quoteattr
+from json.encoder import encode_basestring
+import queue
+import threading
+import time
+import hashlib
+import heapq
+import random
+import itertools
+import codecs
+import contextlib
+import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import pickle
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 try:
-    from urllib.request import Request, urlopen
-    from urllib.error import URLError, HTTPError
     import ssl
 except ImportError:
     pass
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+# Connection errors that mean a pooled keep-alive socket was closed by the peer
+# before the request went out; the request is safe to resend on a fresh socket.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                           ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+# Failures worth another attempt: socket errors and timeouts, protocol errors, and overload responses
+TRANSIENT_ERRORS = (OSError, http.client.HTTPException)
+RETRYABLE_STATUSES = frozenset([429, 502, 503, 504])
+# Read-only statements that are safe to retry and hedge
+IDEMPOTENT_VERBS = frozenset(['SHOW', 'LIST', 'DESCRIBE', 'EXPLAIN'])
+
+
+log = logging.getLogger('ksql_linage')
+
+
+class QuietThreads(logging.Filter):
+    """Drops records below WARNING that are logged by a thread inside quiet(); other threads are unaffected"""
+
+    def __init__(self):
+        super().__init__()
+        self.depth = {}
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or not self.depth.get(record.thread)
+
+    @contextlib.contextmanager
+    def quiet(self, enabled: bool = True):
+        if not enabled:
+            yield
+            return
+        ident = threading.get_ident()
+        self.depth[ident] = self.depth.get(ident, 0) + 1
+        try:
+            yield
+        finally:
+            self.depth[ident] -= 1
+            if not self.depth[ident]:
+                del self.depth[ident]
+
+
+QUIET = QuietThreads()
+log.addFilter(QUIET)
+
+# Federated lineage names objects and queries "<cluster>.<name>"
+CLUSTER_SEPARATOR = '.'
+
+# Response keys whose array elements are streamed one at a time
+ENTITY_LIST_KEYS = frozenset(['streams', 'tables', 'queries', 'sourceDescriptions', 'queryDescriptions'])
+
+JSON_STRUCTURE_PATTERN = re.compile(r'[{}\[\]"]')
+JSON_STRING_END_PATTERN = re.compile(r'["\\]')
+JSON_SCALAR_END_PATTERN = re.compile(r'[,\]}\s]')
+
+
+class JsonStreamReader:
+    """Incremental JSON reader over a file-like object
+
+    Holds at most the value being decoded plus one read chunk: the buffer is
+    trimmed before each value and container ends are found with resumable
+    regex scans, so no value is scanned twice.
+    """
+
+    def __init__(self, readable, chunk_size: int = 65536):
+        self.readable = readable
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.readable.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            self.buf += self.decoder.decode(b'', final=True)
+            return False
+        self.bytes_read += len(chunk)
+        self.buf += self.decoder.decode(chunk)
+        return True
+
+    def peek(self):
+        """Next non-whitespace character without consuming it ('' at end of input)"""
+        while True:
+            buf = self.buf
+            end = len(buf)
+            pos = self.pos
+            while pos < end and buf[pos] in ' \t\r\n':
+                pos += 1
+            self.pos = pos
+            if pos < end:
+                return buf[pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.bytes_read - len(self.buf) + self.pos}")
+        self.pos += 1
+
+    def read_value(self):
+        """Decode the next complete JSON value"""
+        first = self.peek()
+        if not first:
+            raise ValueError("Unexpected end of JSON input")
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        end = self._scan_value(first)
+        value = json.loads(self.buf[:end])
+        self.pos = end
+        return value
+
+    def _scan_value(self, first: str):
+        """End offset of the value starting at buf[0], reading more input as needed"""
+        if first not in '{["':
+            while True:
+                match = JSON_SCALAR_END_PATTERN.search(self.buf, 1)
+                if match:
+                    return match.start()
+                if not self._fill():
+                    return len(self.buf)
+        depth = 0
+        in_string = first == '"'
+        i = 1 if in_string else 0
+        while True:
+            pattern = JSON_STRING_END_PATTERN if in_string else JSON_STRUCTURE_PATTERN
+            match = pattern.search(self.buf, i)
+            if match is None:
+                if not self._fill():
+                    raise ValueError("Unexpected end of JSON input")
+                continue
+            char = match.group()
+            i = match.end()
+            if in_string:
+                if char == '\\':
+                    i += 1
+                    continue
+                in_string = False
+                if depth == 0:
+                    return i
+            elif char == '"':
+                in_string = True
+            elif char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return i
+
+
+def iter_response_items(readable, split_keys=ENTITY_LIST_KEYS):
+    """Stream a ksqlDB response array
+
+    Yields ('entity', key, value) for each element of a split_keys array inside
+    a top-level object as soon as it is decoded, then ('item', object) for the
+    object itself with those arrays left empty. Other elements yield ('item', value).
+    """
+    reader = JsonStreamReader(readable)
+    if reader.peek() != '[':
+        yield 'item', reader.read_value()
+        return
+    reader.expect('[')
+    while True:
+        char = reader.peek()
+        if char == ']':
+            return
+        if not char:
+            raise ValueError("Unexpected end of JSON input: response array was not closed")
+        if char == ',':
+            reader.pos += 1
+            continue
+        if char != '{':
+            yield 'item', reader.read_value()
+            continue
+        reader.expect('{')
+        item = {}
+        while True:
+            char = reader.peek()
+            if char == '}':
+                reader.pos += 1
+                break
+            if char == ',':
+                reader.pos += 1
+                continue
+            key = reader.read_value()
+            reader.expect(':')
+            if key in split_keys and reader.peek() == '[':
+                reader.expect('[')
+                item[key] = []
+                while True:
+                    char = reader.peek()
+                    if char == ']':
+                        reader.pos += 1
+                        break
+                    if char == ',':
+                        reader.pos += 1
+                        continue
+                    yield 'entity', key, reader.read_value()
+            else:
+                item[key] = reader.read_value()
+        yield 'item', item
+
+
+class KsqlHttpTransport:
+    """Persistent keep-alive connection pool for the ksqlDB /ksql endpoint
+
+    hedge_slots connections are reserved for hedged copies, so hedges never wait
+    on (or take) a slot a primary request needs.
+    """
+
+    def __init__(self, ksql_url: str, headers: dict, ssl_context=None,
+                 pool_size: int = 4, connect_timeout: float = 10, read_timeout: float = 30, hedge_slots: int = 0):
+        parts = urlsplit(ksql_url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.headers = headers
+        self.ssl_context = ssl_context
+        self.pool_size = max(1, pool_size)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self.hedge_slots = max(0, hedge_slots)
+        self._hedge_slots = threading.BoundedSemaphore(self.hedge_slots) if self.hedge_slots else None
+        self.connections_opened = 0
+
+    def _connect(self):
+        """Open a new connection; TLS handshake happens here and only here"""
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout,
+                                               context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        self.connections_opened += 1
+        return conn
+
+    def _acquire(self, slots):
+        slots.acquire()
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            try:
+                return self._connect(), False
+            except Exception:
+                slots.release()
+                raise
+
+    def _release(self, conn, reusable: bool, slots):
+        if reusable:
+            self._idle.put(conn)
+        else:
+            conn.close()
+        slots.release()
+
+    def _request(self, conn, payload: bytes, timeout: float = None):
+        conn.request('POST', self.path, body=payload, headers=self.headers)
+        conn.sock.settimeout(timeout or self.read_timeout)
+        return conn.getresponse()
+
+    @contextlib.contextmanager
+    def stream(self, payload: bytes, timeout: float = None, hedge: bool = False):
+        """POST payload and yield the unread response; the connection returns to the pool on exit
+
+        timeout overrides the read timeout for this request only; hedge takes a reserved hedge slot.
+        """
+        slots = self._hedge_slots if hedge and self._hedge_slots else self._slots
+        conn, reused = self._acquire(slots)
+        reusable = False
+        try:
+            try:
+                response = self._request(conn, payload, timeout)
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                conn.close()
+                conn = self._connect()
+                response = self._request(conn, payload, timeout)
+            yield response
+            # Only a fully consumed response leaves the socket reusable
+            reusable = response.isclosed() and not response.will_close
+        finally:
+            self._release(conn, reusable, slots)
+
+    def post(self, payload: bytes, timeout: float = None, hedge: bool = False):
+        """POST payload and return (status, body bytes) over a pooled connection"""
+        with self.stream(payload, timeout, hedge) as response:
+            return response.status, response.read()
+
+    def close(self):
+        """Close every idle pooled connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Single-pass ksqlDB SQL tokenizer. Every alternative is anchored on its first
+# character, so each token is matched once with no backtracking.
+TOKEN_PATTERN = re.compile(r"""\s*(?:
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'[^']*(?:''[^']*)*')
+  | (?P<quoted>`[^`]*(?:``[^`]*)*`|"[^"]*(?:""[^"]*)*")
+  | (?P<word>[A-Za-z_][A-Za-z0-9_@$]*)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+  | (?P<op>::|<>|!=|<=|>=|=>|->|\|\||.)
+)""", re.VERBOSE | re.DOTALL)
+
+# Jumps from SELECT to the FROM that ends its projection, stepping over string
+# literals, quoted identifiers and comments as whole units.
+PROJECTION_SKIP_PATTERN = re.compile(r"""
+    '[^']*(?:''[^']*)*' | `[^`]*(?:``[^`]*)*` | "[^"]*(?:""[^"]*)*"
+  | --[^\n]* | /\*.*?(?:\*/|\Z)
+  | (?P<from>\bFROM\b)
+""", re.VERBOSE | re.DOTALL | re.IGNORECASE)
+
+# Keywords that end a comma-separated FROM list
+FROM_LIST_TERMINATORS = frozenset([
+    'WHERE', 'GROUP', 'HAVING', 'WINDOW', 'EMIT', 'PARTITION', 'LIMIT', 'JOIN',
+    'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS', 'ON', 'WITHIN', 'SELECT'
+])
+
+
+def tokenize_ksql(sql: str, skip_projections: bool = False):
+    """Yield (kind, value) tokens; bare words are upper-cased, quoted identifiers keep their case
+
+    With skip_projections the select list after each SELECT is skipped in one
+    C-level scan, which is all dependency extraction needs.
+    """
+    pos = 0
+    end = len(sql)
+    match = TOKEN_PATTERN.match
+    while pos < end:
+        token = match(sql, pos)
+        if token is None:
+            break
+        pos = token.end()
+        kind = token.lastgroup
+        if kind == 'comment':
+            continue
+        value = token.group(kind)
+        if kind == 'word':
+            value = value.upper()
+            if skip_projections and value == 'SELECT':
+                yield kind, value
+                while True:
+                    skip = PROJECTION_SKIP_PATTERN.search(sql, pos)
+                    if skip is None:
+                        pos = end
+                        break
+                    if skip.lastgroup == 'from':
+                        pos = skip.start()
+                        break
+                    pos = skip.end()
+                continue
+        elif kind == 'quoted':
+            quote = value[0]
+            value = value[1:-1].replace(quote * 2, quote)
+        yield kind, value
+
+
+def parse_ksql_statement(sql: str):
+    """Parse one ksqlDB statement into its sink, object type, statement kind, WITH properties and every source"""
+    tokens = list(tokenize_ksql(sql, skip_projections=True))
+    result = {'kind': 'OTHER', 'object_type': None, 'sink': None, 'sources': [], 'properties': {}}
+    if not tokens:
+        return result
+    
+    def word(i):
+        return tokens[i][1] if i < len(tokens) and tokens[i][0] == 'word' else None
+    
+    def name(i):
+        return tokens[i][1] if i < len(tokens) and tokens[i][0] in ('word', 'quoted') else None
+    
+    i = 0
+    if word(0) == 'CREATE':
+        i = 1
+        if word(i) == 'OR' and word(i + 1) == 'REPLACE':
+            i += 2
+        if word(i) == 'SOURCE':
+            i += 1
+        if word(i) in ('STREAM', 'TABLE'):
+            result['object_type'] = word(i)
+            i += 1
+            if word(i) == 'IF' and word(i + 1) == 'NOT' and word(i + 2) == 'EXISTS':
+                i += 3
+            result['sink'] = name(i)
+            result['kind'] = 'CREATE_SOURCE'
+            i += 1
+    elif word(0) == 'INSERT' and word(1) == 'INTO':
+        result['sink'] = name(2)
+        result['kind'] = 'INSERT'
+        i = 3
+    
+    sources = result['sources']
+    seen = set()
+    depth = 0
+    from_lists = []  # paren depths of the FROM lists currently open
+    expect_source = False
+    for pos in range(i, len(tokens)):
+        kind, value = tokens[pos]
+        if expect_source:
+            expect_source = False
+            if kind in ('word', 'quoted'):
+                if value not in seen:
+                    seen.add(value)
+                    sources.append(value)
+                continue
+        if kind == 'op':
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+                while from_lists and from_lists[-1] > depth:
+                    from_lists.pop()
+            elif value == ',' and from_lists and from_lists[-1] == depth:
+                expect_source = True
+        elif kind == 'word':
+            if value == 'FROM':
+                expect_source = True
+                from_lists.append(depth)
+            elif value in FROM_LIST_TERMINATORS and from_lists and from_lists[-1] == depth:
+                from_lists.pop()
+            if value == 'JOIN':
+                expect_source = True
+            elif value == 'AS' and depth == 0 and word(pos + 1) == 'SELECT' and result['kind'] == 'CREATE_SOURCE':
+                result['kind'] = 'CREATE_AS'
+            elif value == 'WITH' and depth == 0 and not from_lists and not result['properties']:
+                result['properties'] = parse_with_properties(tokens, pos + 1)
+    
+    if result['kind'] == 'CREATE_SOURCE' and sources:
+        # CREATE ... WITH (...) SELECT without AS is not valid ksqlDB, but treat it as derived
+        result['kind'] = 'CREATE_AS'
+    return result
+
+
+def parse_with_properties(tokens, start: int):
+    """Read `( KEY = value, ... )` starting at tokens[start] into an upper-cased key dict"""
+    properties = {}
+    if start >= len(tokens) or tokens[start] != ('op', '('):
+        return properties
+    i = start + 1
+    while i + 2 < len(tokens) and tokens[i + 1] == ('op', '='):
+        key = tokens[i][1].upper()
+        kind, value = tokens[i + 2]
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        properties[key] = value
+        i += 3
+        if i < len(tokens) and tokens[i] == ('op', ','):
+            i += 1
+        else:
+            break
+    return properties
+
+
+def split_ksql_statements(text: str):
+    """Yield each ;-terminated statement, ignoring semicolons inside strings, identifiers and comments"""
+    start = 0
+    pos = 0
+    end = len(text)
+    match = TOKEN_PATTERN.match
+    while pos < end:
+        token = match(text, pos)
+        if token is None:
+            break
+        pos = token.end()
+        if token.lastgroup == 'op' and token.group('op') == ';':
+            statement = text[start:pos].strip()
+            start = pos
+            if statement.rstrip(';').strip():
+                yield statement
+    statement = text[start:].strip()
+    if statement.rstrip(';').strip() and any(kind != 'comment' for kind, _ in tokenize_ksql(statement)):
+        yield statement
+
+
+def statement_dependencies(statement, query_id: str):
+    """Turn a parsed statement into the dependency records used throughout the lineage"""
+    sink = statement['sink']
+    if not sink:
+        return []
+    if statement['kind'] == 'CREATE_SOURCE':
+        return [{
+            "source": "EXTERNAL_SOURCE",
+            "target": sink,
+            "query_id": query_id,
+            "type": f"SOURCE_{statement['object_type']}"
+        }]
+    if statement['kind'] == 'INSERT':
+        dep_type = "INSERT_INTO"
+    elif statement['kind'] == 'CREATE_AS':
+        dep_type = f"CREATE_{statement['object_type']}"
+    else:
+        return []
+    return [{"source": source, "target": sink, "query_id": query_id, "type": dep_type}
+            for source in statement['sources']]
+
+
+# Words inside expressions that are never column references
+EXPRESSION_KEYWORDS = frozenset([
+    'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'AND', 'OR', 'NOT', 'NULL', 'TRUE', 'FALSE', 'IS', 'IN',
+    'BETWEEN', 'LIKE', 'ESCAPE', 'AS', 'DISTINCT', 'INTERVAL', 'BY', 'ASC', 'DESC', 'ON', 'WHERE',
+    'GROUP', 'HAVING', 'PARTITION'
+])
+
+# Clauses after FROM whose expressions are not column references (window sizes, EMIT, LIMIT)
+SKIPPED_CLAUSES = frozenset(['WINDOW', 'WITHIN', 'EMIT', 'LIMIT'])
+REFERENCE_CLAUSES = frozenset(['WHERE', 'ON', 'GROUP', 'HAVING', 'PARTITION'])
+NESTED_TYPES = frozenset(['STRUCT', 'ARRAY', 'MAP'])
+
+
+def column_references(tokens):
+    """(qualifier or None, column) for every column an expression token list reads"""
+    refs = []
+    lambda_params = {tokens[i][1] for i in range(len(tokens) - 1) if tokens[i + 1] == ('op', '=>')}
+    count = len(tokens)
+    i = 0
+    while i < count:
+        kind, value = tokens[i]
+        i += 1
+        if kind not in ('word', 'quoted'):
+            continue
+        previous = tokens[i - 2] if i > 1 else None
+        following = tokens[i] if i < count else None
+        if kind == 'word' and value in NESTED_TYPES and following == ('op', '<'):
+            nesting = 0
+            while i < count:
+                if tokens[i] == ('op', '<'):
+                    nesting += 1
+                elif tokens[i] == ('op', '>'):
+                    nesting -= 1
+                    if not nesting:
+                        i += 1
+                        break
+                i += 1
+            continue
+        if previous in (('op', '.'), ('op', '->'), ('word', 'AS')) or following == ('op', '('):
+            continue
+        if (kind == 'word' and value in EXPRESSION_KEYWORDS) or value in lambda_params:
+            continue
+        if following == ('op', '.') and i + 1 < count and tokens[i + 1][0] in ('word', 'quoted'):
+            refs.append((value, tokens[i + 1][1]))
+            i += 2
+            continue
+        refs.append((None, value))
+    return refs
+
+
+def format_expression(tokens):
+    """Render expression tokens back to compact SQL text"""
+    parts = []
+    previous = previous_kind = None
+    for kind, value in tokens:
+        space = bool(parts) and previous not in ('(', '.', '->') and value not in (')', ',', '.', '->')
+        if value == '(' and previous_kind == 'word' and previous not in EXPRESSION_KEYWORDS:
+            space = False
+        if space:
+            parts.append(' ')
+        parts.append(f"`{value}`" if kind == 'quoted' else value)
+        previous, previous_kind = value, kind
+    return ''.join(parts)
+
+
+def parse_column_definitions(sql: str):
+    """Column names declared by `CREATE STREAM|TABLE name (col TYPE, ...)`, or None without a column list"""
+    tokens = list(tokenize_ksql(sql, skip_projections=True))
+    for start, token in enumerate(tokens):
+        if token == ('op', '('):
+            break
+        if token in (('word', 'WITH'), ('word', 'AS')):
+            return None
+    else:
+        return None
+    
+    columns = []
+    depth = 0
+    expect_name = True
+    for kind, value in tokens[start + 1:]:
+        if expect_name:
+            expect_name = False
+            if kind in ('word', 'quoted'):
+                columns.append(value)
+        if kind == 'op':
+            if value in ('(', '<'):
+                depth += 1
+            elif value in (')', '>'):
+                if value == ')' and not depth:
+                    break
+                depth -= 1
+            elif value == ',' and not depth:
+                expect_name = True
+    return columns
+
+
+def parse_select_statement(sql: str):
+    """Break a CSAS/CTAS/INSERT INTO statement into its projection, aliased sources and filter/join references
+
+    Returns None for statements without a top-level SELECT. Each projection item is
+    {'alias', 'expression', 'refs', 'star', 'direct'} where star is None, '*' or the qualifier of `q.*`
+    and direct marks a bare column reference.
+    """
+    statement = parse_ksql_statement(sql)
+    if statement['kind'] not in ('CREATE_AS', 'INSERT') or not statement['sink']:
+        return None
+    tokens = list(tokenize_ksql(sql))
+    depth = 0
+    select = None
+    for pos, token in enumerate(tokens):
+        if token == ('op', '('):
+            depth += 1
+        elif token == ('op', ')'):
+            depth -= 1
+        elif token == ('word', 'SELECT') and not depth:
+            select = pos
+            break
+    if select is None:
+        return None
+    
+    items = []
+    current = []
+    depth = 0
+    pos = select + 1
+    while pos < len(tokens):
+        token = tokens[pos]
+        if not depth and token in (('op', ','), ('word', 'FROM')):
+            items.append(current)
+            current = []
+            if token[1] == 'FROM':
+                break
+        else:
+            if token == ('op', '('):
+                depth += 1
+            elif token == ('op', ')'):
+                depth -= 1
+            current.append(token)
+        pos += 1
+    else:
+        if current:
+            items.append(current)
+    
+    projection = []
+    for index, item in enumerate(items):
+        alias = None
+        if len(item) > 2 and item[-2] == ('word', 'AS') and item[-1][0] in ('word', 'quoted'):
+            alias, item = item[-1][1], item[:-2]
+        elif (len(item) > 1 and item[-1][0] in ('word', 'quoted') and item[-1][1] not in EXPRESSION_KEYWORDS
+              and item[-2][1] not in EXPRESSION_KEYWORDS and (item[-2][0] != 'op' or item[-2][1] == ')')):
+            alias, item = item[-1][1], item[:-1]
+        star = None
+        if item == [('op', '*')]:
+            star = '*'
+        elif len(item) == 3 and item[1:] == [('op', '.'), ('op', '*')]:
+            star = item[0][1]
+        refs = [] if star else column_references(item)
+        direct = len(refs) == 1 and (len(item) == 1 or (len(item) == 3 and item[1] == ('op', '.')))
+        if alias is None and not star:
+            alias = refs[0][1] if direct else f"KSQL_COL_{index}"
+        projection.append({'alias': alias, 'expression': format_expression(item), 'refs': refs,
+                           'star': star, 'direct': direct})
+    
+    sources = []
+    referenced = []
+    clause_tokens = []
+    clause = 'FROM'
+    depth = 0
+    expect_source = True
+    pos += 1
+    while pos < len(tokens):
+        kind, value = tokens[pos]
+        pos += 1
+        if expect_source and kind in ('word', 'quoted'):
+            expect_source = False
+            alias = value
+            if pos < len(tokens) and tokens[pos] == ('word', 'AS'):
+                pos += 1
+            if (pos < len(tokens) and tokens[pos][0] in ('word', 'quoted')
+                    and tokens[pos][1] not in FROM_LIST_TERMINATORS and tokens[pos][1] not in SKIPPED_CLAUSES):
+                alias = tokens[pos][1]
+                pos += 1
+            sources.append((value, alias))
+            continue
+        if kind == 'op':
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+        # Join keywords (LEFT, OUTER, ...) end an ON expression just as they end a FROM list
+        if not depth and kind == 'word' and (value in REFERENCE_CLAUSES or value in SKIPPED_CLAUSES
+                                             or value in FROM_LIST_TERMINATORS or value == 'FROM'):
+            referenced.extend(column_references(clause_tokens))
+            clause_tokens = []
+            clause = value
+            expect_source = value in ('JOIN', 'FROM')
+            continue
+        if not depth and value == ',' and clause == 'FROM':
+            expect_source = True
+            continue
+        if clause in REFERENCE_CLAUSES:
+            clause_tokens.append((kind, value))
+    referenced.extend(column_references(clause_tokens))
+    
+    return {'kind': statement['kind'], 'sink': statement['sink'], 'items': projection, 'sources': sources,
+            'referenced': referenced}
+
+
+# Below this many statements a process pool costs more to start than parsing saves
+PARALLEL_PARSE_MIN_STATEMENTS = 2000
+
+
+def parse_sql_chunk(chunk):
+    """Dependencies for each (query_id, sql) in chunk; the unit of work sent to parser processes"""
+    return [statement_dependencies(parse_ksql_statement(sql), query_id) for query_id, sql in chunk]
+
+
+def parse_sql_chunk_timed(chunk):
+    """parse_sql_chunk with the seconds each statement took: [(dependencies, seconds)]"""
+    results = []
+    clock = time.perf_counter
+    for query_id, sql in chunk:
+        started = clock()
+        dependencies = statement_dependencies(parse_ksql_statement(sql), query_id)
+        results.append((dependencies, clock() - started))
+    return results
+
+
+def parse_statements(items, workers: int = None, min_parallel: int = PARALLEL_PARSE_MIN_STATEMENTS,
+                     timed: bool = False):
+    """(dependencies for every (query_id, sql) in items in the same order, processes used)
+
+    Large batches are split into chunks and parsed on a process pool (one process per
+    CPU by default); pool.map keeps chunk order, so the merge is deterministic. Small
+    batches, workers=1 and platforms that cannot start a pool are parsed serially, and
+    report 1 process. timed=True returns (dependencies, seconds) pairs instead.
+    """
+    parse_chunk = parse_sql_chunk_timed if timed else parse_sql_chunk
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(items) < min_parallel:
+        return parse_chunk(items), 1
+    chunk_size = max(64, -(-len(items) // (workers * 4)))
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    processes = min(workers, len(chunks))
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = []
+            for parsed in pool.map(parse_chunk, chunks):
+                results.extend(parsed)
+            return results, processes
+    except (OSError, BrokenProcessPool, pickle.PicklingError, AttributeError) as e:
+        log.warning("Process pool unavailable (%s); parsing %d statements serially", e, len(items))
+        return parse_chunk(items), 1
+
+
+def sql_fingerprint(sql: str):
+    """Hash of the whitespace-normalized statement, stable across cosmetic reformatting"""
+    return hashlib.sha256(' '.join((sql or '').split()).encode('utf-8')).hexdigest()
+
+
+class LineageSnapshotCache:
+    """On-disk snapshot of resolved queries keyed by query_id + SQL hash, plus the object inventory"""
+
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queries = {}
+        self.streams = {}
+        self.tables = {}
+        self.generated_at = None
+
+    @classmethod
+    def load(cls, path: str):
+        cache = cls(path)
+        if not os.path.exists(path):
+            log.info("No snapshot cache at %s; doing a full build", path)
+            return cache
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable snapshot cache %s: %s", path, e)
+            return cache
+        if data.get('version') != cls.VERSION:
+            log.warning("Ignoring snapshot cache %s: version %s != %s", path, data.get('version'), cls.VERSION)
+            return cache
+        cache.queries = data.get('queries', {})
+        cache.streams = data.get('streams', {})
+        cache.tables = data.get('tables', {})
+        cache.generated_at = data.get('generated_at')
+        log.info("Loaded snapshot cache %s: %d queries from %s", path, len(cache.queries), cache.generated_at)
+        return cache
+
+    def lookup(self, query_id: str, sql_hash: str):
+        """Cached dependencies for an unchanged query, or None"""
+        entry = self.queries.get(query_id)
+        if not entry or entry['sql_hash'] != sql_hash:
+            return None
+        return [{"source": source, "target": target, "query_id": query_id, "type": dep_type}
+                for source, target, dep_type in entry['dependencies']]
+
+    def edge_set(self):
+        return {(source, target, query_id, dep_type)
+                for query_id, entry in self.queries.items()
+                for source, target, dep_type in entry['dependencies']}
+
+    def diff(self, lineage):
+        """Added/removed edges, queries and objects between this snapshot and a new lineage"""
+        old_edges = self.edge_set()
+        new_edges = set(lineage['dependencies'].iter_tuples())
+        old_objects = set(self.streams) | set(self.tables)
+        new_objects = set(lineage['streams']) | set(lineage['tables'])
+        changed = [query_id for query_id, query in lineage['queries'].items()
+                   if query_id in self.queries and self.queries[query_id]['sql_hash'] != query.get('sql_hash')]
+        
+        def edges(rows):
+            return [{"source": s, "target": t, "query_id": q, "type": k} for s, t, q, k in sorted(rows)]
+        
+        return {
+            "previous_snapshot": self.generated_at,
+            "generated_at": lineage['metadata']['generated_at'],
+            "added_edges": edges(new_edges - old_edges),
+            "removed_edges": edges(old_edges - new_edges),
+            "added_queries": sorted(set(lineage['queries']) - set(self.queries)),
+            "terminated_queries": sorted(set(self.queries) - set(lineage['queries'])),
+            "changed_queries": sorted(changed),
+            "added_objects": sorted(new_objects - old_objects),
+            "removed_objects": sorted(old_objects - new_objects)
+        }
+
+    def update(self, lineage):
+        """Replace the snapshot with the new lineage; terminated queries drop out"""
+        by_query = defaultdict(list)
+        for source, target, query_id, dep_type in lineage['dependencies'].iter_tuples():
+            by_query[query_id].append([source, target, dep_type])
+        self.queries = {
+            query_id: {"sql_hash": query['sql_hash'], "dependencies": by_query.get(query_id, [])}
+            for query_id, query in lineage['queries'].items()
+        }
+        self.streams = lineage['streams']
+        self.tables = lineage['tables']
+        self.generated_at = lineage['metadata']['generated_at']
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "version": self.VERSION,
+                "generated_at": self.generated_at,
+                "queries": self.queries,
+                "streams": self.streams,
+                "tables": self.tables
+            }, f)
+        os.replace(tmp_path, self.path)
+        log.info("✓ Snapshot cache written to: %s", self.path)
+
+
+class LineageStore:
+    """SQLite history of crawls: every snapshot's objects, topics, queries and edges in indexed tables"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY,
+            generated_at TEXT NOT NULL,
+            ksql_url TEXT,
+            objects INTEGER,
+            queries INTEGER,
+            edges INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS snapshots_generated_at ON snapshots (generated_at);
+        CREATE TABLE IF NOT EXISTS objects (
+            snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            topic TEXT,
+            format TEXT,
+            key_format TEXT,
+            cluster TEXT,
+            PRIMARY KEY (snapshot_id, name)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS topics (
+            snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+            topic TEXT NOT NULL,
+            object TEXT NOT NULL,
+            PRIMARY KEY (snapshot_id, topic, object)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS statements (
+            sql_hash TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS queries (
+            snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+            query_id TEXT NOT NULL,
+            status TEXT,
+            sql_hash TEXT REFERENCES statements (sql_hash),
+            resolved_by TEXT,
+            PRIMARY KEY (snapshot_id, query_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS edges (
+            snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+            source TEXT NOT NULL,
+            target TEXT NOT NULL,
+            query_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            PRIMARY KEY (snapshot_id, source, target, query_id, type)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS edges_reverse ON edges (snapshot_id, target, source);
+    """
+
+    # One breadth-first level: the edges leaving the frontier, with their query ids folded per (via, name)
+    STEP_SQL = """
+        SELECT via, name, group_concat(query_id, ', ') FROM (
+            SELECT DISTINCT e.{this} AS via, e.{next} AS name, e.query_id FROM edges e
+            WHERE e.snapshot_id = :snapshot AND e.{this} IN (SELECT value FROM json_each(:frontier))
+              AND e.source != 'EXTERNAL_SOURCE'
+            ORDER BY via, name, e.query_id)
+        GROUP BY via, name
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # --serve hands the store to its polling thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def save_snapshot(self, lineage):
+        """Write the whole lineage as a new snapshot in one transaction; returns its id"""
+        started = time.perf_counter()
+        objects = [(bucket, name, info) for bucket in ('streams', 'tables') for name, info in lineage[bucket].items()]
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO snapshots (generated_at, ksql_url, objects, queries, edges) VALUES (?, ?, ?, ?, ?)",
+                (lineage['metadata']['generated_at'], lineage['metadata'].get('ksql_url'), len(objects),
+                 len(lineage['queries']), len(lineage['dependencies'])))
+            snapshot_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((snapshot_id, name, 'STREAM' if bucket == 'streams' else 'TABLE', info.get('topic', ''),
+                  info.get('format', ''), info.get('key_format', ''), info.get('cluster'))
+                 for bucket, name, info in objects))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO topics VALUES (?, ?, ?)",
+                ((snapshot_id, info['topic'], name) for _, name, info in objects if info.get('topic')))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO statements VALUES (?, ?)",
+                ((query.get('sql_hash') or sql_fingerprint(query['sql']), query['sql'])
+                 for query in lineage['queries'].values()))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)",
+                ((snapshot_id, query_id, query.get('status', ''), query.get('sql_hash') or sql_fingerprint(query['sql']),
+                  query.get('resolved_by')) for query_id, query in lineage['queries'].items()))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO edges VALUES (?, ?, ?, ?, ?)",
+                ((snapshot_id,) + edge for edge in lineage['dependencies'].iter_tuples()))
+        log.info("✓ Snapshot %s written to %s (%d objects, %d edges) in %.2fs",
+                 snapshot_id, self.path, len(objects), len(lineage['dependencies']), time.perf_counter() - started)
+        return snapshot_id
+
+    def latest_snapshot(self):
+        row = self.conn.execute("SELECT max(id) FROM snapshots").fetchone()
+        return row[0]
+
+    def snapshots(self):
+        return self.conn.execute(
+            "SELECT id, generated_at, ksql_url, objects, queries, edges FROM snapshots ORDER BY id").fetchall()
+
+    def changes_since(self, since: str, snapshot_id: int = None):
+        """(baseline snapshot id or None, added edges, removed edges) between the last snapshot taken at or
+        before since and snapshot_id (default: latest)"""
+        snapshot_id = snapshot_id or self.latest_snapshot()
+        baseline = self.conn.execute("SELECT max(id) FROM snapshots WHERE generated_at <= ?",
+                                     (since,)).fetchone()[0]
+        difference = """
+            SELECT source, target, query_id, type FROM edges a WHERE a.snapshot_id = ?
+            AND NOT EXISTS (SELECT 1 FROM edges b WHERE b.snapshot_id = ? AND b.source = a.source
+                            AND b.target = a.target AND b.query_id = a.query_id AND b.type = a.type)
+            ORDER BY source, target, query_id
+        """
+        added = self.conn.execute(difference, (snapshot_id, baseline or -1)).fetchall()
+        removed = self.conn.execute(difference, (baseline or -1, snapshot_id)).fetchall() if baseline else []
+        return baseline, added, removed
+
+    def _walk(self, start, direction: str, depth: int = None, snapshot_id: int = None, exclude=None):
+        """Breadth-first walk one level per query; each name is expanded once, at its shortest distance,
+        through the alphabetically first object that reaches it there"""
+        snapshot_id = snapshot_id or self.latest_snapshot()
+        this, following = ('source', 'target') if direction == 'downstream' else ('target', 'source')
+        step = self.STEP_SQL.format(this=this, next=following)
+        reached = {name: (0, None, None) for name in start}
+        frontier = sorted(reached)
+        distance = 0
+        while frontier and (depth is None or distance < depth):
+            distance += 1
+            level = {}
+            for via, name, queries in self.conn.execute(step, {'snapshot': snapshot_id,
+                                                               'frontier': json.dumps(frontier)}):
+                if name not in reached and (name not in level or via < level[name][1]):
+                    level[name] = (distance, via, queries)
+            reached.update(level)
+            frontier = sorted(level)
+        excluded = set(start if exclude is None else exclude)
+        names = sorted((name for name in reached if name not in excluded), key=lambda name: (reached[name][0], name))
+        objects = {name: (object_type, topic) for name, object_type, topic in self.conn.execute(
+            "SELECT name, type, topic FROM objects WHERE snapshot_id = ? AND name IN (SELECT value FROM json_each(?))",
+            (snapshot_id, json.dumps(names)))}
+        rows = []
+        for name in names:
+            distance, via, queries = reached[name]
+            object_type, topic = objects.get(name, ('EXTERNAL', ''))
+            rows.append((name, distance, via, object_type, topic or '', queries))
+        return rows
+
+    def resolve_name(self, name: str, snapshot_id: int = None):
+        """Match an object name as given, falling back to ksqlDB's upper-cased form"""
+        snapshot_id = snapshot_id or self.latest_snapshot()
+        found = self.conn.execute("SELECT 1 FROM edges WHERE snapshot_id = ? AND (source = ? OR target = ?) LIMIT 1",
+                                  (snapshot_id, name, name)).fetchone() or self.conn.execute(
+            "SELECT 1 FROM objects WHERE snapshot_id = ? AND name = ?", (snapshot_id, name)).fetchone()
+        if found:
+            return name
+        cluster, separator, object_name = name.rpartition(CLUSTER_SEPARATOR)
+        return f"{cluster}{separator}{object_name.upper()}"
+
+    def downstream(self, name: str, depth: int = None, snapshot_id: int = None):
+        """[(name, distance, via, type, topic, query_ids)] for everything fed by name"""
+        return self._walk([name], 'downstream', depth, snapshot_id)
+
+    def upstream(self, name: str, depth: int = None, snapshot_id: int = None):
+        return self._walk([name], 'upstream', depth, snapshot_id)
+
+    def impact(self, topic: str, depth: int = None, snapshot_id: int = None):
+        """Objects on the topic (distance 0) plus everything downstream of them"""
+        snapshot_id = snapshot_id or self.latest_snapshot()
+        readers = [row[0] for row in self.conn.execute(
+            "SELECT object FROM topics WHERE snapshot_id = ? AND topic = ? ORDER BY object", (snapshot_id, topic))]
+        return self._walk(readers, 'downstream', depth, snapshot_id, exclude=[])
+
+    def print_traversal(self, title: str, rows, reverse: bool = False, elapsed_ms: float = 0.0):
+        print(f"\n{title} ({len(rows)} objects, {elapsed_ms:.2f} ms, from {self.path})")
+        print("-" * 80)
+        if not rows:
+            print("  (none)")
+        for name, distance, via, object_type, topic, queries in rows:
+            line = f"  [{distance}] {name} ({object_type})"
+            if topic:
+                line += f" topic={topic}"
+            if via is not None:
+                line += f" via {queries} {'into' if reverse else 'from'} {via}"
+            print(line)
+
+    def print_changes_since(self, since: str):
+        started = time.perf_counter()
+        baseline, added, removed = self.changes_since(since)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        latest = self.latest_snapshot()
+        print(f"\nEDGE CHANGES SINCE {since} (snapshot {baseline or 'none'} → {latest}, {elapsed_ms:.2f} ms)")
+        print("-" * 80)
+        for marker, rows in (('+', added), ('-', removed)):
+            for source, target, query_id, dep_type in rows:
+                print(f"  {marker} {source} → {target} via {query_id} ({dep_type})")
+        print(f"  {len(added)} added, {len(removed)} removed")
+
+    def print_history(self):
+        print(f"\nSNAPSHOTS IN {self.path}")
+        print("-" * 80)
+        for snapshot_id, generated_at, ksql_url, objects, queries, edges in self.snapshots():
+            print(f"  #{snapshot_id} {generated_at} {ksql_url}: {objects} objects, {queries} queries, {edges} edges")
+
+
+class NameTable:
+    """Interns object, query and operation names to small integer ids"""
+
+    __slots__ = ('names', 'ids')
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def intern(self, name: str):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def __len__(self):
+        return len(self.names)
+
+
+class DependencyStore:
+    """Dependency edges as parallel integer arrays over one NameTable
+
+    Behaves like the list of {"source", "target", "query_id", "type"} dicts it
+    replaces: append/extend take those dicts and iteration yields fresh ones.
+    """
+
+    __slots__ = ('names', 'sources', 'targets', 'queries', 'types')
+
+    def __init__(self, dependencies=()):
+        self.names = NameTable()
+        self.sources = array('i')
+        self.targets = array('i')
+        self.queries = array('i')
+        self.types = array('i')
+        self.extend(dependencies)
+
+    def append(self, dep):
+        intern = self.names.intern
+        self.sources.append(intern(dep['source']))
+        self.targets.append(intern(dep['target']))
+        self.queries.append(intern(dep['query_id']))
+        self.types.append(intern(dep['type']))
+
+    def extend(self, dependencies):
+        for dep in dependencies:
+            self.append(dep)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __bool__(self):
+        return len(self.sources) > 0
+
+    def iter_ids(self):
+        """Yield (source_id, target_id, query_id, type_id) without building dicts"""
+        return zip(self.sources, self.targets, self.queries, self.types)
+
+    def iter_tuples(self):
+        """Yield (source, target, query_id, type) name tuples"""
+        names = self.names.names
+        for source, target, query, dep_type in self.iter_ids():
+            yield names[source], names[target], names[query], names[dep_type]
+
+    def __iter__(self):
+        for source, target, query_id, dep_type in self.iter_tuples():
+            yield {"source": source, "target": target, "query_id": query_id, "type": dep_type}
+
+    def __getitem__(self, index):
+        names = self.names.names
+        return {"source": names[self.sources[index]], "target": names[self.targets[index]],
+                "query_id": names[self.queries[index]], "type": names[self.types[index]]}
+
+    def to_list(self):
+        return list(self)
+
+
+RELATIONSHIP_BUCKETS = {
+    'stream_to_stream': ('STREAM', 'STREAM'),
+    'stream_to_table': ('STREAM', 'TABLE'),
+    'table_to_stream': ('TABLE', 'STREAM'),
+    'table_to_table': ('TABLE', 'TABLE'),
+}
+
+
+class RelationshipViews(Mapping):
+    """lineage['relationships'], computed on demand from the DependencyStore
+
+    Each access builds the bucket's list in edge order, so callers see the
+    same dicts the eagerly-built buckets used to hold.
+    """
+
+    KEYS = tuple(RELATIONSHIP_BUCKETS) + ('query_relationships',)
+
+    def __init__(self, lineage):
+        self.lineage = lineage
+
+    def object_types(self):
+        object_types = {}
+        for stream_name in self.lineage['streams']:
+            object_types[stream_name] = 'STREAM'
+        for table_name in self.lineage['tables']:
+            object_types[table_name] = 'TABLE'
+        return object_types
+
+    def _type_ids(self):
+        """Object type per interned name id, None for names that are not streams or tables"""
+        object_types = self.object_types()
+        return [object_types.get(name) for name in self.lineage['dependencies'].names.names]
+
+    def counts(self):
+        """Edge count per typed bucket from one pass over the interned ids, without building rows"""
+        bucket_for = {types: key for key, types in RELATIONSHIP_BUCKETS.items()}
+        counts = dict.fromkeys(RELATIONSHIP_BUCKETS, 0)
+        type_ids = self._type_ids()
+        for source, target, _, _ in self.lineage['dependencies'].iter_ids():
+            key = bucket_for.get((type_ids[source], type_ids[target]))
+            if key:
+                counts[key] += 1
+        return counts
+
+    def __getitem__(self, key):
+        object_types = self.object_types()
+        edges = self.lineage['dependencies'].iter_tuples()
+        if key == 'query_relationships':
+            return [{
+                'query_id': query_id,
+                'input_object': source,
+                'input_type': object_types.get(source, 'EXTERNAL'),
+                'output_object': target,
+                'output_type': object_types.get(target, 'UNKNOWN'),
+                'operation': dep_type
+            } for source, target, query_id, dep_type in edges]
+        source_type, target_type = RELATIONSHIP_BUCKETS[key]
+        return [{
+            'source_object': source,
+            'target_object': target,
+            'query_id': query_id,
+            'relationship_type': dep_type
+        } for source, target, query_id, dep_type in edges
+            if object_types.get(source) == source_type and object_types.get(target) == target_type]
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def to_dict(self):
+        return {key: self[key] for key in self.KEYS}
+
+
+def lineage_json_default(value):
+    """json.dump default= hook for the compact lineage containers"""
+    if isinstance(value, DependencyStore):
+        return value.to_list()
+    if isinstance(value, RelationshipViews):
+        return value.to_dict()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def empty_lineage(ksql_url: str):
+    """A new lineage dict with compact dependency storage and relationship views"""
+    lineage = {
+        "streams": {},
+        "tables": {},
+        "queries": {},
+        "dependencies": DependencyStore(),
+        "relationships": None,
+        "metadata": {
+            "generated_at": datetime.now().isoformat(),
+            "ksql_url": ksql_url
+        },
+        "descriptions": {},
+        "explains": {}
+    }
+    lineage['relationships'] = RelationshipViews(lineage)
+    return lineage
+
+
+class LineageGraph:
+    """Lineage edges indexed once for upstream/downstream and topic impact lookups"""
+
+    def __init__(self, lineage):
+        self._index_objects(lineage)
+        self.forward = defaultdict(set)
+        self.reverse = defaultdict(set)
+        self.edge_queries = defaultdict(set)
+        for source, target, query_id, _ in lineage['dependencies'].iter_tuples():
+            self._add_edge(source, target, query_id)
+        self._traversals = {}
+
+    def _index_objects(self, lineage):
+        self.object_types = {}
+        self.object_topics = {}
+        self.topic_index = defaultdict(set)
+        for bucket, object_type in (('streams', 'STREAM'), ('tables', 'TABLE')):
+            for name, info in lineage[bucket].items():
+                self.object_types[name] = object_type
+                self.object_topics[name] = info.get('topic', '')
+                if info.get('topic'):
+                    self.topic_index[info['topic']].add(name)
+
+    def _add_edge(self, source: str, target: str, query_id: str):
+        if source == 'EXTERNAL_SOURCE':
+            return
+        self.forward[source].add(target)
+        self.reverse[target].add(source)
+        self.edge_queries[(source, target)].add(query_id)
+
+    def _remove_edge(self, source: str, target: str, query_id: str):
+        queries = self.edge_queries.get((source, target))
+        if not queries:
+            return
+        queries.discard(query_id)
+        if not queries:
+            del self.edge_queries[(source, target)]
+            self.forward[source].discard(target)
+            self.reverse[target].discard(source)
+
+    def apply_diff(self, lineage, diff):
+        """Patch the indexes with a LineageSnapshotCache.diff instead of rebuilding them"""
+        if diff['added_objects'] or diff['removed_objects']:
+            self._index_objects(lineage)
+        else:
+            for name in self.object_types:
+                info = lineage['streams'].get(name) or lineage['tables'].get(name) or {}
+                if info.get('topic', '') != self.object_topics[name]:
+                    self._index_objects(lineage)
+                    break
+        for edge in diff['removed_edges']:
+            self._remove_edge(edge['source'], edge['target'], edge['query_id'])
+        for edge in diff['added_edges']:
+            self._add_edge(edge['source'], edge['target'], edge['query_id'])
+        self._traversals.clear()
+
+    def resolve_name(self, name: str):
+        """Match an object name as given, falling back to ksqlDB's upper-cased form"""
+        if name in self.object_types or name in self.forward or name in self.reverse:
+            return name
+        cluster, separator, object_name = name.rpartition(CLUSTER_SEPARATOR)
+        if cluster and f"{cluster}{separator}{object_name.upper()}" in self.object_types:
+            return f"{cluster}{separator}{object_name.upper()}"
+        return name.upper()
+
+    def _traverse(self, start: str, direction: str, depth: int = None):
+        """Breadth-first closure from start: {name: (distance, predecessor)}; memoized per query"""
+        key = (direction, start, depth)
+        if key in self._traversals:
+            return self._traversals[key]
+        index = self.forward if direction == 'downstream' else self.reverse
+        found = {}
+        frontier = [start]
+        distance = 0
+        while frontier and (depth is None or distance < depth):
+            distance += 1
+            next_frontier = []
+            for node in frontier:
+                for neighbour in index.get(node, ()):
+                    if neighbour != start and neighbour not in found:
+                        found[neighbour] = (distance, node)
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        self._traversals[key] = found
+        return found
+
+    def downstream(self, name: str, depth: int = None):
+        return self._traverse(self.resolve_name(name), 'downstream', depth)
+
+    def upstream(self, name: str, depth: int = None):
+        return self._traverse(self.resolve_name(name), 'upstream', depth)
+
+    def impact(self, topic: str, depth: int = None):
+        """Objects reading the topic (distance 0) plus everything downstream of them"""
+        found = {}
+        for name in sorted(self.topic_index.get(topic, ())):
+            found[name] = (0, None)
+        for name in list(found):
+            for node, (distance, via) in self.downstream(name, depth).items():
+                if node not in found or distance < found[node][0]:
+                    found[node] = (distance, via)
+        return found
+
+    def via_queries(self, source: str, target: str):
+        return sorted(self.edge_queries.get((source, target), ()))
+
+    def print_traversal(self, title: str, found, reverse: bool = False, elapsed_ms: float = 0.0):
+        print(f"\n{title} ({len(found)} objects, {elapsed_ms:.2f} ms)")
+        print("-" * 80)
+        if not found:
+            print("  (none)")
+        for name, (distance, via) in sorted(found.items(), key=lambda item: (item[1][0], item[0])):
+            object_type = self.object_types.get(name, 'EXTERNAL')
+            topic = self.object_topics.get(name, '')
+            line = f"  [{distance}] {name} ({object_type})"
+            if topic:
+                line += f" topic={topic}"
+            if via is not None:
+                if reverse:
+                    line += f" via {', '.join(self.via_queries(name, via))} into {via}"
+                else:
+                    line += f" via {', '.join(self.via_queries(via, name))} from {via}"
+            print(line)
+
+
+class ColumnLineage:
+    """Output columns of every CSAS/CTAS/INSERT INTO mapped to the input columns they derive from
+
+    Object schemas are resolved once and memoized: columns carried by SHOW ... EXTENDED,
+    then a DESCRIBE <obj> EXTENDED fetched at most once per object, then the output of the
+    query that created the object (so SELECT * chains expand each upstream schema once),
+    then the column list of its CREATE statement.
+    """
+
+    def __init__(self, lineage, describe=None):
+        self.lineage = lineage
+        self.describe = describe
+        self.schemas = {}
+        self.schema_sets = {}
+        self.statements = {}
+        self.outputs = {}
+        self.creators = {}
+        self.consumers = defaultdict(list)
+        self.readers = defaultdict(set)
+        self.objects = {name: info for bucket in ('streams', 'tables') for name, info in lineage[bucket].items()}
+        self.describe_calls = 0
+        self.star_expansions = 0
+        
+        for query_id, query in lineage['queries'].items():
+            sql = query['sql'] or lineage['explains'].get(query_id, {}).get('statementText', '')
+            parsed = parse_select_statement(sql) if sql else None
+            self.statements[query_id] = parsed
+            if parsed and parsed['kind'] == 'CREATE_AS':
+                self.creators.setdefault(self._qualify(query_id, parsed['sink']), query_id)
+
+    def _qualify(self, query_id: str, name: str):
+        cluster = self.lineage['queries'][query_id].get('cluster')
+        return f"{cluster}{CLUSTER_SEPARATOR}{name}" if cluster else name
+
+    def resolve_name(self, name: str):
+        """Match an object name as given, falling back to ksqlDB's upper-cased form"""
+        if name in self.objects:
+            return name
+        cluster, separator, object_name = name.rpartition(CLUSTER_SEPARATOR)
+        return f"{cluster}{separator}{object_name.upper()}"
+
+    def schema(self, name: str):
+        """Column names of an object, resolved once"""
+        columns = self.schemas.get(name)
+        if columns is not None:
+            return columns
+        self.schemas[name] = ()  # guards against cyclic pipelines while resolving
+        
+        columns = self.objects.get(name, {}).get('columns')
+        detail = self.lineage['descriptions'].get(name)
+        if columns is None and detail is None and self.describe and name in self.objects:
+            self.describe_calls += 1
+            detail = self.describe(name)
+            if detail is not None:
+                self.lineage['descriptions'][name] = detail
+        if columns is None and detail and detail.get('fields'):
+            columns = [field['name'] for field in detail['fields'] if field.get('name')]
+        if columns is None and name in self.creators:
+            columns = list(dict.fromkeys(column for _, column, _, _, _ in self.query_columns(self.creators[name])))
+        if columns is None and detail and detail.get('statement'):
+            columns = parse_column_definitions(detail['statement'])
+        
+        columns = tuple(columns or ())
+        self.schemas[name] = columns
+        self.schema_sets[name] = frozenset(columns)
+        return columns
+
+    def _resolve(self, ref, sources):
+        """Object a (qualifier, column) reference reads from, given the query's (object, alias) sources"""
+        qualifier, column = ref
+        if qualifier is not None:
+            for source, alias in sources:
+                if qualifier in (alias.upper(), alias, source.rpartition(CLUSTER_SEPARATOR)[2]):
+                    return source
+        for source, _ in sources:
+            self.schema(source)
+            if column in self.schema_sets[source]:
+                return source
+        return sources[0][0] if sources else None
+
+    def query_columns(self, query_id: str):
+        """[(target, column, expression, [(source, source_column)], transform)] for one query, memoized"""
+        outputs = self.outputs.get(query_id)
+        if outputs is not None:
+            return outputs
+        self.outputs[query_id] = outputs = []
+        parsed = self.statements.get(query_id)
+        if not parsed:
+            return outputs
+        
+        target = self._qualify(query_id, parsed['sink'])
+        sources = [(self._qualify(query_id, name), alias) for name, alias in parsed['sources']]
+        for item in parsed['items']:
+            if item['star']:
+                self.star_expansions += 1
+                chosen = [(source, alias) for source, alias in sources
+                          if item['star'] == '*' or item['star'] in (alias.upper(), alias)]
+                prefixed = len(sources) > 1
+                for source, alias in chosen:
+                    for column in self.schema(source):
+                        name = f"{alias.upper()}_{column}" if prefixed else column
+                        outputs.append((target, name, '*', [(source, column)], 'star'))
+                continue
+            inputs = []
+            for ref in item['refs']:
+                source = self._resolve(ref, sources)
+                if source is not None and (source, ref[1]) not in inputs:
+                    inputs.append((source, ref[1]))
+            transform = 'direct' if item['direct'] else 'derived'
+            outputs.append((target, item['alias'], item['expression'], inputs, transform))
+        
+        for _, column, _, inputs, transform in outputs:
+            for source_column in inputs:
+                self.consumers[source_column].append((target, column, query_id, transform))
+                if transform != 'star':
+                    self.readers[source_column].add(query_id)
+        for ref in parsed['referenced']:
+            source = self._resolve(ref, sources)
+            if source is not None:
+                self.readers[(source, ref[1])].add(query_id)
+        return outputs
+
+    def build(self):
+        for query_id in self.lineage['queries']:
+            self.query_columns(query_id)
+        return self
+
+    def __len__(self):
+        return sum(len(outputs) for outputs in self.outputs.values())
+
+    def iter_rows(self):
+        """(target, column, source, source_column, query_id, transform, expression) per column edge"""
+        for query_id, outputs in self.outputs.items():
+            for target, column, expression, inputs, transform in outputs:
+                if not inputs:
+                    yield target, column, '', '', query_id, transform, expression
+                for source, source_column in inputs:
+                    yield target, column, source, source_column, query_id, transform, expression
+
+    def blast_radius(self, name: str, column: str):
+        """Columns that disappear or change, and the queries reading them, if name.column is dropped
+
+        Returns ({(object, column): (hop, query_id, transform, from)}, {query_id: {(object, column)}}).
+        Only the queries reading name.column itself break; the others read columns that change.
+        """
+        start = (name, column)
+        affected = {}
+        broken = defaultdict(set)
+        frontier = [start]
+        hop = 0
+        while frontier:
+            hop += 1
+            next_frontier = []
+            for node in frontier:
+                for query_id in self.readers.get(node, ()):
+                    broken[query_id].add(node)
+                for target, target_column, query_id, transform in self.consumers.get(node, ()):
+                    key = (target, target_column)
+                    if key != start and key not in affected:
+                        affected[key] = (hop, query_id, transform, node)
+                        next_frontier.append(key)
+            frontier = next_frontier
+        return affected, dict(broken)
+
+    def print_summary(self, elapsed_ms: float = 0.0):
+        print(f"\nCOLUMN LINEAGE ({len(self)} output columns across {len(self.outputs)} queries, {elapsed_ms:.1f} ms)")
+        print("-" * 80)
+        print(f"Schemas resolved: {len(self.schemas)} ({self.describe_calls} DESCRIBE calls, "
+              f"{self.star_expansions} SELECT * expansions)")
+
+    def resolve_field(self, field: str):
+        """(object, column) for an OBJ.COLUMN argument, upper-casing either part when needed"""
+        name, _, column = field.rpartition('.')
+        name = self.resolve_name(name)
+        return name, column if column in self.schema(name) else column.upper()
+
+    def print_blast_radius(self, name: str, column: str, affected, broken, elapsed_ms: float = 0.0):
+        breaks = sorted(query_id for query_id, columns in broken.items() if (name, column) in columns)
+        print(f"\nBLAST RADIUS OF DROPPING {name}.{column} ({len(affected)} columns, {len(breaks)} queries broken, "
+              f"{len(broken) - len(breaks)} affected, {elapsed_ms:.2f} ms)")
+        print("-" * 80)
+        if column not in self.schema_sets.get(name, ()):
+            print(f"  Note: {column} is not in the known schema of {name}")
+        # First hop: the query reads the dropped column itself; deeper readers only see a changed input
+        for query_id, columns in sorted(broken.items(), key=lambda item: ((name, column) not in item[1], item[0])):
+            reads = ', '.join(f"{obj}.{col}" for obj, col in sorted(columns))
+            label = 'Breaks' if (name, column) in columns else 'Affected'
+            print(f"  {label} {query_id} (reads {reads})")
+        for (obj, col), (hop, query_id, transform, origin) in sorted(affected.items(),
+                                                                       key=lambda item: (item[1][0], item[0])):
+            action = 'dropped' if transform == 'star' else 'loses its input'
+            print(f"  [{hop}] {obj}.{col} {action} via {query_id} from {origin[0]}.{origin[1]}")
+        if not affected and not broken:
+            print("  (none)")
+
+
+# "name: value" pairs in the statistics/errorStats strings of DESCRIBE ... EXTENDED
+STATISTIC_PATTERN = re.compile(r'([A-Za-z][\w-]*):\s*(\S+)')
+
+
+def parse_runtime_statistics(text):
+    """{metric: value} from a ksqlDB statistics string; numeric values become floats"""
+    stats = {}
+    for name, value in STATISTIC_PATTERN.findall(text or ''):
+        try:
+            stats[name] = float(value)
+        except ValueError:
+            stats[name] = value
+    return stats
+
+
+def _host_statistics(hosts):
+    """Per-host stat lists (clusterStatistics/clusterErrorStats) summed across hosts"""
+    totals = defaultdict(float)
+    for host in hosts or ():
+        for stat in (host.get('stats') or ()) if isinstance(host, dict) else ():
+            if isinstance(stat.get('value'), (int, float)) and stat.get('name'):
+                totals[stat['name']] += stat['value']
+    return totals
+
+
+def runtime_metrics(description):
+    """Throughput, error and lag figures of one sourceDescription; absent metrics are left out"""
+    stats = parse_runtime_statistics(description.get('statistics'))
+    errors = parse_runtime_statistics(description.get('errorStats'))
+    for totals, hosts in ((stats, description.get('clusterStatistics')), (errors, description.get('clusterErrorStats'))):
+        for name, value in _host_statistics(hosts).items():
+            totals[name] = value + (totals[name] if isinstance(totals.get(name), float) else 0.0)
+
+    def number(source, *names):
+        for name in names:
+            if isinstance(source.get(name), float):
+                return source[name]
+        return None
+
+    metrics = {
+        'messages_per_sec': number(stats, 'messages-per-sec'),
+        'consumer_messages_per_sec': number(stats, 'consumer-messages-per-sec'),
+        'total_messages': number(stats, 'total-messages', 'consumer-total-messages'),
+        'failed_messages_per_sec': number(errors, 'consumer-failed-messages-per-sec', 'failed-messages-per-sec'),
+        'failed_messages': number(errors, 'consumer-failed-messages', 'failed-messages'),
+        'last_message': stats.get('last-message'),
+    }
+    lags = [value for name, value in stats.items() if 'lag' in name and isinstance(value, float)]
+    if lags:
+        metrics['lag'] = sum(lags)
+    failed = metrics['failed_messages_per_sec']
+    processed = metrics['consumer_messages_per_sec'] or metrics['messages_per_sec'] or 0.0
+    if failed is not None:
+        metrics['error_rate'] = failed / (processed + failed) if processed + failed else 0.0
+    return {name: value for name, value in metrics.items() if value is not None}
+
+
+def format_rate(rate):
+    return 'n/a' if rate is None else f"{rate:,.1f} msg/s"
+
+
+class RuntimeProfile:
+    """Runtime statistics attached to lineage nodes and edges, with bottleneck and fan-out analysis
+
+    Nodes carry the metrics of their DESCRIBE ... EXTENDED statistics. Each edge carries
+    the rates of its source and sink plus the state of the query linking them. The
+    bottleneck of a source→sink pair is the slowest node on the widest path between
+    them, i.e. the node capping what that pipeline can move.
+    """
+
+    def __init__(self, lineage, graph=None):
+        self.lineage = lineage
+        self.graph = graph or LineageGraph(lineage)
+        self.nodes = {}
+        self.edges = {}
+
+    def attach(self):
+        """Compute node and edge metrics from lineage['descriptions'] and store them in lineage['runtime']"""
+        for name, description in self.lineage['descriptions'].items():
+            if name in self.graph.object_types and isinstance(description, dict):
+                self.nodes[name] = runtime_metrics(description)
+        queries = self.lineage['queries']
+        for (source, target), query_ids in self.graph.edge_queries.items():
+            for query_id in query_ids:
+                self.edges[(source, target, query_id)] = {
+                    'source_messages_per_sec': self.throughput(source),
+                    'sink_messages_per_sec': self.throughput(target),
+                    'status': queries.get(query_id, {}).get('status', '')
+                }
+        self.lineage['runtime'] = {
+            'collected_at': datetime.now().isoformat(),
+            'objects': self.nodes,
+            'edges': [dict(metrics, source=source, target=target, query_id=query_id)
+                      for (source, target, query_id), metrics in self.edges.items()]
+        }
+        return self
+
+    def throughput(self, name: str):
+        """Messages/sec written to the object, or read from it when nothing is written"""
+        metrics = self.nodes.get(name)
+        if not metrics:
+            return None
+        rate = metrics.get('messages_per_sec')
+        return rate if rate is not None else metrics.get('consumer_messages_per_sec')
+
+    def _rates(self):
+        """{name: throughput} for every node with a known rate"""
+        rates = {}
+        for name in self.nodes:
+            rate = self.throughput(name)
+            if rate is not None:
+                rates[name] = rate
+        return rates
+
+    def _widest_paths(self, source: str, rates: dict):
+        """{node: (bottleneck rate, bottleneck node, predecessor)} over the paths from source maximising their slowest node"""
+        forward = self.graph.forward
+        rate = rates.get(source)
+        best = {source: (float('inf') if rate is None else rate, None if rate is None else source, None)}
+        heap = [(-best[source][0], source)]
+        done = set()
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            width, limiter, _ = best[node]
+            for neighbour in forward.get(node, ()):
+                rate = rates.get(neighbour)
+                if rate is None or rate >= width:
+                    candidate, via = width, limiter
+                else:
+                    candidate, via = rate, neighbour
+                known = best.get(neighbour)
+                if known is None or candidate > known[0]:
+                    best[neighbour] = (candidate, via, node)
+                    heapq.heappush(heap, (-candidate, neighbour))
+        return best
+
+    def _pairs(self, rates: dict, counts: dict):
+        """Yield (rate, source, sink, bottleneck) per connected source→sink pair with known rates; tallies counts"""
+        forward = self.graph.forward
+        reverse = self.graph.reverse
+        for source in sorted(name for name in forward if forward[name] and not reverse.get(name)):
+            for sink, (rate, limiter, _) in self._widest_paths(source, rates).items():
+                if sink == source or forward.get(sink) or limiter is None:
+                    continue
+                counts[limiter] += 1
+                yield rate, source, sink, limiter
+
+    def bottlenecks(self, top: int = 10):
+        """([(rate, bottleneck, source, sink, path)] for the top slowest pairs, pair count, {bottleneck: pairs it caps}
+
+        Only the top pairs are kept while scanning; their paths are rebuilt afterwards from
+        one more widest-path pass per source involved.
+        """
+        rates = self._rates()
+        capped = defaultdict(int)
+        slowest = heapq.nsmallest(top, self._pairs(rates, capped))
+        paths = {}
+        for source in {source for _, source, _, _ in slowest}:
+            paths[source] = self._widest_paths(source, rates)
+        found = []
+        for rate, source, sink, limiter in slowest:
+            best = paths[source]
+            path = [sink]
+            while best[path[-1]][2] is not None:
+                path.append(best[path[-1]][2])
+            found.append((rate, limiter, source, sink, path[::-1]))
+        return found, sum(capped.values()), capped
+
+    def hotspots(self):
+        """[(fan_out, reader queries, consumer rate, name)] for objects read by anything, busiest first"""
+        spots = []
+        for name, targets in self.graph.forward.items():
+            if not targets:
+                continue
+            readers = set()
+            for target in targets:
+                readers.update(self.graph.edge_queries.get((name, target), ()))
+            consumed = self.nodes.get(name, {}).get('consumer_messages_per_sec')
+            spots.append((len(targets), len(readers), consumed, name))
+        spots.sort(key=lambda spot: (-spot[0], -spot[1], -(spot[2] or 0.0), spot[3]))
+        return spots
+
+    def failing(self):
+        """[(failed/sec, error rate, name)] for objects reporting failed messages"""
+        failing = [(metrics.get('failed_messages_per_sec', 0.0), metrics.get('error_rate', 0.0), name)
+                   for name, metrics in self.nodes.items()
+                   if metrics.get('failed_messages_per_sec') or metrics.get('error_rate')]
+        return sorted(failing, key=lambda item: (-item[1], -item[0], item[2]))
+
+    def print_report(self, top: int = 10):
+        started = time.perf_counter()
+        bottlenecks, pairs, capped = self.bottlenecks(top)
+        hotspots = self.hotspots()
+        failing = self.failing()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        measured = sum(1 for name in self.nodes if self.throughput(name) is not None)
+        print(f"\nRUNTIME BOTTLENECKS ({measured}/{len(self.graph.object_types)} objects with throughput, "
+              f"{len(self.edges)} edges, analysed in {elapsed_ms:.1f} ms)")
+        print("-" * 80)
+        print(f"Slowest source→sink paths ({pairs} pairs, showing {len(bottlenecks)}):")
+        if not bottlenecks:
+            print("  (no source→sink paths with throughput statistics)")
+        for rate, limiter, source, sink, path in bottlenecks:
+            metrics = self.nodes.get(limiter, {})
+            extras = f", lag {metrics['lag']:,.0f}" if 'lag' in metrics else ''
+            if metrics.get('error_rate'):
+                extras += f", {metrics['error_rate']:.1%} errors"
+            print(f"  {source} → {sink}: bottleneck {limiter} at {format_rate(rate)}{extras}")
+            print(f"      path: {' → '.join(path)}")
+        if capped:
+            ranked = sorted(capped.items(), key=lambda item: (-item[1], item[0]))[:top]
+            print(f"  Limiting nodes: {', '.join(f'{name} ({count} paths)' for name, count in ranked)}")
+
+        print(f"\nFan-out hotspots (showing {min(top, len(hotspots))} of {len(hotspots)}):")
+        for fan_out, readers, consumed, name in hotspots[:top]:
+            print(f"  {name} ({self.graph.object_types.get(name, 'EXTERNAL')}): feeds {fan_out} objects "
+                  f"via {readers} queries, consumed at {format_rate(consumed)}")
+        if not hotspots:
+            print("  (none)")
+
+        if failing:
+            print(f"\nObjects with failed messages ({len(failing)}):")
+            for failed, error_rate, name in failing[:top]:
+                print(f"  {name}: {failed:,.2f} failed/s ({error_rate:.1%} of processed)")
+        stopped = sorted({query_id for (_, _, query_id), metrics in self.edges.items()
+                          if metrics['status'] and metrics['status'] != 'RUNNING'})
+        if stopped:
+            print(f"\nQueries not RUNNING ({len(stopped)}): {', '.join(stopped[:top])}"
+                  f"{' ...' if len(stopped) > top else ''}")
+
+
+class LineageTopology:
+    """Whole-graph structure in linear time: cycles, deploy order, depth, fan-in/out and components
+
+    Tarjan's algorithm finds the strongly connected components (INSERT INTO loops)
+    and emits them in reverse topological order, so the condensation is ordered for
+    free. Levels (longest distance from a source) follow by dynamic programming over
+    that order, each component's level computed once from its predecessors'. Objects
+    in one cycle share a level and must be deployed or torn down together.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        names = set(graph.object_types)
+        names.update(name for name, targets in graph.forward.items() if targets)
+        names.update(name for name, sources in graph.reverse.items() if sources)
+        self.nodes = sorted(names)
+        self.index = index = {name: i for i, name in enumerate(self.nodes)}
+        forward = graph.forward
+        self.successors = [[index[target] for target in forward[name]] if name in forward else []
+                           for name in self.nodes]
+        self.predecessors = [[] for _ in self.nodes]
+        for node, targets in enumerate(self.successors):
+            for target in targets:
+                self.predecessors[target].append(node)
+        self.edge_count = sum(len(targets) for targets in self.successors)
+        self._strongly_connected()
+        self._levels()
+        self._weak_components()
+
+    def _strongly_connected(self):
+        """Iterative Tarjan: self.component[node] and self.components, sinks first"""
+        successors = self.successors
+        count = len(self.nodes)
+        order = [-1] * count
+        low = [0] * count
+        cursor = [0] * count
+        on_stack = [False] * count
+        stack = []
+        component = [-1] * count
+        components = []
+        counter = 0
+        for root in range(count):
+            if order[root] != -1:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [root]
+            while work:
+                node = work[-1]
+                targets = successors[node]
+                position = cursor[node]
+                descended = False
+                while position < len(targets):
+                    target = targets[position]
+                    position += 1
+                    if order[target] == -1:
+                        order[target] = low[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack[target] = True
+                        work.append(target)
+                        descended = True
+                        break
+                    if on_stack[target] and order[target] < low[node]:
+                        low[node] = order[target]
+                cursor[node] = position
+                if descended:
+                    continue
+                work.pop()
+                if work and low[node] < low[work[-1]]:
+                    low[work[-1]] = low[node]
+                if low[node] == order[node]:
+                    members = []
+                    label = len(components)
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = label
+                        members.append(member)
+                        if member == node:
+                            break
+                    components.append(members)
+        self.component = component
+        self.components = components
+
+    def _levels(self):
+        """Longest distance from a source per component, with the predecessor that sets it"""
+        component = self.component
+        self.level = [0] * len(self.components)
+        self.via = [None] * len(self.components)
+        for current in range(len(self.components) - 1, -1, -1):
+            depth = self.level[current] + 1
+            for member in self.components[current]:
+                for target in self.successors[member]:
+                    downstream = component[target]
+                    if downstream != current and depth > self.level[downstream]:
+                        self.level[downstream] = depth
+                        self.via[downstream] = member
+
+    def _weak_components(self):
+        self.weak = [-1] * len(self.nodes)
+        self.weak_sizes = []
+        for root in range(len(self.nodes)):
+            if self.weak[root] != -1:
+                continue
+            label = len(self.weak_sizes)
+            self.weak[root] = label
+            frontier = [root]
+            size = 0
+            while frontier:
+                node = frontier.pop()
+                size += 1
+                for neighbour in itertools.chain(self.successors[node], self.predecessors[node]):
+                    if self.weak[neighbour] == -1:
+                        self.weak[neighbour] = label
+                        frontier.append(neighbour)
+            self.weak_sizes.append(size)
+
+    def cycles(self):
+        """Lists of object names that feed each other, largest first"""
+        found = []
+        for members in self.components:
+            if len(members) > 1 or members[0] in self.successors[members[0]]:
+                found.append(sorted(self.nodes[member] for member in members))
+        return sorted(found, key=lambda names: (-len(names), names))
+
+    def deploy_order(self):
+        """[(level, name)] with every object after everything it reads from; tear down in reverse"""
+        return sorted((self.level[self.component[node]], self.nodes[node]) for node in range(len(self.nodes)))
+
+    def longest_chain(self):
+        """One longest source→sink chain as a list of steps; each step lists its names (several for a cycle)"""
+        if not self.nodes:
+            return []
+        deepest = max(range(len(self.nodes)), key=lambda node: (self.level[self.component[node]], -node))
+        chain = [self.component[deepest]]
+        while self.via[chain[-1]] is not None:
+            chain.append(self.component[self.via[chain[-1]]])
+        return [sorted(self.nodes[member] for member in self.components[step]) for step in reversed(chain)]
+
+    def fan(self, name: str):
+        """(fan_in, fan_out) of an object"""
+        node = self.index[name]
+        return len(self.predecessors[node]), len(self.successors[node])
+
+    def subgraph(self, name: str, depth: int = 2):
+        """Object names within depth hops upstream or downstream of name, name included"""
+        name = self.graph.resolve_name(name)
+        return {name} | set(self.graph.upstream(name, depth)) | set(self.graph.downstream(name, depth))
+
+    @staticmethod
+    def _cycle_label(names, limit: int = 8):
+        shown = ' ⇄ '.join(names[:limit])
+        return shown if len(names) <= limit else f"{shown} ⇄ ... (+{len(names) - limit} more)"
+
+    def print_report(self, top: int = 10, elapsed_ms: float = 0.0):
+        cycles = self.cycles()
+        chain = self.longest_chain()
+        print(f"\nTOPOLOGY ({len(self.nodes)} objects, {self.edge_count} edges, analysed in {elapsed_ms:.1f} ms)")
+        print("-" * 80)
+        print(f"Connected components: {len(self.weak_sizes)} (largest: {max(self.weak_sizes, default=0)} objects)")
+        print(f"Pipeline depth: {max(self.level, default=0)}")
+        if chain:
+            steps = [names[0] if len(names) == 1 else f"({self._cycle_label(names)})" for names in chain]
+            print(f"Longest chain ({len(chain)} steps): {' → '.join(steps)}")
+        levels = defaultdict(int)
+        for level, _ in self.deploy_order():
+            levels[level] += 1
+        print(f"Deploy order: {len(levels)} levels "
+              f"({', '.join(f'L{level}: {count}' for level, count in sorted(levels.items())[:top])}"
+              f"{' ...' if len(levels) > top else ''}); tear down in reverse")
+        if cycles:
+            print(f"\nCycles ({len(cycles)}):")
+            for names in cycles[:top]:
+                print(f"  {len(names)} objects: {self._cycle_label(names)}")
+        else:
+            print("Cycles: none")
+        for title, adjacency in (('fan-in', self.predecessors), ('fan-out', self.successors)):
+            ranked = heapq.nsmallest(top, ((-len(edges), self.nodes[node]) for node, edges in enumerate(adjacency)))
+            ranked = [(-count, name) for count, name in ranked if count]
+            if ranked:
+                print(f"\nHighest {title}: {', '.join(f'{name} ({count})' for count, name in ranked)}")
+
+    def export_csv(self, base_filename: str):
+        """One row per object to <base>_topology.csv: deploy position, level, fan-in/out, component, cycle"""
+        filename = f"{base_filename}_topology.csv"
+        cycle_of = {}
+        for number, names in enumerate(self.cycles(), 1):
+            for name in names:
+                cycle_of[name] = number
+        weak = {name: self.weak[node] for node, name in enumerate(self.nodes)}
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Name', 'Type', 'Deploy_Order', 'Level', 'Fan_In', 'Fan_Out', 'Component', 'Cycle'])
+            for position, (level, name) in enumerate(self.deploy_order(), 1):
+                writer.writerow([name, self.graph.object_types.get(name, 'EXTERNAL'), position, level,
+                                 *self.fan(name), weak[name], cycle_of.get(name, '')])
+        log.info("✓ Topology exported to: %s (%d rows)", filename, len(self.nodes))
+
+
+def export_subgraph(lineage, names, base_filename: str, formats):
+    """Export only the relationships among names, so DOT output of a large lineage stays renderable"""
+    names = set(names)
+    view = {bucket: {name: info for name, info in lineage[bucket].items() if name in names}
+            for bucket in ('streams', 'tables')}
+    view['runtime'] = lineage.get('runtime')
+    rows = (row for row in iter_relationship_rows(lineage) if row[0] in names and row[2] in names)
+    return export_lineage_formats(view, base_filename, formats, rows=rows)
+
+
+def iter_relationship_rows(lineage):
+    """Yield (source, source_type, target, target_type, query_id, operation) straight from the store
+
+    Rows come out in the order of the legacy CSV (stream→stream, stream→table,
+    table→stream, table→table); object types are resolved once per name id.
+    """
+    store = lineage['dependencies']
+    names = store.names.names
+    object_types = {name: 'STREAM' for name in lineage['streams']}
+    object_types.update({name: 'TABLE' for name in lineage['tables'] if name not in object_types})
+    type_by_id = [object_types.get(name) for name in names]
+    for source_type, target_type in RELATIONSHIP_BUCKETS.values():
+        for source, target, query, dep_type in store.iter_ids():
+            if type_by_id[source] == source_type and type_by_id[target] == target_type:
+                yield names[source], source_type, names[target], target_type, names[query], names[dep_type]
+
+
+class CsvRelationshipWriter:
+    """<base>_relationships.csv, only created when there is at least one row"""
+
+    suffix = '_relationships.csv'
+    lazy = True
+
+    def __init__(self, f, lineage):
+        self.writer = csv.writer(f)
+        self.writer.writerow(['Source', 'Source_Type', 'Target', 'Target_Type', 'Query_ID', 'Operation'])
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        pass
+
+
+class JsonLinesRelationshipWriter:
+    """<base>_relationships.jsonl, one relationship object per line"""
+
+    suffix = '_relationships.jsonl'
+    lazy = True
+    template = ('{"source": %s, "source_type": %s, "target": %s, "target_type": %s, '
+                '"query_id": %s, "operation": %s}\n')
+
+    def __init__(self, f, lineage):
+        self.f = f
+
+    def write(self, row):
+        self.f.write(self.template % tuple(map(encode_basestring, row)))
+
+    def close(self):
+        pass
+
+
+def dot_quote(value: str):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class QuoteCache(dict):
+    """Memoizes a quoting function; object names repeat across many edges"""
+
+    def __init__(self, quote):
+        super().__init__()
+        self.quote = quote
+
+    def __missing__(self, value):
+        quoted = self[value] = self.quote(value)
+        return quoted
+
+
+class DotLineageWriter:
+    """<base>.dot: topics, objects and queries in the layout ksql-data-linage.sh used"""
+
+    suffix = '.dot'
+    lazy = False
+
+    def __init__(self, f, lineage):
+        self.f = f
+        self.lineage = lineage
+        self.q = QuoteCache(dot_quote)
+        self.queries_seen = set()
+        self.outputs_seen = set()
+        self.targets = set()
+        f.write("digraph ksql_lineage {\n  rankdir=LR;\n")
+        f.write("  node [shape=box];\n")
+
+    def write(self, row):
+        source, _, target, _, query_id, _ = row
+        f = self.f
+        q = self.q
+        if query_id not in self.queries_seen:
+            self.queries_seen.add(query_id)
+            f.write(f"  {q[query_id]} [shape=ellipse];\n")
+        f.write(f"  {q[source]} -> {q[query_id]} [label=\"Query Input\"];\n")
+        if (query_id, target) not in self.outputs_seen:
+            self.outputs_seen.add((query_id, target))
+            f.write(f"  {q[query_id]} -> {q[target]} [label=\"Query Output\"];\n")
+        self.targets.add(target)
+
+    def close(self):
+        f = self.f
+        for bucket, label in (('streams', 'Stream'), ('tables', 'Table')):
+            for name, info in self.lineage[bucket].items():
+                topic = info.get('topic')
+                if not topic:
+                    continue
+                if name in self.targets:
+                    f.write(f"  {dot_quote(name)} -> {dot_quote(topic)} [label=\"Sink Topic\"];\n")
+                else:
+                    f.write(f"  {dot_quote(topic)} -> {dot_quote(name)} [label=\"{label}\"];\n")
+        f.write("}\n")
+
+
+class GraphMLLineageWriter:
+    """<base>.graphml: object nodes with type/topic, edges with query_id/operation
+
+    After --runtime-stats, nodes also carry their throughput/error/lag metrics and
+    edges the rate of the sink they write.
+    """
+
+    suffix = '.graphml'
+    lazy = False
+    NODE_METRICS = ('messages_per_sec', 'consumer_messages_per_sec', 'error_rate', 'lag')
+
+    def __init__(self, f, lineage):
+        self.f = f
+        self.nodes = set()
+        self.attr = QuoteCache(xml_quoteattr)
+        self.text = QuoteCache(xml_escape)
+        runtime = lineage.get('runtime') or {}
+        self.node_metrics = runtime.get('objects', {})
+        self.edge_rates = {(edge['source'], edge['target'], edge['query_id']): edge['sink_messages_per_sec']
+                           for edge in runtime.get('edges', ()) if edge['sink_messages_per_sec'] is not None}
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                '  <key id="type" for="node" attr.name="type" attr.type="string"/>\n'
+                '  <key id="topic" for="node" attr.name="topic" attr.type="string"/>\n'
+                '  <key id="query_id" for="edge" attr.name="query_id" attr.type="string"/>\n'
+                '  <key id="operation" for="edge" attr.name="operation" attr.type="string"/>\n')
+        if runtime:
+            for metric in self.NODE_METRICS:
+                f.write(f'  <key id="{metric}" for="node" attr.name="{metric}" attr.type="double"/>\n')
+            f.write('  <key id="edge_messages_per_sec" for="edge" attr.name="messages_per_sec" attr.type="double"/>\n')
+        f.write('  <graph id="ksql_lineage" edgedefault="directed">\n')
+        for bucket, object_type in (('streams', 'STREAM'), ('tables', 'TABLE')):
+            for name, info in lineage[bucket].items():
+                self._node(name, object_type, info.get('topic', ''))
+
+    def _node(self, name: str, object_type: str, topic: str = ''):
+        if name in self.nodes:
+            return
+        self.nodes.add(name)
+        metrics = self.node_metrics.get(name)
+        data = ''.join(f'<data key="{metric}">{metrics[metric]}</data>'
+                       for metric in self.NODE_METRICS if metric in metrics) if metrics else ''
+        self.f.write(f'    <node id={self.attr[name]}><data key="type">{object_type}</data>'
+                     f'<data key="topic">{xml_escape(topic)}</data>{data}</node>\n')
+
+    def write(self, row):
+        source, source_type, target, target_type, query_id, operation = row
+        if source not in self.nodes:
+            self._node(source, source_type)
+        if target not in self.nodes:
+            self._node(target, target_type)
+        rate = self.edge_rates.get((source, target, query_id)) if self.edge_rates else None
+        data = f'<data key="edge_messages_per_sec">{rate}</data>' if rate is not None else ''
+        self.f.write(f'    <edge source={self.attr[source]} target={self.attr[target]}>'
+                     f'<data key="query_id">{self.text[query_id]}</data>'
+                     f'<data key="operation">{self.text[operation]}</data>{data}</edge>\n')
+
+    def close(self):
+        self.f.write('  </graph>\n</graphml>\n')
+
+
+EXPORT_WRITERS = {
+    'csv': CsvRelationshipWriter,
+    'jsonl': JsonLinesRelationshipWriter,
+    'dot': DotLineageWriter,
+    'graphml': GraphMLLineageWriter,
+}
+
+
+def export_lineage_formats(lineage, base_filename: str, formats, rows=None):
+    """Stream relationship rows once into every requested writer; returns {format: (filename, rows)}"""
+    rows = iter_relationship_rows(lineage) if rows is None else rows
+    opened = {}
+    pending = {}
+    for fmt in formats:
+        writer_class = EXPORT_WRITERS[fmt]
+        filename = f"{base_filename}{writer_class.suffix}"
+        if writer_class.lazy:
+            pending[fmt] = (writer_class, filename)
+        else:
+            f = open(filename, 'w', newline='')
+            opened[fmt] = (f, writer_class(f, lineage), filename)
+    
+    count = 0
+    try:
+        if pending:
+            # Row formats are only created once there is a row to write
+            for row in rows:
+                for fmt, (writer_class, filename) in pending.items():
+                    f = open(filename, 'w', newline='')
+                    opened[fmt] = (f, writer_class(f, lineage), filename)
+                rows = itertools.chain([row], rows)
+                break
+        writes = [writer.write for _, writer, _ in opened.values()]
+        if len(writes) == 1:
+            write = writes[0]
+            for row in rows:
+                count += 1
+                write(row)
+        else:
+            for row in rows:
+                count += 1
+                for write in writes:
+                    write(row)
+    finally:
+        for f, writer, _ in opened.values():
+            writer.close()
+            f.close()
+    
+    return {fmt: (filename, count) for fmt, (_, _, filename) in opened.items()}
+
+
+class Profiler:
+    """Timing spans, HTTP latencies and per-query parse times for --profile; a no-op until enabled
+
+    Disabled, span() hands back one shared null context and the record_* methods return
+    immediately, so instrumented hot paths pay a method call and nothing else.
+    """
+
+    SLOWEST = 20
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.requests = []
+        self.parses = []
+        self._null = contextlib.nullcontext()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    def span(self, name: str):
+        """Context manager adding wall and process CPU time to the named phase"""
+        if not self.enabled:
+            return self._null
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name: str):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add_span(self, name: str, wall: float, cpu: float = 0.0):
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = {'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                            'max_wall_seconds': 0.0}
+            stats['count'] += 1
+            stats['wall_seconds'] += wall
+            stats['cpu_seconds'] += cpu
+            stats['max_wall_seconds'] = max(stats['max_wall_seconds'], wall)
+
+    def record_request(self, statement: str, seconds: float, received: int, status):
+        if self.enabled:
+            self.requests.append((seconds, received, status, statement))
+
+    def record_parse(self, query_id: str, seconds: float, sql: str):
+        if self.enabled:
+            self.parses.append((seconds, query_id, sql))
+
+    @staticmethod
+    def percentiles(values):
+        if not values:
+            return {}
+        ordered = sorted(values)
+
+        def at(fraction):
+            return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+        return {'p50_ms': at(0.50), 'p90_ms': at(0.90), 'p95_ms': at(0.95), 'p99_ms': at(0.99),
+                'max_ms': round(ordered[-1] * 1000, 3), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)}
+
+    def report(self):
+        requests = list(self.requests)
+        parses = list(self.parses)
+        slowest_parses = sorted(parses, key=lambda parse: parse[0], reverse=True)[:self.SLOWEST]
+        slowest_requests = sorted(requests, key=lambda request: request[0], reverse=True)[:self.SLOWEST]
+        return {
+            'generated_at': datetime.now().isoformat(),
+            'total': {'wall_seconds': round(time.perf_counter() - self.started, 6),
+                      'cpu_seconds': round(time.process_time() - self.started_cpu, 6)},
+            'phases': {name: {key: round(value, 6) if isinstance(value, float) else value
+                              for key, value in stats.items()}
+                       for name, stats in sorted(self.spans.items())},
+            'http': dict({'requests': len(requests),
+                          'errors': sum(1 for request in requests if request[2] != 200),
+                          'bytes_received': sum(request[1] for request in requests)},
+                         **self.percentiles([request[0] for request in requests])),
+            'slowest_requests': [{'statement': statement, 'ms': round(seconds * 1000, 3), 'bytes': received,
+                                  'status': status} for seconds, received, status, statement in slowest_requests],
+            'parse': dict({'statements': len(parses), 'total_seconds': round(sum(parse[0] for parse in parses), 6)},
+                          **self.percentiles([parse[0] for parse in parses])),
+            'parse_ms_by_query': {query_id: round(seconds * 1000, 4) for seconds, query_id, _ in parses},
+            'slowest_statements': [{'query_id': query_id, 'ms': round(seconds * 1000, 4), 'length': len(sql),
+                                    'sql': ' '.join(sql.split())[:500]} for seconds, query_id, sql in slowest_parses]
+        }
+
+    def write(self, path: str):
+        report = self.report()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        log.info("✓ Profile written to: %s (%s requests, %s parsed statements, %d phases)",
+                 path, report['http']['requests'], report['parse']['statements'], len(report['phases']))
+
+
+PROFILER = Profiler()
+
+
+class CountingResponse:
+    """Counts the bytes read from a streamed response for the profiler"""
+
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status
+        self.received = 0
+
+    def read(self, amount: int = None):
+        data = self.response.read() if amount is None else self.response.read(amount)
+        self.received += len(data)
+        return data
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing request starts to at most `rate` per second"""
+
+    def __init__(self, rate: float = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def statement_of(payload: bytes):
+    """Whitespace-normalized ksql statement carried by a /ksql request payload"""
+    return ' '.join(json.loads(payload.decode('utf-8'))['ksql'].split())
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised without touching the network while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: opens after `threshold` failures, lets one trial through after `reset_after` seconds"""
+
+    def __init__(self, threshold: int = 5, reset_after: float = 30):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        if not self.threshold:
+            return
+        with self._lock:
+            if self.state == 'open':
+                remaining = self.reset_after - (time.monotonic() - self.opened_at)
+                if remaining > 0:
+                    raise CircuitOpenError(f"circuit open after {self.failures} consecutive failures; "
+                                           f"next trial in {remaining:.1f}s")
+                self.state = 'half-open'
+            if self.state == 'half-open':
+                if self.trial_in_flight:
+                    raise CircuitOpenError('circuit half-open; trial request in flight')
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                log.info("✓ Circuit closed: server is answering again")
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        if not self.threshold:
+            return
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == 'half-open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                log.warning("Circuit open: %d consecutive failures, failing fast for %ss",
+                            self.failures, self.reset_after)
+
+
+class LatencyTracker:
+    """Sliding window of successful request latencies per statement kind"""
+
+    def __init__(self, window: int = 200, min_samples: int = 5):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, seconds: float):
+        with self._lock:
+            samples = self.samples.get(kind)
+            if samples is None:
+                samples = self.samples[kind] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, kind: str, fraction: float):
+        """Latency at fraction (0-1) for kind, or None until min_samples have been seen"""
+        with self._lock:
+            samples = self.samples.get(kind)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def statement_kind(statement: str):
+    """Latency bucket for a statement: 'SHOW QUERIES', 'DESCRIBE', 'EXPLAIN', ..."""
+    words = statement.rstrip(';').split(None, 2)
+    if not words:
+        return ''
+    verb = words[0].upper()
+    if verb in ('SHOW', 'LIST') and len(words) > 1:
+        return f"{verb} {words[1].upper()}"
+    return verb
+
+
+class ResilientTransport:
+    """Request policy around a transport: retries with jittered backoff, hedging, adaptive timeouts and a breaker
+
+    Idempotent statements are retried on transient errors and overload statuses with
+    full-jitter exponential backoff. Read timeouts adapt per statement kind to
+    timeout_factor x the observed p99, clamped to [min_timeout, timeout]. With
+    hedge_percentile set, a buffered request still running past that latency
+    percentile gets a second copy and the first answer wins. Hedges use the inner
+    transport's reserved hedge_slots; when all are busy the request just waits on its
+    primary. Streamed responses are retried only before their body is handed out,
+    and are never hedged. Every attempt reports an outcome to the breaker, whatever
+    it raises.
+    """
+
+    def __init__(self, inner, retries: int = 3, backoff_base: float = 0.2, backoff_cap: float = 5.0,
+                 timeout: float = 30, min_timeout: float = 2.0, timeout_factor: float = 3.0,
+                 hedge_percentile: float = None, breaker: CircuitBreaker = None):
+        self.inner = inner
+        self.retries = max(0, retries)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.min_timeout = min(min_timeout, timeout)
+        self.timeout_factor = timeout_factor
+        self.hedge_fraction = hedge_percentile / 100.0 if hedge_percentile else None
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._hedge_pool = None
+        self._hedge_budget = threading.BoundedSemaphore(getattr(inner, 'hedge_slots', 0) or 1)
+        self._lock = threading.Lock()
+        self.stats = {'retries': 0, 'failed': 0, 'hedged': 0, 'hedge_wins': 0, 'hedges_skipped': 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _plan(self, payload: bytes):
+        statement = statement_of(payload)
+        kind = statement_kind(statement)
+        idempotent = kind.split(' ', 1)[0] in IDEMPOTENT_VERBS
+        return statement, kind, (self.retries + 1 if idempotent else 1), idempotent
+
+    def timeout_for(self, kind: str):
+        """Read timeout for the next request of this kind"""
+        p99 = self.latency.percentile(kind, 0.99)
+        if p99 is None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, p99 * self.timeout_factor))
+
+    def hedge_delay(self, kind: str, timeout: float):
+        if not self.hedge_fraction:
+            return None
+        delay = self.latency.percentile(kind, self.hedge_fraction)
+        return delay if delay is not None and delay < timeout else None
+
+    def backoff(self, attempt: int):
+        """Full-jitter exponential backoff before retry number attempt + 1"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def _retry(self, statement: str, attempt: int, attempts: int, reason):
+        """Record a failed attempt; sleep and return True if another attempt is allowed"""
+        self.breaker.record_failure()
+        if attempt + 1 >= attempts:
+            self._count('failed')
+            return False
+        delay = self.backoff(attempt)
+        self._count('retries')
+        log.debug("Retrying in %.2fs (attempt %d/%d, %s): %s", delay, attempt + 2, attempts, reason, statement)
+        time.sleep(delay)
+        return True
+
+    def _completed(self, kind: str, status: int, seconds: float):
+        if status not in RETRYABLE_STATUSES:
+            self.breaker.record_success()
+            self.latency.observe(kind, seconds)
+
+    def _send(self, payload: bytes, kind: str, timeout: float, idempotent: bool):
+        delay = self.hedge_delay(kind, timeout) if idempotent else None
+        if delay is None:
+            return self.inner.post(payload, timeout)
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=2 * getattr(self.inner, 'pool_size', 4),
+                                                      thread_name_prefix='ksql-hedge')
+        primary = self._hedge_pool.submit(self.inner.post, payload, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self._hedge_budget.acquire(blocking=False):
+            self._count('hedges_skipped')
+            return primary.result()
+        self._count('hedged')
+        if getattr(self.inner, 'hedge_slots', 0):
+            hedge = self._hedge_pool.submit(self.inner.post, payload, timeout, True)
+        else:
+            hedge = self._hedge_pool.submit(self.inner.post, payload, timeout)
+        hedge.add_done_callback(lambda _: self._hedge_budget.release())
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except TRANSIENT_ERRORS as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    self._count('hedge_wins')
+                return result
+        raise error
+
+    def post(self, payload: bytes, timeout: float = None):
+        statement, kind, attempts, idempotent = self._plan(payload)
+        for attempt in range(attempts):
+            self.breaker.before_request()
+            started = time.perf_counter()
+            try:
+                status, body = self._send(payload, kind, timeout or self.timeout_for(kind), idempotent)
+            except TRANSIENT_ERRORS as e:
+                if self._retry(statement, attempt, attempts, e):
+                    continue
+                raise
+            except BaseException:
+                # Anything else still ends the attempt; a half-open breaker must not wait on it forever
+                self.breaker.record_failure()
+                raise
+            if status in RETRYABLE_STATUSES and self._retry(statement, attempt, attempts, f"HTTP {status}"):
+                continue
+            self._completed(kind, status, time.perf_counter() - started)
+            return status, body
+
+    @contextlib.contextmanager
+    def stream(self, payload: bytes, timeout: float = None):
+        statement, kind, attempts, _ = self._plan(payload)
+        for attempt in range(attempts):
+            self.breaker.before_request()
+            started = time.perf_counter()
+            with contextlib.ExitStack() as stack:
+                try:
+                    response = stack.enter_context(self.inner.stream(payload, timeout or self.timeout_for(kind)))
+                    retry = response.status in RETRYABLE_STATUSES and attempt + 1 < attempts
+                    if retry:
+                        response.read()
+                except TRANSIENT_ERRORS as e:
+                    if self._retry(statement, attempt, attempts, e):
+                        continue
+                    raise
+                except BaseException:
+                    self.breaker.record_failure()
+                    raise
+                if not retry:
+                    # Latency up to the response headers; the body is consumed by the caller
+                    self._completed(kind, response.status, time.perf_counter() - started)
+                    if response.status in RETRYABLE_STATUSES:
+                        self._retry(statement, attempt, attempts, f"HTTP {response.status}")
+                    try:
+                        yield response
+                    except BaseException:
+                        # The body broke off (or its consumer failed) after the headers counted as a success
+                        self.breaker.record_failure()
+                        raise
+                    return
+            self._retry(statement, attempt, attempts, f"HTTP {response.status}")
+
+    def summary(self):
+        return dict(self.stats, breaker_trips=self.breaker.trips, breaker_state=self.breaker.state)
+
+    def close(self):
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.inner.close()
+        stats = self.summary()
+        if stats['retries'] or stats['hedged'] or stats['breaker_trips'] or stats['failed']:
+            log.info("Request policy: %d retries, %d hedged (%d won by the hedge, %d skipped at the hedge budget), "
+                     "%d circuit trips", stats['retries'], stats['hedged'], stats['hedge_wins'],
+                     stats['hedges_skipped'], stats['breaker_trips'])
+        if stats['failed']:
+            log.warning("Warning: %d requests failed after retries; lineage may be incomplete", stats['failed'])
+
+
+class TeeResponse:
+    """Response wrapper copying every byte read into a file"""
+
+    def __init__(self, response, f):
+        self.response = response
+        self.status = response.status
+        self.f = f
+
+    def read(self, amount: int = None):
+        data = self.response.read() if amount is None else self.response.read(amount)
+        self.f.write(data)
+        return data
+
+
+class RecordingTransport:
+    """Wraps a transport and saves every raw response plus an index for later --replay"""
+
+    def __init__(self, inner, directory: str, ksql_url: str):
+        os.makedirs(directory, exist_ok=True)
+        self.inner = inner
+        self.directory = directory
+        self.ksql_url = ksql_url
+        self.index = {}
+        self._lock = threading.Lock()
+
+    def _response_path(self, statement: str):
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', statement).strip('_').lower()[:60]
+        digest = hashlib.sha1(statement.encode('utf-8')).hexdigest()[:8]
+        return f"{slug}_{digest}.json"
+
+    def _record(self, statement: str, filename: str, status: int):
+        with self._lock:
+            self.index[statement] = {"file": filename, "status": status}
+
+    def post(self, payload: bytes):
+        status, body = self.inner.post(payload)
+        statement = statement_of(payload)
+        filename = self._response_path(statement)
+        with open(os.path.join(self.directory, filename), 'wb') as f:
+            f.write(body)
+        self._record(statement, filename, status)
+        return status, body
+
+    @contextlib.contextmanager
+    def stream(self, payload: bytes):
+        statement = statement_of(payload)
+        filename = self._response_path(statement)
+        with self.inner.stream(payload) as response, open(os.path.join(self.directory, filename), 'wb') as f:
+            yield TeeResponse(response, f)
+        self._record(statement, filename, response.status)
+
+    def close(self):
+        self.inner.close()
+        with open(os.path.join(self.directory, 'index.json'), 'w') as f:
+            json.dump({
+                "ksql_url": self.ksql_url,
+                "recorded_at": datetime.now().isoformat(),
+                "responses": self.index
+            }, f, indent=2)
+        log.info("✓ Recorded %d responses to: %s", len(self.index), self.directory)
+
+
+class ReplayResponse:
+    """Recorded response read back from disk in chunks, like an HTTP response"""
+
+    def __init__(self, status: int, f):
+        self.status = status
+        self.f = f
+
+    def read(self, amount: int = None):
+        return self.f.read() if amount is None else self.f.read(amount)
+
+
+class ReplayTransport:
+    """Answers requests from a directory written by --record; no network involved"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            index = json.load(f)
+        self.ksql_url = index.get('ksql_url', '')
+        self.recorded_at = index.get('recorded_at')
+        self.responses = index.get('responses', {})
+
+    def _lookup(self, payload: bytes):
+        statement = statement_of(payload)
+        entry = self.responses.get(statement)
+        if entry is None:
+            log.warning("Not recorded: %s", statement)
+        return entry
+
+    def post(self, payload: bytes):
+        entry = self._lookup(payload)
+        if entry is None:
+            return 404, b''
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            return entry['status'], f.read()
+
+    @contextlib.contextmanager
+    def stream(self, payload: bytes):
+        entry = self._lookup(payload)
+        if entry is None:
+            yield ReplayResponse(404, io.BytesIO())
+            return
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            yield ReplayResponse(entry['status'], f)
+
+    def close(self):
+        pass
+
 
 class KsqlDBLineageEnhanced:
     def __init__(self, ksql_url: str, username: str = None, password: str = None, 
                  api_key: str = None, api_secret: str = None, 
-                 verify_ssl: bool = True, ca_cert: str = None):
+                 verify_ssl: bool = True, ca_cert: str = None,
+                 pool_size: int = 4, connect_timeout: float = 10, timeout: float = 30,
+                 transport=None, parse_workers: int = None, request_policy: dict = None):
         self.ksql_url = f"{ksql_url}/ksql"
+        self.parse_workers = parse_workers
         self.username = username
         self.password = password
         self.api_key = api_key
         self.api_secret = api_secret
         self.verify_ssl = verify_ssl
         self.ca_cert = ca_cert
+        self.headers = self._build_headers()
+        self.ssl_context = self._build_ssl_context()
+        if transport is None:
+            # request_policy holds ResilientTransport options; breaker_threshold/breaker_reset configure its breaker
+            policy = dict(request_policy or {})
+            breaker = CircuitBreaker(policy.pop('breaker_threshold', 5), policy.pop('breaker_reset', 30))
+            # Hedges get a quarter of the pool on top of it instead of competing with primaries
+            hedge_slots = max(1, pool_size // 4) if policy.get('hedge_percentile') else 0
+            transport = ResilientTransport(KsqlHttpTransport(self.ksql_url, self.headers, self.ssl_context,
+                                                             pool_size=pool_size, connect_timeout=connect_timeout,
+                                                             read_timeout=timeout, hedge_slots=hedge_slots),
+                                           timeout=timeout, breaker=breaker, **policy)
+        self.transport = transport
+
+    def _build_headers(self):
+        """Build request headers once, including the Authorization header"""
+        headers = {
+            "Content-Type": "application/vnd.ksql.v1+json; charset=utf-8",
+            "Accept": "application/vnd.ksql.v1+json",
+            "User-Agent": "ksqlDB-Lineage-Tool/1.0"
+        }
+        
+        if self.username and self.password:
+            auth_string = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+            headers["Authorization"] = f"Basic {auth_string}"
+        elif self.api_key and self.api_secret:
+            auth_string = base64.b64encode(f"{self.api_key}:{self.api_secret}".encode()).decode()
+            headers["Authorization"] = f"Basic {auth_string}"
+        return headers
+
+    def _build_ssl_context(self):
+        """Build the SSL context once so the CA bundle is read a single time"""
+        if not self.ksql_url.startswith('https'):
+            return None
+        if not self.verify_ssl:
+            return ssl._create_unverified_context()
+        if self.ca_cert:
+            return ssl.create_default_context(cafile=self.ca_cert)
+        return ssl.create_default_context()
 
     def execute_ksql(self, ksql: str):
-        """Execute ksqlDB query using urllib (standard library)"""
+        """Execute ksqlDB query over the pooled keep-alive transport"""
+        started = time.perf_counter()
+        status, body = None, b''
         try:
-            print(f"Executing: {ksql}")
-            
+            log.debug("Executing: %s", ksql)
+
             payload = json.dumps({
                 "ksql": ksql,
                 "streamsProperties": {}
             }).encode('utf-8')
-            
-            headers = {
-                "Content-Type": "application/vnd.ksql.v1+json; charset=utf-8",
-                "Accept": "application/vnd.ksql.v1+json",
-                "User-Agent": "ksqlDB-Lineage-Tool/1.0"
-            }
-            
-            if self.username and self.password:
-                auth_string = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
-                headers["Authorization"] = f"Basic {auth_string}"
-            elif self.api_key and self.api_secret:
-                auth_string = base64.b64encode(f"{self.api_key}:{self.api_secret}".encode()).decode()
-                headers["Authorization"] = f"Basic {auth_string}"
-            
-            ssl_context = None
-            if not self.verify_ssl:
-                ssl_context = ssl._create_unverified_context()
-            elif self.ca_cert:
-                ssl_context = ssl.create_default_context(cafile=self.ca_cert)
-            
-            request = Request(self.ksql_url, data=payload, headers=headers, method='POST')
-            
-            if ssl_context:
-                response = urlopen(request, context=ssl_context, timeout=30)
-            else:
-                response = urlopen(request, timeout=30)
-            
-            print(f"Response status: {response.getcode()}")
-            
-            if response.getcode() == 200:
-                result = response.read().decode('utf-8')
-                return json.loads(result)
+
+            with PROFILER.span('execute_ksql'):
+                status, body = self.transport.post(payload)
+
+            log.debug("Response status: %s", status)
+
+            if status == 200:
+                return json.loads(body.decode('utf-8'))
             else:
-                print(f"Error: HTTP {response.getcode()}")
+                log.warning("Error: HTTP %s for %s", status, ksql)
                 return None
-                
+
         except Exception as e:
-            print(f"Error: {e}")
+            log.warning("Error: %s (%s)", e, ksql)
             return None
+        finally:
+            PROFILER.record_request(ksql, time.perf_counter() - started, len(body or b''), status)
+
+    def execute_ksql_stream(self, ksql: str, entity_type: str):
+        """Execute a SHOW statement and yield its entities as they are decoded off the socket
+
+        A body that breaks off or fails to decode raises instead of ending early, so
+        callers never mistake a partial entity list for the complete one.
+        """
+        started = time.perf_counter()
+        status, response = None, None
+        try:
+            log.debug("Executing: %s", ksql)
+
+            payload = json.dumps({
+                "ksql": ksql,
+                "streamsProperties": {}
+            }).encode('utf-8')
+
+            with self.transport.stream(payload) as raw_response:
+                response = CountingResponse(raw_response) if PROFILER.enabled else raw_response
+                status = response.status
+                log.debug("Response status: %s", status)
+
+                if status != 200:
+                    log.warning("Error: HTTP %s for %s", status, ksql)
+                    response.read()
+                    return
+                yield from self.parse_show_stream(iter_response_items(response), entity_type)
+        finally:
+            if PROFILER.enabled:
+                elapsed = time.perf_counter() - started
+                PROFILER.add_span('execute_ksql_stream', elapsed)
+                PROFILER.record_request(ksql, elapsed, getattr(response, 'received', 0), status)
+
+    def parse_show_stream(self, events, entity_type: str):
+        """Streaming counterpart of parse_show_response over iter_response_items events"""
+        for event in events:
+            if event[0] == 'entity':
+                _, key, entity = event
+                if (key == entity_type
+                        or (key == 'sourceDescriptions' and entity_type in ('streams', 'tables'))
+                        or (key == 'queryDescriptions' and entity_type == 'queries')):
+                    yield entity
+                continue
+            item = event[1]
+            if not isinstance(item, dict):
+                continue
+            if 'type' in item and item['type'] in ['STREAM', 'TABLE']:
+                yield item
+            elif entity_type == 'queries' and 'id' in item:
+                yield item
+            elif item.get('@type') == 'statement_error':
+                log.warning("Error: %s", item.get('message', item))
 
     def parse_show_response(self, response, entity_type: str):
         """Parse SHOW STREAMS/TABLES/QUERIES response"""
+        with PROFILER.span('parse_show_response'):
+            return self._parse_show_response(response, entity_type)
+
+    def _parse_show_response(self, response, entity_type: str):
         entities = []
         
         if isinstance(response, list):
@@ -88,12 +2969,29 @@ class KsqlDBLineageEnhanced:
                     # Also check for nested entities
                     elif entity_type in item and isinstance(item[entity_type], list):
                         entities.extend(item[entity_type])
+                    # SHOW ... EXTENDED wraps entities in sourceDescriptions/queryDescriptions
+                    elif entity_type in ('streams', 'tables') and isinstance(item.get('sourceDescriptions'), list):
+                        entities.extend(item['sourceDescriptions'])
+                    elif entity_type == 'queries' and isinstance(item.get('queryDescriptions'), list):
+                        entities.extend(item['queryDescriptions'])
                     # For queries, look for query-specific structure
                     elif entity_type == 'queries' and 'id' in item:
                         entities.append(item)
         
         return entities
 
+    def parse_describe_response(self, response, key: str):
+        """Return the sourceDescription/queryDescription body of a DESCRIBE/EXPLAIN response"""
+        if isinstance(response, list):
+            for item in response:
+                if isinstance(item, dict) and isinstance(item.get(key), dict):
+                    return item[key]
+        return None
+
+    def describe_source(self, name: str):
+        """sourceDescription from DESCRIBE <name> EXTENDED, or None"""
+        return self.parse_describe_response(self.execute_ksql(f"DESCRIBE {name} EXTENDED;"), 'sourceDescription')
+
     def extract_entity_info(self, entity, entity_type: str):
         """Extract standardized information from entity objects"""
         if not isinstance(entity, dict):
@@ -107,7 +3005,7 @@ class KsqlDBLineageEnhanced:
         format_val = entity.get('valueFormat', entity.get('format', ''))
         key_format = entity.get('keyFormat', '')
         
-        return {
+        info = {
             'name': name,
             'type': entity_type,
             'topic': topic,
@@ -115,6 +3013,10 @@ class KsqlDBLineageEnhanced:
             'key_format': key_format,
             'is_windowed': entity.get('isWindowed', False)
         }
+        if entity.get('fields'):
+            # SHOW ... EXTENDED carries the schema; keep just the column names for column lineage
+            info['columns'] = tuple(field['name'] for field in entity['fields'] if field.get('name'))
+        return info
 
     def debug_queries_and_sql(self):
         """Debug method to see exactly what queries and SQL exist"""
@@ -166,222 +3068,375 @@ class KsqlDBLineageEnhanced:
             print("No queries found at all")
 
     def parse_dependencies_from_sql(self, sql: str, query_id: str):
-        """Parse SQL to extract source and target relationships - enhanced patterns"""
+        """Parse SQL to extract source and target relationships with the single-pass tokenizer"""
         dependencies = []
         if not sql:
             return dependencies
-            
-        # Clean and normalize SQL
-        sql_clean = ' '.join(sql.split()).replace('\n', ' ').replace('\t', ' ')
-        sql_upper = sql_clean.upper()
-        
-        print(f"DEBUG: Parsing SQL for {query_id}: {sql_upper[:200]}...")
-        
-        # Pattern 1: CREATE STREAM/TABLE ... AS SELECT ... FROM ...
-        # More flexible pattern to handle different formatting
-        create_patterns = [
-            r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+AS\s+SELECT\s+.*?\s+FROM\s+(\w+)',
-            r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+WITH\s+.*?AS\s+SELECT\s+.*?\s+FROM\s+(\w+)',
-            r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+AS\s+SELECT\s+.*?\s+FROM\s+(\w+)\s+',
-        ]
-        
-        for pattern in create_patterns:
-            matches = re.findall(pattern, sql_upper, re.IGNORECASE | re.DOTALL)
-            for match in matches:
-                if len(match) == 3:
-                    object_type, target, source = match
-                    dependencies.append({
-                        "source": source,
-                        "target": target,
-                        "query_id": query_id,
-                        "type": f"CREATE_{object_type}"
-                    })
-                    print(f"✅ Found CREATE dependency: {source} -> {target}")
-        
-        # Pattern 2: INSERT INTO ... SELECT ... FROM ...
-        insert_patterns = [
-            r'INSERT\s+INTO\s+(\w+)\s+SELECT\s+.*?\s+FROM\s+(\w+)',
-            r'INSERT\s+INTO\s+(\w+)\s+SELECT\s+.*?\s+FROM\s+(\w+)\s+',
-        ]
-        
-        for pattern in insert_patterns:
-            matches = re.findall(pattern, sql_upper, re.IGNORECASE | re.DOTALL)
-            for match in matches:
-                if len(match) == 2:
-                    target, source = match
-                    dependencies.append({
-                        "source": source,
-                        "target": target,
-                        "query_id": query_id,
-                        "type": "INSERT_INTO"
-                    })
-                    print(f"✅ Found INSERT dependency: {source} -> {target}")
-        
-        # Pattern 3: CREATE STREAM/TABLE with WITH properties (source streams/tables)
-        if not dependencies:
-            create_source_pattern = r'CREATE\s+(TABLE|STREAM)\s+(\w+)\s+WITH\s*\('
-            matches = re.findall(create_source_pattern, sql_upper)
-            for match in matches:
-                if len(match) == 2:
-                    object_type, name = match
-                    dependencies.append({
-                        "source": "EXTERNAL_SOURCE",
-                        "target": name,
-                        "query_id": query_id,
-                        "type": f"SOURCE_{object_type}"
-                    })
-                    print(f"✅ Found SOURCE creation: EXTERNAL -> {name}")
         
-        if not dependencies:
-            print(f"❌ No dependencies found in SQL for {query_id}")
-            
+        if PROFILER.enabled:
+            with PROFILER.span('parse_dependencies_from_sql'):
+                started = time.perf_counter()
+                dependencies = statement_dependencies(parse_ksql_statement(sql), query_id)
+                PROFILER.record_parse(query_id, time.perf_counter() - started, sql)
+        else:
+            dependencies = statement_dependencies(parse_ksql_statement(sql), query_id)
+        if log.isEnabledFor(logging.DEBUG):
+            self._report_parsed(sql, query_id, dependencies)
         return dependencies
 
-    def build_comprehensive_lineage(self):
-        """Build comprehensive lineage"""
-        print("Building comprehensive ksqlDB lineage...")
-        
-        lineage = {
-            "streams": {},
-            "tables": {}, 
-            "queries": {},
-            "dependencies": [],
-            "relationships": {
-                "stream_to_stream": [],
-                "stream_to_table": [],
-                "table_to_stream": [],
-                "table_to_table": [],
-                "query_relationships": []
-            },
-            "metadata": {
-                "generated_at": datetime.now().isoformat(),
-                "ksql_url": self.ksql_url
-            }
+    def parse_sql_batch(self, items):
+        """Dependencies for each (query_id, sql) in order, on a process pool when the batch is large"""
+        if not items:
+            return []
+        started = time.perf_counter()
+        statements = [(query_id, sql) for query_id, sql in items if sql]
+        results, processes = parse_statements(statements, self.parse_workers, timed=PROFILER.enabled)
+        elapsed = time.perf_counter() - started
+        PROFILER.add_span('parse_sql_batch', elapsed)
+        mode = f"on {processes} processes" if processes > 1 else "serially"
+        log.info("Parsed %d statements %s in %.2fs", len(statements), mode, elapsed)
+        if PROFILER.enabled:
+            for (query_id, sql), (_, seconds) in zip(statements, results):
+                PROFILER.record_parse(query_id, seconds, sql)
+            results = [dependencies for dependencies, _ in results]
+        parsed = iter(results)
+        debug = log.isEnabledFor(logging.DEBUG)
+        batch = []
+        for query_id, sql in items:
+            dependencies = next(parsed) if sql else []
+            if sql and debug:
+                self._report_parsed(sql, query_id, dependencies)
+            batch.append(dependencies)
+        return batch
+
+    def _report_parsed(self, sql: str, query_id: str, dependencies):
+        log.debug("DEBUG: Parsing SQL for %s: %s...", query_id, ' '.join(sql.split())[:200])
+
+        for dep in dependencies:
+            if dep['source'] == 'EXTERNAL_SOURCE':
+                log.debug("✅ Found SOURCE creation: EXTERNAL -> %s", dep['target'])
+            elif dep['type'] == 'INSERT_INTO':
+                log.debug("✅ Found INSERT dependency: %s -> %s", dep['source'], dep['target'])
+            else:
+                log.debug("✅ Found CREATE dependency: %s -> %s", dep['source'], dep['target'])
+
+        if not dependencies:
+            log.debug("❌ No dependencies found in SQL for %s", query_id)
+
+    def _operation_for_query(self, query_id: str, sink: str, sql: str, lineage):
+        """Derive the dependency type from the query id, sink type or statement verb"""
+        if query_id.startswith('CSAS_'):
+            return 'CREATE_STREAM'
+        if query_id.startswith('CTAS_'):
+            return 'CREATE_TABLE'
+        if query_id.startswith('INSERTQUERY_') or sql.lstrip()[:6].upper() == 'INSERT':
+            return 'INSERT_INTO'
+        if sink in lineage['streams']:
+            return 'CREATE_STREAM'
+        if sink in lineage['tables']:
+            return 'CREATE_TABLE'
+        return 'QUERY'
+
+    def _resolve_query(self, query_id: str, query, lineage):
+        """Resolve one query's edges from metadata; returns (path, dependencies), or ('sql_parse', sql) when
+        only the statement text is left to parse"""
+        explain = lineage['explains'].get(query_id) or {}
+        if query['sources'] and query['sinks']:
+            path, sources, sinks = 'server_metadata', query['sources'], query['sinks']
+        elif explain.get('sources') and explain.get('sinks'):
+            path, sources, sinks = 'explain', explain['sources'], explain['sinks']
+        else:
+            return 'sql_parse', query['sql'] or explain.get('statementText', '')
+        
+        dependencies = []
+        for sink in dict.fromkeys(sinks):
+            operation = self._operation_for_query(query_id, sink, query['sql'], lineage)
+            for source in dict.fromkeys(sources):
+                dependencies.append({
+                    "source": source,
+                    "target": sink,
+                    "query_id": query_id,
+                    "type": operation
+                })
+        return path, dependencies
+
+    def resolve_dependencies(self, lineage, cache=None):
+        """Build dependency edges from server-reported sources/sinks, parsing SQL only as a fallback"""
+        counts = {'cache': 0, 'server_metadata': 0, 'explain': 0, 'sql_parse': 0}
+        
+        resolved = []
+        to_parse = []
+        for query_id, query in lineage['queries'].items():
+            sql_hash = sql_fingerprint(query['sql'])
+            dependencies = cache.lookup(query_id, sql_hash) if cache else None
+            if dependencies is not None:
+                path = 'cache'
+            else:
+                path, dependencies = self._resolve_query(query_id, query, lineage)
+                if path == 'sql_parse':
+                    to_parse.append((query_id, dependencies))
+            counts[path] += 1
+            query['resolved_by'] = path
+            query['sql_hash'] = sql_hash
+            resolved.append((path, dependencies))
+        
+        # Statement text only left for these: parse them as one batch, then splice the results back in order
+        parsed = iter(self.parse_sql_batch(to_parse))
+        for path, dependencies in resolved:
+            lineage['dependencies'].extend(next(parsed) if path == 'sql_parse' else dependencies)
+        
+        lineage['metadata']['resolution'] = counts
+        log.info("Resolved %d queries: %s unchanged from cache, %s from SHOW QUERIES metadata, "
+                 "%s from EXPLAIN, %s by SQL parsing",
+                 len(lineage['queries']), counts['cache'], counts['server_metadata'], counts['explain'],
+                 counts['sql_parse'])
+        return counts
+
+    def _query_record(self, query):
+        """(query_id, record) kept in lineage['queries'] for one SHOW QUERIES entity"""
+        query_id = query.get('id', query.get('queryId', ''))
+        if not query_id:
+            return None
+        return query_id, {
+            'sql': query.get('sql', query.get('queryString', query.get('statementText', ''))),
+            'status': query.get('status', query.get('state', '')),
+            'sources': query.get('sources', []),
+            'sinks': query.get('sinks', [])
         }
+
+    def _fetch_show_records(self, ksql: str, entity_type: str, stream: bool):
+        """Run one SHOW statement and reduce each entity to the record the lineage keeps"""
+        if stream:
+            entities = self.execute_ksql_stream(ksql, entity_type)
+        else:
+            result = self.execute_ksql(ksql)
+            entities = self.parse_show_response(result, entity_type) if result else []
+        
+        records = []
+        try:
+            for entity in entities:
+                if entity_type == 'queries':
+                    record = self._query_record(entity)
+                else:
+                    record = self.extract_entity_info(entity, entity_type[:-1].upper())
+                if record:
+                    records.append(record)
+        except Exception as e:
+            # A stream that broke off mid-body fails the whole request, like execute_ksql returning None
+            log.warning("Error: %s (%s)", e, ksql)
+            return []
+        return records
+
+    def _fetch_show_results(self, deep: bool, workers: int, limiter, stream: bool = True):
+        """Run the three SHOW ... EXTENDED calls, in parallel when deep"""
+        statements = [("SHOW STREAMS EXTENDED;", 'streams'), ("SHOW TABLES EXTENDED;", 'tables'),
+                      ("SHOW QUERIES EXTENDED;", 'queries')]
+        
+        def run(statement):
+            limiter.wait()
+            return self._fetch_show_records(statement[0], statement[1], stream)
+        
+        if not deep:
+            return [run(statement) for statement in statements]
+        with ThreadPoolExecutor(max_workers=min(workers, len(statements))) as pool:
+            return list(pool.map(run, statements))
+
+    def _detail_statements(self, lineage):
+        """(bucket, key, ksql, body_key) for every DESCRIBE <obj> EXTENDED and EXPLAIN <query_id>"""
+        statements = []
+        for name in list(lineage['streams']) + list(lineage['tables']):
+            statements.append(('descriptions', name, f"DESCRIBE {name} EXTENDED;", 'sourceDescription'))
+        for query_id in lineage['queries']:
+            statements.append(('explains', query_id, f"EXPLAIN {query_id};", 'queryDescription'))
+        return statements
+
+    def _fetch_detail(self, item):
+        """Run one detail statement; returns (bucket, key, detail or None)"""
+        bucket, key, ksql, body_key = item
+        return bucket, key, self.parse_describe_response(self.execute_ksql(ksql), body_key)
+
+    def _fetch_details(self, lineage, statements, workers: int = 8, limiter=None):
+        """Run detail statements over a bounded, rate-limited thread pool into lineage; returns how many failed"""
+        limiter = limiter or RateLimiter()
+        
+        def run(item):
+            limiter.wait()
+            return self._fetch_detail(item)
+        
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for bucket, key, detail in pool.map(run, statements):
+                if detail is None:
+                    failed += 1
+                    continue
+                lineage[bucket][key] = detail
+        return failed
+
+    def collect_object_details(self, lineage, workers: int = 8, limiter=None):
+        """Fan out DESCRIBE <obj> EXTENDED and EXPLAIN <query_id> over a bounded thread pool"""
+        statements = self._detail_statements(lineage)
+        log.info("\nFetching details for %d objects/queries with %s workers...", len(statements), workers)
+        started = time.monotonic()
+        failed = self._fetch_details(lineage, statements, workers, limiter)
+        log.info("✓ Details fetched in %.2fs (%d described, %d explained, %s failed)",
+                 time.monotonic() - started, len(lineage['descriptions']), len(lineage['explains']), failed)
+
+    def collect_runtime_stats(self, lineage, workers: int = 8, limiter=None):
+        """DESCRIBE <obj> EXTENDED every object not described yet (--deep already did), concurrently"""
+        statements = [item for item in self._detail_statements(lineage)
+                      if item[0] == 'descriptions' and item[1] not in lineage['descriptions']]
+        if not statements:
+            return
+        log.info("\nFetching runtime statistics for %d objects with %s workers...", len(statements), workers)
+        started = time.monotonic()
+        failed = self._fetch_details(lineage, statements, workers, limiter)
+        log.info("✓ Statistics fetched in %.2fs (%s failed)", time.monotonic() - started, failed)
+
+    def build_comprehensive_lineage(self, deep: bool = False, workers: int = 8, rate_limit: float = None,
+                                    cache=None, stream: bool = True, quiet: bool = False):
+        """Build comprehensive lineage; quiet drops this thread's progress logging (warnings still show)"""
+        with QUIET.quiet(quiet):
+            return self._build_comprehensive_lineage(deep, workers, rate_limit, cache, stream)
+
+    def _build_comprehensive_lineage(self, deep, workers, rate_limit, cache, stream):
+        log.info("Building comprehensive ksqlDB lineage...")
+        limiter = RateLimiter(rate_limit)
+        
+        lineage = empty_lineage(self.ksql_url)
         
+        with PROFILER.span('phase:fetch'):
+            streams, tables, queries = self._fetch_show_results(deep, workers, limiter, stream)
+
         # Get streams
-        print("\n" + "="*60)
-        print("STEP 1: FETCHING STREAMS")
-        print("="*60)
-        streams_result = self.execute_ksql("SHOW STREAMS EXTENDED;")
-        if streams_result:
-            streams = self.parse_show_response(streams_result, 'streams')
-            for stream in streams:
-                info = self.extract_entity_info(stream, 'STREAM')
-                if info and info['name']:
-                    lineage['streams'][info['name']] = info
-                    print(f"✓ Stream: {info['name']}")
+        log.info("\n%s", "="*60)
+        log.info("STEP 1: FETCHING STREAMS")
+        log.info("="*60)
+        for info in streams:
+            lineage['streams'][info['name']] = info
+            log.info("✓ Stream: %s", info['name'])
         
         # Get tables  
-        print("\n" + "="*60)
-        print("STEP 2: FETCHING TABLES")
-        print("="*60)
-        tables_result = self.execute_ksql("SHOW TABLES EXTENDED;")
-        if tables_result:
-            tables = self.parse_show_response(tables_result, 'tables')
-            for table in tables:
-                info = self.extract_entity_info(table, 'TABLE')
-                if info and info['name']:
-                    lineage['tables'][info['name']] = info
-                    print(f"✓ Table: {info['name']}")
+        log.info("\n%s", "="*60)
+        log.info("STEP 2: FETCHING TABLES")
+        log.info("="*60)
+        for info in tables:
+            lineage['tables'][info['name']] = info
+            log.info("✓ Table: %s", info['name'])
         
         # Get queries
-        print("\n" + "="*60)
-        print("STEP 3: FETCHING QUERIES")
-        print("="*60)
-        queries_result = self.execute_ksql("SHOW QUERIES EXTENDED;")
-        if queries_result:
-            queries = self.parse_show_response(queries_result, 'queries')
-            for query in queries:
-                query_id = query.get('id', query.get('queryId', ''))
-                if query_id:
-                    sql_text = query.get('sql', query.get('queryString', ''))
-                    
-                    lineage['queries'][query_id] = {
-                        'sql': sql_text,
-                        'status': query.get('status', query.get('state', '')),
-                        'sources': query.get('sources', []),
-                        'sinks': query.get('sinks', [])
-                    }
-                    print(f"✓ Query: {query_id}")
-                    
-                    # Parse dependencies from SQL
-                    dependencies = self.parse_dependencies_from_sql(sql_text, query_id)
-                    lineage['dependencies'].extend(dependencies)
+        log.info("\n%s", "="*60)
+        log.info("STEP 3: FETCHING QUERIES")
+        log.info("="*60)
+        for query_id, record in queries:
+            lineage['queries'][query_id] = record
+            log.info("✓ Query: %s", query_id)
         
-        print(f"\n" + "="*60)
-        print("COLLECTION SUMMARY")
-        print("="*60)
-        print(f"Streams: {len(lineage['streams'])}")
-        print(f"Tables: {len(lineage['tables'])}")
-        print(f"Queries: {len(lineage['queries'])}")
-        print(f"Dependencies: {len(lineage['dependencies'])}")
+        if deep:
+            log.info("\n%s", "="*60)
+            log.info("STEP 4: FETCHING OBJECT DETAILS")
+            log.info("="*60)
+            with PROFILER.span('phase:details'):
+                self.collect_object_details(lineage, workers, limiter)
+
+        return self._finish_lineage(lineage, cache)
+
+    def build_lineage_from_sql(self, path: str, cache=None):
+        """Build lineage offline from a .sql file such as the ksql_definitions.sql from ksql-export.sh"""
+        log.info("Building ksqlDB lineage offline from %s...", path)
+        lineage = empty_lineage(f"file://{os.path.abspath(path)}")
+        with open(path) as f:
+            text = f.read()
+        
+        log.info("\n%s", "="*60)
+        log.info("READING DEFINITIONS")
+        log.info("="*60)
+        seen = set()
+        for index, statement in enumerate(split_ksql_statements(text)):
+            fingerprint = sql_fingerprint(statement)
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            parsed = parse_ksql_statement(statement)
+            sink = parsed['sink']
+            if not sink:
+                continue
+            
+            if parsed['object_type']:
+                properties = parsed['properties']
+                lineage['streams' if parsed['object_type'] == 'STREAM' else 'tables'][sink] = {
+                    'name': sink,
+                    'type': parsed['object_type'],
+                    'topic': properties.get('KAFKA_TOPIC', sink),
+                    'format': properties.get('VALUE_FORMAT', properties.get('FORMAT', '')),
+                    'key_format': properties.get('KEY_FORMAT', ''),
+                    'is_windowed': False
+                }
+                lineage['descriptions'][sink] = {'name': sink, 'type': parsed['object_type'], 'statement': statement}
+                log.info("✓ %s: %s", parsed['object_type'].title(), sink)
+            
+            if parsed['kind'] in ('CREATE_AS', 'INSERT'):
+                if parsed['kind'] == 'INSERT':
+                    query_id = f"INSERTQUERY_{index}"
+                else:
+                    query_id = f"C{parsed['object_type'][0]}AS_{sink}_{index}"
+                lineage['queries'][query_id] = {'sql': statement, 'status': 'OFFLINE', 'sources': [], 'sinks': []}
+                log.info("✓ Query: %s", query_id)
+        
+        return self._finish_lineage(lineage, cache)
+
+    def _finish_lineage(self, lineage, cache=None):
+        """Resolve dependencies, print the collection summary and report relationships"""
+        log.info("\n%s", "="*60)
+        log.info("RESOLVING DEPENDENCIES")
+        log.info("="*60)
+        with PROFILER.span('phase:resolve'):
+            self.resolve_dependencies(lineage, cache)
+        return self._summarize_lineage(lineage)
+
+    def _summarize_lineage(self, lineage):
+        """Print the collection summary and report relationships for a resolved lineage"""
+        log.info("\n%s", "="*60)
+        log.info("COLLECTION SUMMARY")
+        log.info("="*60)
+        log.info("Streams: %d", len(lineage['streams']))
+        log.info("Tables: %d", len(lineage['tables']))
+        log.info("Queries: %d", len(lineage['queries']))
+        log.info("Dependencies: %d", len(lineage['dependencies']))
         
         # Build comprehensive relationships
         if lineage['dependencies']:
-            print(f"\nBuilding relationships from {len(lineage['dependencies'])} dependencies...")
+            log.info("\nBuilding relationships from %d dependencies...", len(lineage['dependencies']))
             self._build_relationships(lineage)
         else:
-            print(f"\nNo dependencies found to build relationships")
+            log.info("\nNo dependencies found to build relationships")
             
         return lineage
 
     def _build_relationships(self, lineage):
-        """Build comprehensive relationship mapping"""
+        """Report the relationship mapping; the typed buckets are views over lineage['dependencies']"""
+        with PROFILER.span('_build_relationships'):
+            self._report_relationships(lineage)
+
+    def _report_relationships(self, lineage):
         relationships = lineage['relationships']
+        object_types = relationships.object_types()
         
-        # Build object type mapping
-        object_types = {}
-        for stream_name in lineage['streams']:
-            object_types[stream_name] = 'STREAM'
-        for table_name in lineage['tables']:
-            object_types[table_name] = 'TABLE'
-        
-        print(f"Object type mapping: {len(object_types)} objects")
+        log.info("Object type mapping: %d objects", len(object_types))
         
         # Analyze each dependency
-        for dep in lineage['dependencies']:
-            source = dep['source']
-            target = dep['target']
-            query_id = dep['query_id']
-            
-            source_type = object_types.get(source, 'EXTERNAL')
-            target_type = object_types.get(target, 'UNKNOWN')
-            
-            print(f"Relationship: {source}({source_type}) → {target}({target_type}) via {query_id}")
-            
-            # Categorize relationships
-            relationship_data = {
-                'source_object': source,
-                'target_object': target, 
-                'query_id': query_id,
-                'relationship_type': dep['type']
-            }
-            
-            if source_type == 'STREAM' and target_type == 'STREAM':
-                relationships['stream_to_stream'].append(relationship_data)
-            elif source_type == 'STREAM' and target_type == 'TABLE':
-                relationships['stream_to_table'].append(relationship_data)
-            elif source_type == 'TABLE' and target_type == 'STREAM':
-                relationships['table_to_stream'].append(relationship_data)
-            elif source_type == 'TABLE' and target_type == 'TABLE':
-                relationships['table_to_table'].append(relationship_data)
-            
-            # Build query relationships
-            relationships['query_relationships'].append({
-                'query_id': query_id,
-                'input_object': source,
-                'input_type': source_type,
-                'output_object': target,
-                'output_type': target_type,
-                'operation': dep['type']
-            })
+        if log.isEnabledFor(logging.DEBUG):
+            for source, target, query_id, dep_type in lineage['dependencies'].iter_tuples():
+                source_type = object_types.get(source, 'EXTERNAL')
+                target_type = object_types.get(target, 'UNKNOWN')
+
+                log.debug("Relationship: %s(%s) → %s(%s) via %s", source, source_type, target, target_type, query_id)
         
-        print(f"Relationship building complete:")
-        print(f"  Stream→Stream: {len(relationships['stream_to_stream'])}")
-        print(f"  Stream→Table:  {len(relationships['stream_to_table'])}")
-        print(f"  Table→Stream:  {len(relationships['table_to_stream'])}")
-        print(f"  Table→Table:   {len(relationships['table_to_table'])}")
+        counts = relationships.counts()
+        log.info("Relationship building complete:")
+        log.info("  Stream→Stream: %d", counts['stream_to_stream'])
+        log.info("  Stream→Table:  %d", counts['stream_to_table'])
+        log.info("  Table→Stream:  %d", counts['table_to_stream'])
+        log.info("  Table→Table:   %d", counts['table_to_table'])
 
     def print_relationship_report(self, lineage):
         """Print comprehensive relationship report"""
@@ -389,8 +3444,6 @@ class KsqlDBLineageEnhanced:
         print("FINAL RELATIONSHIP REPORT")
         print("=" * 100)
         
-        rel = lineage['relationships']
-        
         # Summary
         print(f"\nSUMMARY")
         print("-" * 50)
@@ -399,18 +3452,14 @@ class KsqlDBLineageEnhanced:
         print(f"Queries: {len(lineage['queries'])}")
         print(f"Dependencies found: {len(lineage['dependencies'])}")
         
-        # Show relationships if any
-        all_relationships = (rel['stream_to_stream'] + rel['stream_to_table'] + 
-                           rel['table_to_stream'] + rel['table_to_table'])
+        # Show relationships if any; rows carry their endpoint types, resolved once per name
+        all_relationships = sorted(iter_relationship_rows(lineage), key=lambda row: (row[0], row[2]))
         
         if all_relationships:
             print(f"\nALL RELATIONSHIPS ({len(all_relationships)}):")
             print("-" * 80)
-            for rel_item in sorted(all_relationships, key=lambda x: (x['source_object'], x['target_object'])):
-                source_type = 'STREAM' if rel_item['source_object'] in lineage['streams'] else 'TABLE' if rel_item['source_object'] in lineage['tables'] else 'EXTERNAL'
-                target_type = 'STREAM' if rel_item['target_object'] in lineage['streams'] else 'TABLE' if rel_item['target_object'] in lineage['tables'] else 'UNKNOWN'
-                
-                print(f"  {rel_item['source_object']} ({source_type}) → {rel_item['target_object']} ({target_type}) via {rel_item['query_id']}")
+            for source, source_type, target, target_type, query_id, _ in all_relationships:
+                print(f"  {source} ({source_type}) → {target} ({target_type}) via {query_id}")
         else:
             print(f"\nNO RELATIONSHIPS FOUND")
             if lineage['queries']:
@@ -423,6 +3472,11 @@ class KsqlDBLineageEnhanced:
         """Export relationship data to CSV files"""
         
         # Always export inventory, even if no relationships
+        self.export_inventory_csv(lineage, base_filename)
+        self.export_relationships(lineage, base_filename, ['csv'])
+
+    def export_inventory_csv(self, lineage, base_filename: str):
+        """Export the stream/table inventory to <base>_inventory.csv"""
         inventory_filename = f"{base_filename}_inventory.csv"
         with open(inventory_filename, 'w', newline='') as f:
             writer = csv.writer(f)
@@ -434,68 +3488,730 @@ class KsqlDBLineageEnhanced:
             for table_name, info in lineage['tables'].items():
                 writer.writerow([table_name, 'TABLE', info['topic'], info['format'], info.get('key_format', '')])
         
-        print(f"✓ Object inventory exported to: {inventory_filename}")
+        log.info("✓ Object inventory exported to: %s", inventory_filename)
+
+    def export_relationships(self, lineage, base_filename: str, formats):
+        """Export relationships to every format in one streaming pass"""
+        started = time.perf_counter()
+        written = export_lineage_formats(lineage, base_filename, formats)
+        elapsed = time.perf_counter() - started
+        
+        for fmt in formats:
+            if fmt in written:
+                filename, count = written[fmt]
+                log.info("✓ Relationships exported to: %s (%s rows)", filename, count)
+            else:
+                log.info("No relationships to export as %s", fmt)
+        log.info("Export finished in %.2fs", elapsed)
+
+    def export_column_lineage_csv(self, columns, base_filename: str):
+        """Export one row per output column and input column it derives from to <base>_column_lineage.csv"""
+        filename = f"{base_filename}_column_lineage.csv"
+        count = 0
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Target_Object', 'Target_Column', 'Source_Object', 'Source_Column', 'Query_ID',
+                             'Transform', 'Expression'])
+            for row in columns.iter_rows():
+                writer.writerow(row)
+                count += 1
+        log.info("✓ Column lineage exported to: %s (%s rows)", filename, count)
+
+    def export_definitions_sql(self, lineage, filename: str):
+        """Write CREATE/INSERT statements collected by --deep (replaces ksql-export.sh)"""
+        written = set()
+        statements = []
+        for name, detail in lineage['descriptions'].items():
+            statements.append(detail.get('statement', ''))
+        for query_id, detail in lineage['explains'].items():
+            statements.append(detail.get('statementText', lineage['queries'].get(query_id, {}).get('sql', '')))
         
-        # Export relationships if any
-        rel = lineage['relationships']
-        all_relationships = (rel['stream_to_stream'] + rel['stream_to_table'] + 
-                           rel['table_to_stream'] + rel['table_to_table'])
+        with open(filename, 'w') as f:
+            for statement in statements:
+                statement = statement.strip().rstrip(';').strip()
+                if statement and statement not in written:
+                    written.add(statement)
+                    f.write(statement + ";\n")
         
-        if all_relationships:
-            master_filename = f"{base_filename}_relationships.csv"
-            with open(master_filename, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['Source', 'Source_Type', 'Target', 'Target_Type', 'Query_ID', 'Operation'])
-                
-                for r in all_relationships:
-                    source_type = 'STREAM' if r['source_object'] in lineage['streams'] else 'TABLE' if r['source_object'] in lineage['tables'] else 'EXTERNAL'
-                    target_type = 'STREAM' if r['target_object'] in lineage['streams'] else 'TABLE' if r['target_object'] in lineage['tables'] else 'UNKNOWN'
-                    
-                    writer.writerow([
-                        r['source_object'], 
-                        source_type, 
-                        r['target_object'], 
-                        target_type, 
-                        r['query_id'], 
-                        r['relationship_type']
-                    ])
-            
-            print(f"✓ Relationships exported to: {master_filename}")
+        log.info("✓ %d definitions exported to: %s", len(written), filename)
+
+    def export_lineage_report(self, lineage, filename: str):
+        """Write the plain-text streams/tables/queries report ksql-data-linage.sh used to scrape from the ksql CLI"""
+        topics = {name: info.get('topic', '') for bucket in ('streams', 'tables') for name, info in lineage[bucket].items()}
+        with open(filename, 'w') as f:
+            f.write("ksqlDB Data Lineage Report\n=========================\n\n")
+            for title, bucket in (('Streams', 'streams'), ('Tables', 'tables')):
+                f.write(f"{title}:\n")
+                for name in sorted(lineage[bucket]):
+                    f.write(f"- {name} (Kafka Topic: {topics[name]})\n")
+                f.write("\n")
+            f.write("Queries:\n")
+            for query_id in sorted(lineage['queries']):
+                query = lineage['queries'][query_id]
+                sinks = query.get('sinks') or []
+                sink_topics = ', '.join(topics[sink] for sink in sinks if topics.get(sink))
+                f.write(f"- {query_id}\n")
+                f.write(f"  Query: {' '.join(query.get('sql', '').split())}\n")
+                f.write(f"  Sources: {', '.join(query.get('sources') or []) or 'None'}\n")
+                f.write(f"  Sinks: {', '.join(sinks) or 'None'} (Kafka Topic: {sink_topics or 'None'})\n\n")
+        log.info("✓ Lineage report written to: %s", filename)
+
+
+def load_cluster_configs(path: str, defaults: dict):
+    """Read a federation config: a JSON list (or {"clusters": [...]}) of {name, url, credentials...}
+
+    String values may reference environment variables ($VAR or ${VAR}) so secrets stay out of the file.
+    Keys missing from a cluster fall back to defaults (the matching command-line options).
+    """
+    with open(path) as f:
+        config = json.load(f)
+    entries = config.get('clusters', []) if isinstance(config, dict) else config
+    
+    clusters = []
+    for index, entry in enumerate(entries):
+        cluster = dict(defaults)
+        cluster.update({key: os.path.expandvars(value) if isinstance(value, str) else value
+                        for key, value in entry.items()})
+        if not cluster.get('url'):
+            raise ValueError(f"cluster #{index + 1} in {path} has no url")
+        cluster['name'] = cluster.get('name') or urlsplit(cluster['url']).hostname
+        if CLUSTER_SEPARATOR in cluster['name']:
+            raise ValueError(f"cluster name {cluster['name']!r} must not contain {CLUSTER_SEPARATOR!r}")
+        if any(existing['name'] == cluster['name'] for existing in clusters):
+            raise ValueError(f"duplicate cluster name {cluster['name']!r} in {path}")
+        cluster['max_concurrency'] = max(1, int(cluster.get('max_concurrency') or 1))
+        clusters.append(cluster)
+    if not clusters:
+        raise ValueError(f"no clusters defined in {path}")
+    return clusters
+
+
+async def crawl_cluster(cluster, client, executor, deep: bool, stream: bool):
+    """Collect and resolve one cluster's lineage, never running more than max_concurrency requests at once"""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(cluster['max_concurrency'])
+    limiter = RateLimiter(cluster.get('rate_limit'))
+    
+    def limited(fn, *args):
+        limiter.wait()
+        return fn(*args)
+    
+    async def call(fn, *args):
+        async with semaphore:
+            return await loop.run_in_executor(executor, limited, fn, *args)
+    
+    started = time.monotonic()
+    lineage = empty_lineage(client.ksql_url)
+    streams, tables, queries = await asyncio.gather(
+        call(client._fetch_show_records, "SHOW STREAMS EXTENDED;", 'streams', stream),
+        call(client._fetch_show_records, "SHOW TABLES EXTENDED;", 'tables', stream),
+        call(client._fetch_show_records, "SHOW QUERIES EXTENDED;", 'queries', stream))
+    for info in streams:
+        lineage['streams'][info['name']] = info
+    for info in tables:
+        lineage['tables'][info['name']] = info
+    for query_id, record in queries:
+        lineage['queries'][query_id] = record
+    
+    if deep:
+        details = await asyncio.gather(*(call(client._fetch_detail, item)
+                                         for item in client._detail_statements(lineage)))
+        for bucket, key, detail in details:
+            if detail is not None:
+                lineage[bucket][key] = detail
+    
+    await loop.run_in_executor(executor, client.resolve_dependencies, lineage)
+    lineage['metadata']['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    return lineage
+
+
+def merge_cluster_lineage(federated, cluster_name: str, lineage):
+    """Copy one cluster's lineage into the federated lineage with every name prefixed by the cluster"""
+    def qualify(name):
+        return name if name == 'EXTERNAL_SOURCE' else f"{cluster_name}{CLUSTER_SEPARATOR}{name}"
+    
+    for bucket in ('streams', 'tables'):
+        for name, info in lineage[bucket].items():
+            federated[bucket][qualify(name)] = dict(info, name=qualify(name), cluster=cluster_name)
+    for query_id, query in lineage['queries'].items():
+        federated['queries'][qualify(query_id)] = dict(query, cluster=cluster_name,
+                                                       sources=[qualify(name) for name in query['sources']],
+                                                       sinks=[qualify(name) for name in query['sinks']])
+    for bucket in ('descriptions', 'explains'):
+        for key, detail in lineage[bucket].items():
+            federated[bucket][qualify(key)] = detail
+    for source, target, query_id, dep_type in lineage['dependencies'].iter_tuples():
+        federated['dependencies'].append({"source": qualify(source), "target": qualify(target),
+                                          "query_id": qualify(query_id), "type": dep_type})
+    
+    federated['metadata']['clusters'][cluster_name] = {
+        'ksql_url': lineage['metadata']['ksql_url'],
+        'streams': len(lineage['streams']),
+        'tables': len(lineage['tables']),
+        'queries': len(lineage['queries']),
+        'dependencies': len(lineage['dependencies']),
+        'resolution': lineage['metadata'].get('resolution', {}),
+        'elapsed_seconds': lineage['metadata'].get('elapsed_seconds')
+    }
+
+
+def stitch_clusters(federated):
+    """Add CROSS_CLUSTER edges from objects a query writes in one cluster to objects declared over
+    the same topic in another; returns the number of edges added"""
+    written = set()
+    for source, target, _, _ in federated['dependencies'].iter_tuples():
+        if source != 'EXTERNAL_SOURCE':
+            written.add(target)
+    
+    producers = defaultdict(list)
+    consumers = defaultdict(list)
+    for bucket in ('streams', 'tables'):
+        for name, info in federated[bucket].items():
+            if info.get('topic'):
+                (producers if name in written else consumers)[info['topic']].append(info)
+    
+    stitched = 0
+    for topic, sinks in producers.items():
+        for sink in sinks:
+            for reader in consumers.get(topic, ()):
+                if reader['cluster'] != sink['cluster']:
+                    federated['dependencies'].append({"source": sink['name'], "target": reader['name'],
+                                                      "query_id": f"topic:{topic}", "type": "CROSS_CLUSTER"})
+                    stitched += 1
+    federated['metadata']['cross_cluster_edges'] = stitched
+    return stitched
+
+
+async def crawl_federation(clusters, deep: bool = False, stream: bool = True,
+                           connect_timeout: float = 10, timeout: float = 30, request_policy: dict = None):
+    """Crawl every cluster concurrently; wall time tracks the slowest cluster rather than the sum"""
+    clients = [KsqlDBLineageEnhanced(cluster['url'], username=cluster.get('username'),
+                                     password=cluster.get('password'), api_key=cluster.get('api_key'),
+                                     api_secret=cluster.get('api_secret'),
+                                     verify_ssl=not cluster.get('no_ssl_verify'), ca_cert=cluster.get('ca_cert'),
+                                     pool_size=cluster['max_concurrency'], connect_timeout=connect_timeout,
+                                     timeout=timeout, request_policy=request_policy)
+               for cluster in clusters]
+    executor = ThreadPoolExecutor(max_workers=sum(cluster['max_concurrency'] for cluster in clusters))
+    try:
+        return await asyncio.gather(*(crawl_cluster(cluster, client, executor, deep, stream)
+                                      for cluster, client in zip(clusters, clients)),
+                                    return_exceptions=True)
+    finally:
+        executor.shutdown(wait=True)
+        for client in clients:
+            client.transport.close()
+
+
+def build_federated_lineage(clusters, deep: bool = False, stream: bool = True,
+                            connect_timeout: float = 10, timeout: float = 30, request_policy: dict = None):
+    """One lineage spanning every cluster, with cluster-qualified names and cross-cluster topic edges"""
+    log.info("Building federated ksqlDB lineage across %d clusters...", len(clusters))
+    started = time.monotonic()
+    results = asyncio.run(crawl_federation(clusters, deep, stream, connect_timeout, timeout, request_policy))
+    
+    federated = empty_lineage(', '.join(f"{cluster['url']}/ksql" for cluster in clusters))
+    federated['metadata']['clusters'] = {}
+    log.info("\n%s", "="*60)
+    log.info("CLUSTERS")
+    log.info("="*60)
+    for cluster, result in zip(clusters, results):
+        if isinstance(result, Exception):
+            log.warning("✗ %s: %s", cluster['name'], result)
+            federated['metadata']['clusters'][cluster['name']] = {'ksql_url': f"{cluster['url']}/ksql",
+                                                                  'error': str(result)}
+            continue
+        merge_cluster_lineage(federated, cluster['name'], result)
+        log.info("✓ %s: %d streams, %d tables, %d queries in %.2fs",
+                 cluster['name'], len(result['streams']), len(result['tables']), len(result['queries']),
+                 result['metadata']['elapsed_seconds'])
+    
+    stitched = stitch_clusters(federated)
+    log.info("✓ %s cross-cluster edges via shared topics", stitched)
+    log.info("Federated crawl finished in %.2fs", time.monotonic() - started)
+    return federated
+
+
+class LineageWatcher:
+    """Keeps a lineage and its graph indexes current by polling, and serves them over local HTTP
+
+    Each poll re-runs the SHOW ... EXTENDED calls, reuses the edges of unchanged queries
+    from an in-memory snapshot, and patches the graph with only the added/removed edges.
+    Each response carries an ETag hashed from its own body, so a resource keeps its ETag
+    across polls until what it serves changes.
+    """
+
+    def __init__(self, client, lineage, cache, interval: float = 60, deep: bool = False, workers: int = 8,
+                 rate_limit: float = None, stream: bool = True, persist: bool = False, store=None):
+        self.client = client
+        self.store = store
+        self.cache = cache
+        self.interval = interval
+        self.deep = deep
+        self.workers = workers
+        self.rate_limit = rate_limit
+        self.stream = stream
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.polls = 0
+        self.errors = 0
+        self.last_poll = lineage['metadata']['generated_at']
+        self.last_diff = None
+        self._install(lineage, LineageGraph(lineage))
+
+    def _install(self, lineage, graph):
+        self.lineage = lineage
+        self.graph = graph
+        self._bodies = {}
+
+    @staticmethod
+    def _served_details(lineage):
+        """Object records and query SQL/status: served content that the edge diff does not cover"""
+        return (lineage['streams'], lineage['tables'],
+                {query_id: (query.get('sql_hash'), query['status']) for query_id, query in lineage['queries'].items()})
+
+    def body(self, path: str, query: str = ''):
+        """(status, JSON bytes, ETag) for a GET; 200 bodies are cached until the next install. Needs self.lock"""
+        key = (path, query)
+        cached = self._bodies.get(key)
+        if cached:
+            return cached
+        status, payload = self.response(path, parse_qs(query))
+        body = json.dumps(payload, default=lineage_json_default).encode('utf-8')
+        result = (status, body, f'"{hashlib.sha256(body).hexdigest()[:20]}"')
+        if status == 200 and path != '/health':
+            self._bodies[key] = result
+        return result
+
+    def poll(self):
+        """Re-collect the cluster and apply the changes; returns the diff (None when nothing changed)"""
+        started = time.monotonic()
+        lineage = self.client.build_comprehensive_lineage(deep=self.deep, workers=self.workers,
+                                                          rate_limit=self.rate_limit, cache=self.cache,
+                                                          stream=self.stream, quiet=True)
+        with QUIET.quiet():
+            diff = self.cache.diff(lineage)
+            self.cache.update(lineage)
+            if self.persist:
+                self.cache.save()
+        self.polls += 1
+        self.last_poll = lineage['metadata']['generated_at']
+        changed = any(diff[key] for key in ('added_edges', 'removed_edges', 'added_queries', 'terminated_queries',
+                                            'changed_queries', 'added_objects', 'removed_objects'))
+        with self.lock:
+            refreshed = changed or self._served_details(lineage) != self._served_details(self.lineage)
+            if changed:
+                self.graph.apply_diff(lineage, diff)
+                self.last_diff = diff
+            if refreshed:
+                self._install(lineage, self.graph)
+        if changed and self.store:
+            with QUIET.quiet():
+                self.store.save_snapshot(lineage)
+        
+        stamp = datetime.now().strftime('%H:%M:%S')
+        elapsed = time.monotonic() - started
+        if changed:
+            log.info("[%s] poll %s: +%d/-%d edges, %d new, %d changed, %d terminated queries (%.2fs)",
+                     stamp, self.polls, len(diff['added_edges']), len(diff['removed_edges']),
+                     len(diff['added_queries']), len(diff['changed_queries']), len(diff['terminated_queries']), elapsed)
+        elif refreshed:
+            log.info("[%s] poll %s: query status or object details changed (%.2fs)", stamp, self.polls, elapsed)
         else:
-            print("No relationships to export")
+            log.info("[%s] poll %s: no changes (%.2fs)", stamp, self.polls, elapsed)
+        return diff if changed else None
+
+    def run_polling(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.errors += 1
+                log.warning("[%s] poll failed: %s", datetime.now().strftime('%H:%M:%S'), e)
+
+    def _traversal_body(self, found, reverse: bool):
+        graph = self.graph
+        results = []
+        for name, (distance, via) in sorted(found.items(), key=lambda item: (item[1][0], item[0])):
+            queries = graph.via_queries(name, via) if reverse else graph.via_queries(via, name)
+            results.append({"name": name, "type": graph.object_types.get(name, 'EXTERNAL'),
+                            "topic": graph.object_topics.get(name, ''), "distance": distance, "via": via,
+                            "queries": queries})
+        return results
+
+    def response(self, path: str, params):
+        """(status, body object) for a GET; called with self.lock held"""
+        depth = int(params['depth'][0]) if params.get('depth') else None
+        if path == '/health':
+            return 200, {"status": "ok", "etag": self.body('/lineage')[2], "polls": self.polls, "errors": self.errors,
+                         "last_poll": self.last_poll, "interval_seconds": self.interval}
+        if path == '/lineage':
+            lineage = self.lineage
+            return 200, {"metadata": lineage['metadata'], "streams": lineage['streams'],
+                         "tables": lineage['tables'], "queries": lineage['queries'],
+                         "dependencies": lineage['dependencies']}
+        if path == '/inventory':
+            return 200, [dict(info, type=object_type)
+                         for bucket, object_type in (('streams', 'STREAM'), ('tables', 'TABLE'))
+                         for info in self.lineage[bucket].values()]
+        if path == '/diff':
+            return 200, self.last_diff or {}
+        if path in ('/upstream', '/downstream'):
+            if not params.get('object'):
+                return 400, {"error": f"{path} requires ?object=NAME"}
+            name = self.graph.resolve_name(params['object'][0])
+            found = getattr(self.graph, path[1:])(name, depth)
+            return 200, {"object": name, "depth": depth, "results": self._traversal_body(found, path == '/upstream')}
+        if path == '/impact':
+            if not params.get('topic'):
+                return 400, {"error": "/impact requires ?topic=NAME"}
+            topic = params['topic'][0]
+            return 200, {"topic": topic, "depth": depth,
+                         "results": self._traversal_body(self.graph.impact(topic, depth), False)}
+        return 404, {"error": f"unknown path {path}",
+                     "paths": ['/health', '/lineage', '/inventory', '/diff', '/upstream', '/downstream', '/impact']}
+
+    def _handler_class(self):
+        watcher = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                with watcher.lock:
+                    status, body, etag = watcher.body(url.path, url.query)
+                if status == 200 and self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+                self.send_response(status)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                if status != 304:
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def serve(self, host: str, port: int):
+        """Poll in the background and answer HTTP requests until interrupted"""
+        httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        httpd.daemon_threads = True
+        poller = threading.Thread(target=self.run_polling, daemon=True)
+        poller.start()
+        log.info("\nServing lineage on http://%s:%s (polling every %gs, Ctrl-C to stop)",
+                 host, httpd.server_address[1], self.interval)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            httpd.server_close()
+
+
+def run_store_queries(store, args):
+    """Answer --history/--since/--upstream/--downstream/--impact from the SQLite store's latest snapshot"""
+    if not store.latest_snapshot():
+        print(f"No snapshots in {store.path} yet")
+        return
+    if args.history:
+        store.print_history()
+    if args.since:
+        store.print_changes_since(args.since)
+    depth_note = f" (depth <= {args.depth})" if args.depth else ""
+    for option, direction in ((args.upstream, 'upstream'), (args.downstream, 'downstream')):
+        if option:
+            name = store.resolve_name(option)
+            started = time.perf_counter()
+            rows = getattr(store, direction)(name, args.depth)
+            store.print_traversal(f"{direction.upper()} OF {name}{depth_note}", rows, reverse=direction == 'upstream',
+                                  elapsed_ms=(time.perf_counter() - started) * 1000)
+    if args.impact:
+        started = time.perf_counter()
+        rows = store.impact(args.impact, args.depth)
+        store.print_traversal(f"IMPACT OF TOPIC {args.impact}{depth_note}", rows,
+                              elapsed_ms=(time.perf_counter() - started) * 1000)
+
+
+def run_graph_queries(graph, args):
+    """Answer --upstream/--downstream/--impact from the indexed graph"""
+    depth_note = f" (depth <= {args.depth})" if args.depth else ""
+    if args.upstream:
+        started = time.perf_counter()
+        found = graph.upstream(args.upstream, args.depth)
+        graph.print_traversal(f"UPSTREAM OF {graph.resolve_name(args.upstream)}{depth_note}", found,
+                              reverse=True, elapsed_ms=(time.perf_counter() - started) * 1000)
+    if args.downstream:
+        started = time.perf_counter()
+        found = graph.downstream(args.downstream, args.depth)
+        graph.print_traversal(f"DOWNSTREAM OF {graph.resolve_name(args.downstream)}{depth_note}", found,
+                              elapsed_ms=(time.perf_counter() - started) * 1000)
+    if args.impact:
+        started = time.perf_counter()
+        found = graph.impact(args.impact, args.depth)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        graph.print_traversal(f"IMPACT OF TOPIC {args.impact}{depth_note}", found, elapsed_ms=elapsed_ms)
+        affected_topics = sorted({graph.object_topics[name] for name in found
+                                  if graph.object_topics.get(name) and graph.object_topics[name] != args.impact})
+        if affected_topics:
+            print(f"  Downstream topics: {', '.join(affected_topics)}")
+
 
 def main():
     parser = argparse.ArgumentParser(description='Comprehensive ksqlDB Relationship Analysis')
-    parser.add_argument('--url', required=True, help='ksqlDB server URL')
+    parser.add_argument('--url', help='ksqlDB server URL')
+    parser.add_argument('--replay', metavar='DIR', help='Analyse responses saved with --record instead of a live server')
+    parser.add_argument('--from-sql', metavar='FILE', help='Analyse a .sql definitions file (e.g. from ksql-export.sh) instead of a live server')
+    parser.add_argument('--clusters', metavar='FILE', help='Crawl every ksqlDB cluster in this JSON config concurrently and stitch them by shared topics')
+    parser.add_argument('--record', metavar='DIR', help='Save every raw response while collecting, for later --replay')
     parser.add_argument('--username', help='Username for basic auth') 
     parser.add_argument('--password', help='Password for basic auth')
     parser.add_argument('--api-key', help='API key for Confluent Cloud')
     parser.add_argument('--api-secret', help='API secret for Confluent Cloud')
     parser.add_argument('--no-ssl-verify', action='store_true', help='Disable SSL verification')
     parser.add_argument('--ca-cert', help='Path to custom CA certificate file')
+    parser.add_argument('--pool-size', type=int, default=4, help='Keep-alive connections kept open to ksqlDB (default: 4)')
+    parser.add_argument('--connect-timeout', type=float, default=10, help='Connection/TLS handshake timeout in seconds (default: 10)')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request read timeout in seconds; the ceiling for adaptive timeouts (default: 30)')
+    parser.add_argument('--min-timeout', type=float, default=2.0, help='Floor for read timeouts adapted to observed latency (3x p99 per statement kind; default: 2)')
+    parser.add_argument('--retries', type=int, default=3, help='Retries with jittered exponential backoff for failed SHOW/DESCRIBE/EXPLAIN requests (default: 3)')
+    parser.add_argument('--hedge', type=float, metavar='PERCENTILE', help='Send a second copy of a request still running past this latency percentile of its kind, e.g. 95')
+    parser.add_argument('--breaker-threshold', type=int, default=5, help='Consecutive failures that open the circuit breaker; 0 disables it (default: 5)')
+    parser.add_argument('--breaker-reset', type=float, default=30, help='Seconds the open breaker fails fast before a trial request (default: 30)')
     parser.add_argument('--export-csv', help='Export relationship CSVs (base filename)')
+    parser.add_argument('--export', metavar='BASE', help='Export inventory CSV plus relationships in --formats (base filename)')
+    parser.add_argument('--no-inventory', action='store_true', help='With --export, skip <base>_inventory.csv and write only the relationship formats')
+    parser.add_argument('--formats', default='csv', help=f"Comma-separated export formats for --export: {', '.join(EXPORT_WRITERS)} (default: csv)")
     parser.add_argument('--debug-queries', action='store_true', help='Debug queries and SQL content')
+    parser.add_argument('--deep', action='store_true', help='Run SHOW calls in parallel and DESCRIBE/EXPLAIN every object and query')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests in --deep mode, and per cluster with --clusters (default: 8)')
+    parser.add_argument('--rate-limit', type=float, help='Maximum requests per second in --deep mode (per cluster with --clusters)')
+    parser.add_argument('--export-sql', help='Write collected definitions to a .sql file (requires --deep)')
+    parser.add_argument('--export-report', metavar='FILE', help='Write a plain-text report of streams, tables and queries with their topics, sources and sinks')
+    parser.add_argument('--parse-workers', type=int, help=f'Processes for parsing SQL when there are {PARALLEL_PARSE_MIN_STATEMENTS}+ statements (default: one per CPU; 1 disables)')
+    parser.add_argument('--no-stream', action='store_true', help='Buffer whole SHOW responses instead of decoding them entity by entity')
+    parser.add_argument('--incremental', action='store_true', help='Reuse the snapshot cache and only resolve new or changed queries')
+    parser.add_argument('--cache-file', default='ksql_lineage_cache.json', help='Snapshot cache for --incremental (default: ksql_lineage_cache.json)')
+    parser.add_argument('--upstream', metavar='OBJ', help='List every object OBJ transitively reads from')
+    parser.add_argument('--downstream', metavar='OBJ', help='List every object transitively fed by OBJ')
+    parser.add_argument('--impact', metavar='TOPIC', help='List every object affected by dropping or changing TOPIC')
+    parser.add_argument('--depth', type=int, help='Limit --upstream/--downstream/--impact to N hops, and set the --subgraph radius (default there: 2)')
+    parser.add_argument('--column-lineage', action='store_true', help='Map every output column to the input columns it derives from (exported with --export)')
+    parser.add_argument('--drop-field', metavar='OBJ.COLUMN', help='Show the columns and queries affected by dropping OBJ.COLUMN (implies --column-lineage)')
+    parser.add_argument('--runtime-stats', action='store_true', help='Attach DESCRIBE ... EXTENDED throughput/error/lag statistics to the lineage and report bottlenecks and fan-out hotspots')
+    parser.add_argument('--top', type=int, default=10, help='Rows per section of the --runtime-stats and --topology reports (default: 10)')
+    parser.add_argument('--topology', action='store_true', help='Report cycles, deploy order, pipeline depth, longest chain, fan-in/out and components (with --export, also <base>_topology.csv)')
+    parser.add_argument('--subgraph', metavar='OBJ', help='Export only the objects within --depth hops of OBJ, in --formats, to <--export base or "subgraph">_<OBJ>')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help='After the first crawl, keep polling and serve lineage over HTTP on this address')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between polls with --serve (default: 60)')
+    parser.add_argument('--store', metavar='DB', help='SQLite lineage history: append each crawl as a snapshot; without a source, answer --since/--history/--upstream/--downstream/--impact from it')
+    parser.add_argument('--since', metavar='DATE', help='List edges added/removed since DATE (ISO format; requires --store)')
+    parser.add_argument('--history', action='store_true', help='List the snapshots in --store')
+    parser.add_argument('--profile', metavar='FILE', help='Write per-phase wall/CPU time, HTTP latency percentiles, bytes received and per-query parse times to this JSON file')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Detail of progress logging (default: INFO; DEBUG shows every request and parsed dependency)')
+    parser.add_argument('-v', '--verbose', action='store_const', const='DEBUG', dest='log_level', help='Same as --log-level DEBUG')
+    parser.add_argument('--diff-report', help='Write added/removed edges since the cached snapshot to this JSON file (requires --incremental)')
     
     args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level), format='%(message)s', stream=sys.stdout)
+    if args.profile:
+        PROFILER.enable()
+    sources = sum(1 for source in (args.url, args.replay, args.from_sql, args.clusters) if source)
+    store_only = sources == 0 and bool(args.store)
+    if store_only and not (args.since or args.history or args.upstream or args.downstream or args.impact):
+        parser.error('--store without a source needs --since, --history, --upstream, --downstream or --impact')
+    if not store_only and sources != 1:
+        parser.error('exactly one of --url, --replay, --from-sql or --clusters is required')
+    if args.store and sqlite3 is None:
+        parser.error('--store needs Python built with the sqlite3 module')
+    if (args.since or args.history) and not args.store:
+        parser.error('--since and --history require --store')
+    if args.since:
+        try:
+            args.since = datetime.fromisoformat(args.since).isoformat()
+        except ValueError:
+            parser.error(f"--since expects an ISO date or timestamp, got {args.since!r}")
+    if args.clusters and (args.record or args.incremental or args.export_sql or args.debug_queries):
+        parser.error('--clusters cannot be combined with --record, --incremental, --export-sql or --debug-queries')
+    if args.record and not args.url:
+        parser.error('--record requires --url')
+    if args.export_sql and not args.deep:
+        parser.error('--export-sql requires --deep')
+    export_formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown_formats = [fmt for fmt in export_formats if fmt not in EXPORT_WRITERS]
+    if unknown_formats:
+        parser.error(f"unknown export format(s): {', '.join(unknown_formats)}")
+    if args.serve and not args.url:
+        parser.error('--serve requires --url')
+    if args.serve and (args.record or args.debug_queries):
+        parser.error('--serve cannot be combined with --record or --debug-queries')
+    if args.drop_field and '.' not in args.drop_field:
+        parser.error('--drop-field expects OBJ.COLUMN')
+    if args.diff_report and not args.incremental:
+        parser.error('--diff-report requires --incremental')
+    if args.hedge is not None and not 0 < args.hedge < 100:
+        parser.error('--hedge expects a percentile between 0 and 100')
+    request_policy = {'retries': args.retries, 'min_timeout': args.min_timeout, 'hedge_percentile': args.hedge,
+                      'breaker_threshold': args.breaker_threshold, 'breaker_reset': args.breaker_reset}
+    
+    if store_only:
+        store = LineageStore(args.store)
+        run_store_queries(store, args)
+        store.close()
+        return
+    
+    clusters = None
+    if args.clusters:
+        try:
+            clusters = load_cluster_configs(args.clusters, {
+                'username': args.username, 'password': args.password, 'api_key': args.api_key,
+                'api_secret': args.api_secret, 'no_ssl_verify': args.no_ssl_verify, 'ca_cert': args.ca_cert,
+                'max_concurrency': args.workers, 'rate_limit': args.rate_limit})
+        except (OSError, ValueError) as e:
+            parser.error(f"--clusters: {e}")
+    
+    transport = ReplayTransport(args.replay) if args.replay else None
+    if transport:
+        log.info("Replaying %d responses recorded at %s from %s",
+                 len(transport.responses), transport.recorded_at, args.replay)
     
     ksql_client = KsqlDBLineageEnhanced(
-        ksql_url=args.url,
+        ksql_url=args.url or (transport.ksql_url[:-len('/ksql')] if transport else 'federated' if clusters else 'offline'),
         username=args.username,
         password=args.password,
         api_key=args.api_key, 
         api_secret=args.api_secret,
         verify_ssl=not args.no_ssl_verify,
-        ca_cert=args.ca_cert
+        ca_cert=args.ca_cert,
+        pool_size=max(args.pool_size, args.workers) if args.deep else args.pool_size,
+        connect_timeout=args.connect_timeout,
+        timeout=args.timeout,
+        transport=transport,
+        parse_workers=args.parse_workers,
+        request_policy=request_policy
     )
+    if args.record:
+        ksql_client.transport = RecordingTransport(ksql_client.transport, args.record, ksql_client.ksql_url)
     
     if args.debug_queries:
         ksql_client.debug_queries_and_sql()
     else:
-        lineage = ksql_client.build_comprehensive_lineage()
-        ksql_client.print_relationship_report(lineage)
+        cache = LineageSnapshotCache.load(args.cache_file) if args.incremental else None
+        if args.from_sql:
+            lineage = ksql_client.build_lineage_from_sql(args.from_sql, cache=cache)
+        elif clusters:
+            lineage = build_federated_lineage(clusters, deep=args.deep, stream=not args.no_stream,
+                                              connect_timeout=args.connect_timeout, timeout=args.timeout,
+                                              request_policy=request_policy)
+            ksql_client._summarize_lineage(lineage)
+        else:
+            lineage = ksql_client.build_comprehensive_lineage(deep=args.deep, workers=args.workers,
+                                                              rate_limit=args.rate_limit, cache=cache,
+                                                              stream=not args.no_stream)
+        with PROFILER.span('phase:report'):
+            ksql_client.print_relationship_report(lineage)
         
-        if args.export_csv:
-            ksql_client.export_relationship_csv(lineage, args.export_csv)
+        if cache:
+            diff = cache.diff(lineage)
+            log.info("\nChanges since %s: +%d/-%d edges, %d new, %d changed, %d terminated queries",
+                     diff['previous_snapshot'] or 'empty snapshot', len(diff['added_edges']),
+                     len(diff['removed_edges']), len(diff['added_queries']), len(diff['changed_queries']),
+                     len(diff['terminated_queries']))
+            if args.diff_report:
+                with open(args.diff_report, 'w') as f:
+                    json.dump(diff, f, indent=2)
+                log.info("✓ Diff report written to: %s", args.diff_report)
+            cache.update(lineage)
+            cache.save()
+        
+        store = LineageStore(args.store) if args.store else None
+        if store:
+            with PROFILER.span('phase:store'):
+                store.save_snapshot(lineage)
+            if args.history:
+                store.print_history()
+            if args.since:
+                store.print_changes_since(args.since)
+        
+        graph = None
+        if args.upstream or args.downstream or args.impact or args.runtime_stats or args.topology or args.subgraph:
+            graph = LineageGraph(lineage)
+        if args.upstream or args.downstream or args.impact:
+            with PROFILER.span('phase:graph_queries'):
+                run_graph_queries(graph, args)
+        
+        if args.runtime_stats:
+            if args.url or args.replay:
+                with PROFILER.span('phase:runtime_stats'):
+                    ksql_client.collect_runtime_stats(lineage, workers=args.workers,
+                                                      limiter=RateLimiter(args.rate_limit))
+            RuntimeProfile(lineage, graph).attach().print_report(args.top)
+        
+        topology = None
+        if args.topology or args.subgraph:
+            started = time.perf_counter()
+            with PROFILER.span('phase:topology'):
+                topology = LineageTopology(graph)
+            if args.topology:
+                topology.print_report(args.top, (time.perf_counter() - started) * 1000)
+        
+        columns = None
+        if args.column_lineage or args.drop_field:
+            started = time.perf_counter()
+            describe = ksql_client.describe_source if args.url or args.replay else None
+            with PROFILER.span('phase:column_lineage'):
+                columns = ColumnLineage(lineage, describe).build()
+            columns.print_summary((time.perf_counter() - started) * 1000)
+            if args.drop_field:
+                name, column = columns.resolve_field(args.drop_field)
+                started = time.perf_counter()
+                affected, broken = columns.blast_radius(name, column)
+                columns.print_blast_radius(name, column, affected, broken, (time.perf_counter() - started) * 1000)
+        
+        with PROFILER.span('phase:export'):
+            if args.export_csv:
+                ksql_client.export_relationship_csv(lineage, args.export_csv)
+            if args.export:
+                if not args.no_inventory:
+                    ksql_client.export_inventory_csv(lineage, args.export)
+                ksql_client.export_relationships(lineage, args.export, export_formats)
+                if columns:
+                    ksql_client.export_column_lineage_csv(columns, args.export)
+            if args.export_sql:
+                ksql_client.export_definitions_sql(lineage, args.export_sql)
+            if args.export_report:
+                ksql_client.export_lineage_report(lineage, args.export_report)
+            if args.topology and args.export:
+                topology.export_csv(args.export)
+            if args.subgraph:
+                name = graph.resolve_name(args.subgraph)
+                names = topology.subgraph(name, 2 if args.depth is None else args.depth)
+                written = export_subgraph(lineage, names, f"{args.export or 'subgraph'}_{name}", export_formats)
+                log.info("✓ Subgraph of %s: %d objects", name, len(names))
+                for filename, count in written.values():
+                    log.info("  %s (%s rows)", filename, count)
+        if args.profile:
+            PROFILER.write(args.profile)
+        
+        if args.serve:
+            host, _, port = args.serve.rpartition(':')
+            if not cache:
+                cache = LineageSnapshotCache(args.cache_file)
+                cache.update(lineage)
+            watcher = LineageWatcher(ksql_client, lineage, cache, interval=args.interval, deep=args.deep,
+                                     workers=args.workers, rate_limit=args.rate_limit, stream=not args.no_stream,
+                                     persist=args.incremental, store=store)
+            watcher.serve(host or '127.0.0.1', int(port))
+        if store:
+            store.close()
+    
+    ksql_client.transport.close()
 
 if __name__ == "__main__":
     main()